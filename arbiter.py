@@ -0,0 +1,111 @@
+import threading
+
+# Logging
+import logging as l
+
+from buzzers import BuzzerPress
+
+
+class BuzzerArbiter:
+    '''Decides which team answers, based on timestamps of presses.
+
+    Presses can be submitted from any thread and in any order. Contest starts
+    with earliest press, every press that arrived within tie window after it
+    takes part in it. Ties are broken in favour of the team that waited longest
+    for its last answer, then by timestamp and index, so result depends only
+    on presses and never on order in which they were delivered.
+    '''
+
+    def __init__(self, number_teams: int, tie_window_us: int = 0, lockout: bool = True) -> None:
+        self.lock: threading.Lock = threading.Lock()
+        self.number_teams: int = number_teams
+        self.tie_window_ns: int = tie_window_us * 1000
+        self.lockout: bool = lockout  # Whether team answering incorrectly is locked out.
+
+        self.is_open: bool = True  # Whether presses are accepted.
+        self.locked_out: set = set()  # Teams that can't answer until next round.
+        # Earliest press of each team in current contest.
+        self.presses: dict = {}
+        self.first_ns: int = None  # Timestamp of earliest press in current contest.
+        self.winner: BuzzerPress = None
+        self.runners_up: list = []  # Other presses of last contest, ordered by time.
+        # Number of contest in which team answered last, used for breaking ties.
+        self.last_answers: dict = {}
+        self.contests: int = 0
+
+    def new_round(self) -> None:
+        '''Clears lockouts and opens new contest, called when new song starts.'''
+        with self.lock:
+            self.locked_out.clear()
+            self._open()
+
+    def submit(self, press: BuzzerPress) -> bool:
+        '''Adds press to current contest, returns whether it was accepted.'''
+        team: int = press.team
+        if not 0 <= team < self.number_teams:
+            l.warning(f'Ignoring press of unused team {team} from {press.source}.')
+            return False
+        with self.lock:
+            if team in self.locked_out:
+                return False
+            if not self.is_open:
+                # Presses after decision are only recorded.
+                if self.winner and team != self.winner.team and \
+                        all(p.team != team for p in self.runners_up):
+                    self.runners_up.append(press)
+                return False
+            earlier: BuzzerPress = self.presses.get(team)
+            if earlier and earlier.timestamp_ns <= press.timestamp_ns:
+                return False
+            self.presses[team] = press
+            if self.first_ns is None or press.timestamp_ns < self.first_ns:
+                self.first_ns = press.timestamp_ns
+            return True
+
+    def deadline_ns(self) -> int:
+        '''Returns moment when current contest can be resolved, None if nobody pressed.'''
+        with self.lock:
+            if not self.is_open or self.first_ns is None:
+                return None
+            return self.first_ns + self.tie_window_ns
+
+    def resolve(self, now_ns: int) -> BuzzerPress:
+        '''Chooses winner once tie window is over, otherwise returns None.'''
+        with self.lock:
+            if not self.is_open or self.first_ns is None:
+                return None
+            if now_ns < self.first_ns + self.tie_window_ns:
+                return None
+
+            presses: list = sorted(self.presses.values(),
+                                   key=lambda p: (p.timestamp_ns, p.team))
+            end: int = self.first_ns + self.tie_window_ns
+            tied: list = [p for p in presses if p.timestamp_ns <= end]
+            winner: BuzzerPress = min(tied, key=lambda p: (
+                self.last_answers.get(p.team, -1), p.timestamp_ns, p.team))
+
+            self.contests += 1
+            self.last_answers[winner.team] = self.contests
+            self.winner = winner
+            self.runners_up = [p for p in presses if p is not winner]
+            self.is_open = False
+
+        if len(tied) > 1:
+            l.info(f'Tie between teams {[p.team for p in tied]} won by team {winner.team}.')
+        if self.runners_up:
+            l.info(f'Runners-up: {[p.team for p in self.runners_up]}.')
+        return winner
+
+    def verdict(self, correct: bool) -> None:
+        '''Applies answer of winning team and opens next contest.'''
+        with self.lock:
+            if self.winner and not correct and self.lockout:
+                self.locked_out.add(self.winner.team)
+            self._open()
+
+    def _open(self) -> None:
+        self.is_open = True
+        self.presses = {}
+        self.first_ns = None
+        self.winner = None
+        self.runners_up = []
@@ -0,0 +1,240 @@
+import io
+import wave
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Logging
+import logging as l
+
+from typing import Callable
+
+# Audio playback, decoding and bitrate check
+import numpy as np
+from pygame import mixer
+from mutagen import mp3
+
+from instrumentation import instruments, timed
+
+DEFAULT_FREQUENCY = 44100
+# Output format, signed 16 bit stereo.
+OUTPUT_SIZE = -16
+OUTPUT_CHANNELS = 2
+
+# Types of samples stored in WAV files with given sample width.
+WAV_TYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+def read_frequency(song: dict) -> int:
+    '''Returns sample rate of the song.'''
+    if song['extension'] == 'mp3':
+        return mp3.MP3(song['path']).info.sample_rate
+    if song['extension'] == 'wav':
+        with wave.open(song['path']) as file:
+            return file.getframerate()
+    return DEFAULT_FREQUENCY
+
+
+def resample(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    '''Resamples array of shape (frames, channels) using linear interpolation.'''
+    if source_rate == target_rate or len(samples) == 0:
+        return samples
+    frames: int = len(samples)
+    count: int = frames * target_rate // source_rate
+    positions: np.ndarray = np.arange(count) * (source_rate / target_rate)
+    left: np.ndarray = positions.astype(np.intp)
+    right: np.ndarray = np.minimum(left + 1, frames - 1)
+    fraction: np.ndarray = (positions - left)[:, np.newaxis].astype(samples.dtype)
+    return samples[left] + (samples[right] - samples[left]) * fraction
+
+
+def read_wav(data: io.BytesIO, max_seconds: float = None, start: float = 0) -> tuple:
+    '''Reads WAV file into float array of shape (frames, channels), returns it with sample rate.'''
+    with wave.open(data) as file:
+        rate: int = file.getframerate()
+        width: int = file.getsampwidth()
+        channels: int = file.getnchannels()
+        first: int = min(int(start * rate), file.getnframes())
+        file.setpos(first)
+        frames: int = file.getnframes() - first
+        if max_seconds is not None:
+            frames = min(frames, int(max_seconds * rate))
+        raw: bytes = file.readframes(frames)
+
+    if width == 3:
+        # 24 bit samples are padded to 32 bits.
+        packed: np.ndarray = np.frombuffer(raw, np.uint8).reshape(-1, 3)
+        padded: np.ndarray = np.zeros((len(packed), 4), np.uint8)
+        padded[:, 1:] = packed
+        samples: np.ndarray = padded.view(np.int32).ravel()
+        width = 4
+    else:
+        samples = np.frombuffer(raw, WAV_TYPES[width])
+
+    samples = samples.astype(np.float32)
+    if width == 1:
+        samples = (samples - 128) / 128
+    else:
+        samples /= 2 ** (8 * width - 1)
+    return samples.reshape(-1, channels), rate
+
+
+def to_output(samples: np.ndarray, rate: int, frequency: int) -> bytes:
+    '''Converts float samples to raw buffer in output format of the mixer.'''
+    samples = resample(samples, rate, frequency)
+    if samples.shape[1] == 1:
+        samples = np.repeat(samples, OUTPUT_CHANNELS, axis=1)
+    elif samples.shape[1] > OUTPUT_CHANNELS:
+        samples = samples[:, :OUTPUT_CHANNELS]
+    np.clip(samples, -1, 1, out=samples)
+    return (samples * 32767).astype(np.int16).tobytes()
+
+
+@timed('song load')
+def prepare_song(song: dict, max_seconds: float = None) -> dict:
+    '''Reads and decodes the song in output format, so it starts without any delay.
+
+    Sound starts at second given by 'start' of the song, so playing it
+    needs no seeking.
+    '''
+    frequency: int = mixer.get_init()[0]
+    start: float = song.get('start', 0)
+    prepared: dict = dict(song)
+    with open(song['path'], 'rb') as file:
+        data: io.BytesIO = io.BytesIO(file.read())
+
+    if song['extension'] == 'wav':
+        samples, rate = read_wav(data, max_seconds, start)
+        prepared['frequency'] = rate
+        prepared['sound'] = mixer.Sound(buffer=to_output(samples, rate, frequency))
+    else:
+        # MP3 is decoded and converted to output format by SDL on load,
+        # so it doesn't go through resample like WAV.
+        prepared['frequency'] = song.get('frequency') or read_frequency(song)
+        sound: mixer.Sound = mixer.Sound(file=data)
+        if start or max_seconds:
+            # SDL can't start or stop decoding in the middle, so decoded audio is cut
+            # and only the played part of it is kept while the song waits.
+            frame_size: int = abs(OUTPUT_SIZE) // 8 * OUTPUT_CHANNELS
+            first: int = int(start * frequency) * frame_size
+            last: int = first + int(max_seconds * frequency) * frame_size if max_seconds else None
+            sound = mixer.Sound(buffer=sound.get_raw()[first:last])
+        prepared['sound'] = sound
+    return prepared
+
+
+class ChannelSink:
+    '''Songs of one game played on its own channel of shared mixer.'''
+
+    def __init__(self, channel: mixer.Channel, buffer_ms: float) -> None:
+        self.channel: mixer.Channel = channel
+        # Time it takes to play one buffer.
+        self.buffer_ms: float = buffer_ms
+
+    def play(self, sound: mixer.Sound) -> None:
+        self.channel.set_volume(1)
+        self.channel.play(sound)
+
+    def silence(self) -> None:
+        '''Mutes the song at next buffer, can be called from any thread.'''
+        self.channel.set_volume(0)
+
+    def pause(self) -> None:
+        self.channel.pause()
+
+    def unpause(self) -> None:
+        self.channel.set_volume(1)
+        self.channel.unpause()
+
+    def stop(self) -> None:
+        self.channel.stop()
+
+
+class AudioOutput(ChannelSink):
+    '''Mixer opened once at fixed rate, songs are played on its first reserved channel.
+
+    More channels are reserved when several games share the mixer, each
+    of them plays on its own sink.
+    '''
+
+    def __init__(self, frequency: int = DEFAULT_FREQUENCY, buffer: int = 512,
+                 reserved: int = 1) -> None:
+        with instruments.measure('mixer init'):
+            mixer.pre_init(frequency=frequency, size=OUTPUT_SIZE,
+                           channels=OUTPUT_CHANNELS, buffer=buffer)
+            mixer.init()
+        self.frequency: int = mixer.get_init()[0]
+        self.buffer: int = buffer
+        if reserved > mixer.get_num_channels():
+            mixer.set_num_channels(reserved)
+        mixer.set_reserved(reserved)
+        super().__init__(mixer.Channel(0), buffer / self.frequency * 1000)
+        l.info(f'Opened audio output at {self.frequency} Hz.')
+
+    def sink(self, index: int) -> ChannelSink:
+        '''Returns sink playing on reserved channel with given index.'''
+        return ChannelSink(mixer.Channel(index), self.buffer_ms)
+
+
+class SongPrefetcher:
+    '''Prepares next song in background while current one is playing.'''
+
+    def __init__(self, next_song: Callable[[], dict]) -> None:
+        # Returns next song to play or None if there are no more songs.
+        self.next_song: Callable[[], dict] = next_song
+        # Only this part of the song is decoded, when it's possible.
+        self.max_seconds: float = None
+        # Returns second at which the song should start for given length of snippet.
+        self.snippet_start: Callable[[dict, float], float] = None
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='SongPrefetcher')
+        self.future: Future = None
+        self.song: dict = None  # Song being prepared, as returned by next_song.
+
+    def prefetch(self) -> None:
+        '''Starts preparing next song unless it is already being prepared.'''
+        if self.future is None:
+            song: dict = self.next_song()
+            if song is not None:
+                self.song = song
+                self.future = self.executor.submit(self.prepare, song)
+
+    def prepare(self, song: dict) -> dict:
+        if self.snippet_start and self.max_seconds:
+            song = dict(song, start=self.snippet_start(song, self.max_seconds))
+        return prepare_song(song, self.max_seconds)
+
+    def take(self) -> dict:
+        '''Returns prepared song, waiting for it if needed, and starts preparing next one.'''
+        self.prefetch()
+        while self.future is not None:
+            future: Future = self.future
+            self.future = None
+            try:
+                song: dict = future.result()
+            except Exception as e:
+                # Broken file is skipped like it was never loaded.
+                l.error(f'Preparing song failed: {e}')
+                self.prefetch()
+                continue
+            self.prefetch()
+            return song
+        return None
+
+    def refresh(self) -> None:
+        '''Prepares the same song again, used when it should be cut differently.'''
+        # Song was already taken from the queue, dropping it would skip it for good.
+        if self.future is not None:
+            self.future.cancel()
+            self.future = self.executor.submit(self.prepare, self.song)
+        else:
+            self.prefetch()
+
+    def reset(self) -> None:
+        '''Drops prepared song, used when list of songs changes.'''
+        if self.future is not None:
+            self.future.cancel()
+            self.future = None
+            self.song = None
+
+    def shutdown(self) -> None:
+        self.reset()
+        self.executor.shutdown(wait=False)
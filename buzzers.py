@@ -0,0 +1,318 @@
+import os
+import time
+import selectors
+import threading
+from collections import deque
+
+# Logging
+import logging as l
+
+from typing import Callable, NamedTuple
+
+# Serial connection handling
+import serial
+
+from instrumentation import timed
+
+# Serial line settings used by Arduino.
+BAUDRATE = 115200
+# Start bit, 8 data bits, parity bit and stop bit.
+BITS_PER_BYTE = 11
+BYTE_TIME_NS = BITS_PER_BYTE * 1_000_000_000 // BAUDRATE
+
+# Boards with id send every press as '#<board>,<sequence>,<team>\n',
+# single ASCII digits outside of frames are presses of boards without id.
+FRAME_START = ord('#')
+FRAME_END = ord('\n')
+MAX_FRAME = 32
+# Sequence numbers of presses wrap around at this value.
+SEQUENCE_MODULUS = 1 << 16
+# Frames repeated by radio or USB may come late, so this many last numbers are remembered.
+RECENT_SEQUENCES = 64
+# Board that restarted without its port being reopened numbers presses again from below this.
+RESTART_SEQUENCES = 16
+
+
+class BuzzerPress(NamedTuple):
+    '''Single press of a buzzer.'''
+    team: int  # Index of team that pressed the button.
+    timestamp_ns: int  # Moment of arrival measured with time.monotonic_ns().
+    source: str  # Where the press came from, e.g. serial port or 'keyboard'.
+
+
+class PortParser:
+    '''Splits bytes read from one port into presses, frames may span reads.'''
+
+    def __init__(self, port: str) -> None:
+        self.port: str = port
+        self.frame: bytearray = None  # Incomplete frame, None outside of frame.
+
+    def parse(self, data: bytes, timestamp_ns: int) -> list:
+        '''Returns team, arrival time, board and sequence number of every press.
+
+        Bytes read together arrived one after another, so each press is
+        stamped with estimated arrival time of its last byte based on line speed.
+        '''
+        presses: list = []
+        last: int = len(data) - 1
+        for i, byte in enumerate(data):
+            arrival: int = timestamp_ns - (last - i) * BYTE_TIME_NS
+            if self.frame is not None:
+                if byte == FRAME_END:
+                    press: tuple = self.decode(bytes(self.frame), arrival)
+                    if press:
+                        presses.append(press)
+                    self.frame = None
+                elif len(self.frame) >= MAX_FRAME:
+                    l.warning(f'Dropping too long frame from {self.port}.')
+                    self.frame = None
+                else:
+                    self.frame.append(byte)
+            elif byte == FRAME_START:
+                self.frame = bytearray()
+            # Arduino without id sends index of team as ASCII digit, anything else is ignored.
+            elif 0x30 <= byte <= 0x39:
+                presses.append((byte - 0x30, arrival, None, None))
+        return presses
+
+    def decode(self, frame: bytes, arrival: int) -> tuple:
+        try:
+            board, sequence, team = (int(field) for field in frame.split(b','))
+        except ValueError:
+            l.warning(f'Dropping broken frame {frame!r} from {self.port}.')
+            return None
+        return team, arrival, board, sequence
+
+
+class SerialMultiplexer(threading.Thread):
+    '''Reads presses from any number of serial ports in single thread.
+
+    Thread sleeps in selector until any port has data, so ports cost nothing
+    while idle and the GUI never polls them. Presses read during one wake-up
+    are passed to callback ordered by arrival, stream of presses is never out
+    of order. Sequence numbers of boards with id reveal lost and repeated
+    presses, repeated ones are dropped. Callback is called from reader thread.
+    '''
+
+    def __init__(self, callback: Callable[[BuzzerPress], None]) -> None:
+        super().__init__(name='SerialMultiplexer', daemon=True)
+        self.callback: Callable[[BuzzerPress], None] = callback
+        self.selector: selectors.BaseSelector = selectors.DefaultSelector()
+        # Pipe waking the thread when ports are added or removed.
+        self.wake_read, self.wake_write = os.pipe()
+        self.selector.register(self.wake_read, selectors.EVENT_READ)
+        self.lock: threading.Lock = threading.Lock()
+        self.commands: list = []  # Changes of watched ports, applied by reader thread.
+        self.ports: dict = {}  # Connection and parser of each open port.
+        self.readers: dict = {}  # Threads of ports that can't be watched by selector.
+        self.stopped: bool = False
+        self.emit_lock: threading.Lock = threading.Lock()
+
+        self.sequences: dict = {}  # Recent sequence numbers of each board, last one at the end.
+        self.boards: dict = {}  # Port on which each board was seen last.
+        self.lost: int = 0  # Number of presses missing in sequences.
+        self.duplicates: int = 0  # Number of dropped repeated presses.
+        self.last_ns: int = 0  # Timestamp of last passed press.
+
+    @property
+    def open_ports(self) -> list:
+        with self.lock:
+            return list(self.ports)
+
+    def open(self, port: str) -> None:
+        '''Opens port and starts reading from it, raises SerialException on failure.'''
+        connection: serial.Serial = serial.Serial(
+            port, BAUDRATE, parity=serial.PARITY_EVEN, stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS, timeout=0)
+        with self.lock:
+            self.ports[port] = (connection, PortParser(port))
+            # Arduino restarts when its port is opened, so it numbers presses again.
+            self.forget_boards(port)
+        try:
+            connection.fileno()
+        except (AttributeError, OSError):
+            # Selector can't watch ports on Windows, they get their own thread.
+            connection.timeout = 0.1
+            reader: SerialReader = SerialReader(connection, self.received)
+            self.readers[port] = reader
+            reader.start()
+        else:
+            self.command(('register', port, connection))
+        l.info(f'Reading presses from {port}.')
+
+    def close(self, port: str) -> None:
+        with self.lock:
+            connection, _ = self.ports.pop(port, (None, None))
+            self.forget_boards(port)
+        if connection is None:
+            return
+        reader: SerialReader = self.readers.pop(port, None)
+        if reader:
+            reader.stop()
+            connection.close()
+        else:
+            # Port is closed by reader thread once it's no longer watched.
+            self.command(('unregister', port, connection))
+
+    def forget_boards(self, port: str) -> None:
+        '''Forgets sequence numbers of boards seen on the port, called with lock held.'''
+        for board in [board for board, seen in self.boards.items() if seen == port]:
+            del self.boards[board]
+            self.sequences.pop(board, None)
+
+    def close_all(self) -> None:
+        for port in self.open_ports:
+            self.close(port)
+
+    def stop(self) -> None:
+        self.close_all()
+        self.stopped = True
+        if self.is_alive():
+            self.command(None)
+            self.join(1)
+        else:
+            self.selector.close()
+            os.close(self.wake_read)
+            os.close(self.wake_write)
+
+    def command(self, command: tuple) -> None:
+        with self.lock:
+            self.commands.append(command)
+        os.write(self.wake_write, b'\0')
+        if not self.is_alive() and not self.stopped:
+            self.start()
+
+    def apply_commands(self) -> None:
+        os.read(self.wake_read, 4096)
+        with self.lock:
+            commands: list = self.commands
+            self.commands = []
+        for command in commands:
+            if command is None:
+                continue
+            action, port, connection = command
+            if action == 'register':
+                self.selector.register(connection.fileno(), selectors.EVENT_READ, port)
+            else:
+                self.selector.unregister(connection.fileno())
+                connection.close()
+
+    def run(self) -> None:
+        while not self.stopped:
+            events: list = self.selector.select()
+            timestamp_ns: int = time.monotonic_ns()
+            presses: list = []
+            for key, _ in events:
+                if key.data is None:
+                    self.apply_commands()
+                    continue
+                with self.lock:
+                    connection, parser = self.ports.get(key.data, (None, None))
+                if connection is None:
+                    continue
+                try:
+                    data: bytes = connection.read(connection.in_waiting or 1)
+                except (serial.SerialException, OSError) as e:
+                    l.error(f'Reading from {key.data} failed: {e}')
+                    self.close(key.data)
+                    continue
+                presses += self.accept(parser, data, timestamp_ns)
+            self.emit(presses)
+        self.selector.close()
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+
+    def received(self, port: str, data: bytes, timestamp_ns: int) -> None:
+        '''Handles data read by thread of single port.'''
+        with self.lock:
+            _, parser = self.ports.get(port, (None, None))
+        if parser is not None:
+            self.emit(self.accept(parser, data, timestamp_ns))
+
+    @timed('serial read')
+    def accept(self, parser: PortParser, data: bytes, timestamp_ns: int) -> list:
+        '''Parses data of the port, returns presses that aren't repeated.'''
+        presses: list = []
+        for team, arrival, board, sequence in parser.parse(data, timestamp_ns):
+            if board is None:
+                presses.append(BuzzerPress(team, arrival, parser.port))
+            elif self.check_sequence(parser.port, board, sequence):
+                presses.append(BuzzerPress(team, arrival, f'{parser.port} board {board}'))
+        return presses
+
+    def check_sequence(self, port: str, board: int, sequence: int) -> bool:
+        '''Returns whether press is new, counting lost and repeated presses.'''
+        with self.lock:
+            if self.boards.get(board, port) != port:
+                l.warning(f'Board {board} moved from {self.boards[board]} to {port}.')
+            self.boards[board] = port
+            recent: deque = self.sequences.get(board)
+            if recent is None:
+                recent = self.sequences[board] = deque(maxlen=RECENT_SEQUENCES)
+            elif sequence in recent:
+                self.duplicates += 1
+                l.warning(f'Dropping repeated press {sequence} of board {board}.')
+                return False
+            else:
+                gap: int = (sequence - recent[-1]) % SEQUENCE_MODULUS
+                if 1 < gap <= SEQUENCE_MODULUS // 2:
+                    self.lost += gap - 1
+                    l.warning(f'Lost {gap - 1} presses of board {board} before {sequence}.')
+                elif gap > SEQUENCE_MODULUS // 2 and sequence < min(RESTART_SEQUENCES, min(recent)):
+                    # Numbers went back to the start, board was reset without reopening its port.
+                    l.info(f'Board {board} restarted.')
+                    recent.clear()
+                elif gap > SEQUENCE_MODULUS // 2:
+                    # Repeated frame older than remembered numbers.
+                    self.duplicates += 1
+                    l.warning(f'Dropping late press {sequence} of board {board}.')
+                    return False
+            recent.append(sequence)
+            return True
+
+    def emit(self, presses: list) -> None:
+        '''Passes presses to callback in order of arrival.'''
+        presses.sort(key=lambda press: press.timestamp_ns)
+        with self.emit_lock:
+            for press in presses:
+                # Estimated arrival can't precede press that was already passed.
+                if press.timestamp_ns < self.last_ns:
+                    press = press._replace(timestamp_ns=self.last_ns)
+                self.last_ns = press.timestamp_ns
+                self.callback(press)
+
+
+class SerialReader(threading.Thread):
+    '''Reads from single port in background thread, used where selector can't watch ports.
+
+    Thread blocks on serial port and drains whole input buffer at once, so
+    simultaneous presses are never queued behind the GUI. Data is passed to
+    callback with moment of its arrival, callback is called from reader thread.
+    '''
+
+    def __init__(self, connection: serial.Serial,
+                 callback: Callable[[str, bytes, int], None]) -> None:
+        super().__init__(name=f'SerialReader({connection.port})', daemon=True)
+        self.connection: serial.Serial = connection
+        self.callback: Callable[[str, bytes, int], None] = callback
+        self.stopped: threading.Event = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                # Blocks until at least one byte arrives or timeout passes.
+                data: bytes = self.connection.read(max(1, self.connection.in_waiting))
+            except (serial.SerialException, OSError, TypeError) as e:
+                if not self.stopped.is_set():
+                    l.error(f'Reading from {self.connection.port} failed: {e}')
+                break
+            if data:
+                self.callback(self.connection.port, data, time.monotonic_ns())
+
+    def stop(self) -> None:
+        '''Stops reading and waits for thread to finish.'''
+        self.stopped.set()
+        if hasattr(self.connection, 'cancel_read'):
+            self.connection.cancel_read()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(1)
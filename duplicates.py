@@ -0,0 +1,137 @@
+import numpy as np
+
+from features import ENVELOPE_RATE, FLOOR_DB, SPECTRUM_BANDS
+
+# Bits of fingerprint, each tells on which side of random hyperplane the spectrum lies.
+FINGERPRINT_BITS = 64
+PLANES = np.random.default_rng(2718).standard_normal((2 * SPECTRUM_BANDS, FINGERPRINT_BITS))
+# Fingerprint is split into bands, songs sharing any band are compared.
+LSH_BANDS = 4
+# Fingerprints of the same recording differ at most in this many bits,
+# so they always share a band.
+MAX_DISTANCE = 3
+# Spectra are centred on average song once there are this many of them.
+MIN_CENTRED = 64
+# Copies may start with different silence, envelopes are aligned up to this shift.
+MAX_SHIFT_SECONDS = 5
+# Correlation of aligned envelopes above which songs are the same recording.
+MIN_CORRELATION = 0.6
+# Only this range below the loudest frame is compared, encoding changes quiet parts.
+COMPARED_RANGE_DB = 30
+
+MASK = (1 << FINGERPRINT_BITS) - 1
+
+
+def simhash(spectra: np.ndarray) -> list:
+    '''Returns fingerprints of rows of the array, bits differ little for similar spectra.'''
+    bits: np.ndarray = np.packbits(spectra @ PLANES > 0, axis=1)
+    return [int.from_bytes(row.tobytes(), 'big') for row in bits]
+
+
+def bands(fingerprint: int) -> list:
+    '''Splits fingerprint into keys of LSH tables.'''
+    width: int = FINGERPRINT_BITS // LSH_BANDS
+    return [(fingerprint >> (band * width)) & ((1 << width) - 1) for band in range(LSH_BANDS)]
+
+
+def distance(first: int, second: int) -> int:
+    return ((first ^ second) & MASK).bit_count()
+
+
+def normalise(loudness: np.ndarray) -> np.ndarray:
+    '''Returns envelope with quiet parts levelled, with zero mean and unit variance.'''
+    floor: float = loudness.max() - COMPARED_RANGE_DB * 255 / -FLOOR_DB
+    levelled: np.ndarray = np.maximum(loudness.astype(np.float32), floor)
+    return (levelled - levelled.mean()) / (levelled.std() + 1e-12)
+
+
+def correlation(first: np.ndarray, second: np.ndarray) -> float:
+    '''Returns correlation of loudness envelopes at their best alignment.'''
+    shift: int = MAX_SHIFT_SECONDS * ENVELOPE_RATE
+    if abs(len(first) - len(second)) > 2 * shift or min(len(first), len(second)) <= shift:
+        return 0
+    first, second = normalise(first), normalise(second)
+    # All shifts at once, correlation is product of spectra.
+    size: int = len(first) + len(second)
+    products: np.ndarray = np.fft.irfft(np.fft.rfft(first, size) * np.conj(np.fft.rfft(second, size)), size)
+    shifts: np.ndarray = np.concatenate((products[:shift + 1], products[-shift:]))
+    return float(shifts.max()) / min(len(first), len(second))
+
+
+class DuplicateIndex:
+    '''Finds songs that are the same recording, e.g. rips in other formats.
+
+    Spectra are hashed into fingerprints kept in LSH tables, so only songs
+    with similar fingerprint are compared and finding duplicates stays fast
+    for any size of library. Spectra are centred on average song first,
+    otherwise features shared by all music would set most bits the same
+    way and fill few buckets. Candidates are confirmed by comparing
+    loudness envelopes.
+    '''
+
+    def __init__(self, loudness) -> None:
+        # Returns loudness envelope of the song with given hash.
+        self.loudness = loudness
+        self.spectra: dict = {}  # Spectrum of every added hash.
+        self.fingerprints: dict = {}
+        self.tables: list = [{} for _ in range(LSH_BANDS)]
+        self.centre: np.ndarray = 0
+        self.scale: np.ndarray = 1
+        self.centred: int = 0  # Number of songs when centre was computed.
+        self.comparisons: int = 0  # Number of compared envelopes.
+
+    def fingerprint(self, spectrum: np.ndarray) -> int:
+        return simhash(((spectrum - self.centre) / self.scale)[np.newaxis])[0]
+
+    def add(self, song_hash: str, spectrum: np.ndarray) -> str:
+        '''Returns hash of added song that is the same recording, adds the song if there isn't any.'''
+        fingerprint: int = self.fingerprint(spectrum)
+        original: str = self.find(song_hash, fingerprint)
+        if original is not None:
+            return original
+        self.spectra[song_hash] = spectrum
+        if len(self.spectra) >= max(MIN_CENTRED, 2 * self.centred):
+            # Repeated as library doubles, so it costs constant time per song on average.
+            self.recentre()
+        else:
+            self.insert(song_hash, fingerprint)
+        return None
+
+    def find(self, song_hash: str, fingerprint: int) -> str:
+        checked: set = set()
+        for table, key in zip(self.tables, bands(fingerprint)):
+            for candidate in table.get(key, ()):
+                if candidate in checked or candidate == song_hash:
+                    continue
+                checked.add(candidate)
+                if distance(fingerprint, self.fingerprints[candidate]) > MAX_DISTANCE:
+                    continue
+                self.comparisons += 1
+                if correlation(self.loudness(song_hash), self.loudness(candidate)) >= MIN_CORRELATION:
+                    return candidate
+        return None
+
+    def insert(self, song_hash: str, fingerprint: int) -> None:
+        self.fingerprints[song_hash] = fingerprint
+        for table, key in zip(self.tables, bands(fingerprint)):
+            table.setdefault(key, []).append(song_hash)
+
+    def recentre(self) -> None:
+        '''Centres spectra on their average and fingerprints all songs again.'''
+        hashes: list = list(self.spectra)
+        spectra: np.ndarray = np.stack([self.spectra[song_hash] for song_hash in hashes])
+        self.centre = spectra.mean(axis=0)
+        self.scale = spectra.std(axis=0) + 1e-6
+        self.centred = len(hashes)
+        self.fingerprints.clear()
+        for table in self.tables:
+            table.clear()
+        for song_hash, fingerprint in zip(hashes, simhash((spectra - self.centre) / self.scale)):
+            self.insert(song_hash, fingerprint)
+
+    def clear(self) -> None:
+        self.spectra.clear()
+        self.fingerprints.clear()
+        for table in self.tables:
+            table.clear()
+        self.centre, self.scale, self.centred = 0, 1, 0
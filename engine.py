@@ -0,0 +1,288 @@
+import time
+
+# Logging
+import logging as l
+
+from typing import TYPE_CHECKING, Callable, NamedTuple
+
+from buzzers import BuzzerPress
+from arbiter import BuzzerArbiter
+from instrumentation import instruments
+
+if TYPE_CHECKING:
+    from audio import ChannelSink
+
+# Playback states
+S_PLAYING = 0
+S_PAUSED = 1
+S_STOPPED = 2
+
+# Kinds of game events
+SONG_STARTED = 'song_started'
+PAUSED = 'paused'
+RESUMED = 'resumed'
+STOPPED = 'stopped'
+TEAM_GUESSING = 'team_guessing'
+SCORED = 'scored'
+NO_SONGS = 'no_songs'
+NEW_GAME = 'new_game'
+
+
+class GameEvent(NamedTuple):
+    '''Change of game state passed to observers.'''
+    kind: str
+    team: int = None  # Team that is guessing or scored.
+    song: dict = None  # Song that started.
+    points: int = 0  # Points added to score of the team.
+    score: int = None  # New score of the team.
+    press: BuzzerPress = None  # Press that won arbitration.
+    correct: bool = None  # Whether scored answer was correct.
+
+
+class PlaybackClock:
+    '''Measures position of the song using monotonic clock instead of counting timer ticks.'''
+
+    def __init__(self, time_ns: Callable[[], int] = time.monotonic_ns) -> None:
+        self.time_ns: Callable[[], int] = time_ns
+        self.elapsed_ns: int = 0  # Time played before last pause.
+        self.started_ns: int = None  # Moment of last start or resume, None when paused.
+
+    def start(self) -> None:
+        self.elapsed_ns = 0
+        self.started_ns = self.time_ns()
+
+    def pause(self) -> None:
+        if self.started_ns is not None:
+            self.elapsed_ns += self.time_ns() - self.started_ns
+            self.started_ns = None
+
+    def resume(self) -> None:
+        if self.started_ns is None:
+            self.started_ns = self.time_ns()
+
+    def millis(self) -> int:
+        '''Returns position of the song in milliseconds.'''
+        elapsed: int = self.elapsed_ns
+        if self.started_ns is not None:
+            elapsed += self.time_ns() - self.started_ns
+        return elapsed // 1_000_000
+
+
+class VirtualClock:
+    '''Clock moved forward only by its owner, used instead of real time by tests and tools.'''
+
+    def __init__(self) -> None:
+        self.now: int = 0
+
+    def __call__(self) -> int:
+        return self.now
+
+    def advance(self, ms: float) -> None:
+        self.now += int(ms * 1_000_000)
+
+
+class Silencer:
+    '''Silences the song right after first press and measures how long it took.
+
+    Contest is resolved only after tie window, while audience shouldn't
+    hear any more of the song. Accepted press always ends in pause, so
+    the song is paused by engine later. Local audio is silent once its
+    buffer is played, Spotify reports silence once the player paused.
+    '''
+
+    def __init__(self, time_ns: Callable[[], int] = time.monotonic_ns) -> None:
+        self.time_ns: Callable[[], int] = time_ns
+        # Whether song was silenced by press, before the contest was resolved.
+        self.silenced: bool = False
+        self.press: BuzzerPress = None  # Press whose latency is being measured.
+        self.latency_ms: float = None  # Latency of last silenced song.
+
+    def silence(self, press: BuzzerPress, playback_state: int,
+                pause_spotify: Callable[[], None] = None, sink: 'ChannelSink' = None) -> None:
+        '''Pauses Spotify if given, otherwise mutes the sink, can be called from any thread.'''
+        if self.silenced or playback_state != S_PLAYING:
+            return
+        self.silenced = True
+        self.press = press
+        if pause_spotify:
+            pause_spotify()
+        elif sink:
+            sink.silence()
+            # Audio already in output buffer is still played.
+            self.report(self.time_ns() + int(sink.buffer_ms * 1_000_000))
+
+    def report(self, silent_ns: int) -> None:
+        '''Records delay between press and silence, can be called from any thread.'''
+        press: BuzzerPress = self.press
+        if press is None:
+            return
+        self.press = None
+        latency_ns: int = silent_ns - press.timestamp_ns
+        instruments.record('press to silence', latency_ns)
+        self.latency_ms = latency_ns / 1_000_000
+        l.info(f'Press to silence latency: {self.latency_ms:.1f} ms.')
+
+    def reset(self) -> None:
+        '''Lets next press silence the song, called when it starts or resumes.'''
+        self.silenced = False
+        self.press = None
+
+
+class GameEngine:
+    '''State of the game, changed only through its methods.
+
+    Engine doesn't play audio nor show anything, every change is passed to
+    observers as GameEvent, in order in which it happened. Only press can be
+    called from other threads, everything else must be called from one thread.
+    '''
+
+    def __init__(self, number_teams: int, playback_time: int,
+                 points_correct: int = 1, points_incorrect: int = -1,
+                 tie_window_us: int = 0, lockout: bool = True,
+                 song_source: Callable[[], dict] = None,
+                 time_ns: Callable[[], int] = time.monotonic_ns) -> None:
+        self.number_teams: int = number_teams
+        self.playback_time: int = playback_time  # Seconds of each song that are played.
+        self.points_correct: int = points_correct
+        self.points_incorrect: int = points_incorrect
+        # Returns next song to play or None if there are no more songs.
+        self.song_source: Callable[[], dict] = song_source
+        self.time_ns: Callable[[], int] = time_ns
+
+        self.observers: list = []
+        self.arbiter: BuzzerArbiter = BuzzerArbiter(number_teams, tie_window_us, lockout)
+        self.clock: PlaybackClock = PlaybackClock(time_ns)  # Position of the song
+
+        self.current_song: dict = None
+        self.playback_state: int = S_STOPPED
+        self.is_team_guessing: bool = False
+        self.guessing_team: int = None  # Index of team that pressed button first
+        self.team_scores: list = [0] * number_teams
+        self.songs_played: int = 0
+
+    def subscribe(self, observer: Callable[[GameEvent], None]) -> None:
+        self.observers.append(observer)
+
+    def emit(self, event: GameEvent) -> None:
+        for observer in self.observers:
+            observer(event)
+
+    @property
+    def millis(self) -> int:
+        '''Position of the song in milliseconds.'''
+        return self.clock.millis()
+
+    @property
+    def can_play_next(self) -> bool:
+        return not self.is_team_guessing and self.playback_state != S_PLAYING
+
+    @property
+    def can_pause_resume(self) -> bool:
+        return not self.is_team_guessing and self.playback_state != S_STOPPED
+
+    def next_song(self) -> bool:
+        '''Starts next song from song source, returns whether it started.'''
+        if not self.can_play_next:
+            l.warning('Song is playing or team is guessing.')
+            return False
+        song: dict = self.song_source() if self.song_source else None
+        if song is None:
+            self.emit(GameEvent(NO_SONGS))
+            return False
+        self.start_song(song)
+        return True
+
+    def start_song(self, song: dict) -> None:
+        '''Starts given song, used when song is chosen outside of the engine.'''
+        self.current_song = song
+        self.songs_played += 1
+        self.clock.start()
+        self.arbiter.new_round()
+        self.playback_state = S_PLAYING
+        self.emit(GameEvent(SONG_STARTED, song=song))
+
+    def pause(self) -> None:
+        if self.playback_state == S_PLAYING:
+            self.clock.pause()
+            self.playback_state = S_PAUSED
+            self.emit(GameEvent(PAUSED))
+        else:
+            l.warning('Song is not playing.')
+
+    def resume(self) -> None:
+        if self.playback_state == S_PAUSED:
+            self.clock.resume()
+            self.playback_state = S_PLAYING
+            self.emit(GameEvent(RESUMED))
+        else:
+            l.warning('Song is already playing.')
+
+    def stop(self) -> None:
+        if self.playback_state != S_STOPPED:
+            self.clock.pause()
+            self.playback_state = S_STOPPED
+            self.emit(GameEvent(STOPPED))
+
+    def pause_resume(self) -> None:
+        if self.playback_state == S_PLAYING:
+            self.pause()
+        elif self.playback_state == S_PAUSED:
+            self.resume()
+
+    def remaining_ms(self) -> int:
+        '''Returns time left until the end of playback time.'''
+        return self.playback_time * 1000 - self.millis
+
+    def check_time(self) -> bool:
+        '''Stops the song if playback time is over, returns whether it stopped.'''
+        if self.playback_state == S_PLAYING and self.remaining_ms() <= 0:
+            self.stop()
+            return True
+        return False
+
+    def press(self, press: BuzzerPress) -> bool:
+        '''Submits press to arbiter, returns whether it takes part in contest.'''
+        return self.arbiter.submit(press)
+
+    def arbitration_deadline(self) -> int:
+        '''Returns moment when presses can be resolved, None if there are none.'''
+        return self.arbiter.deadline_ns()
+
+    def resolve(self, now_ns: int = None) -> BuzzerPress:
+        '''Gives the floor to the team that won arbitration, if it's decided.'''
+        if self.is_team_guessing:
+            return None
+        winner: BuzzerPress = self.arbiter.resolve(self.time_ns() if now_ns is None else now_ns)
+        if winner is not None:
+            if self.playback_state == S_PLAYING:
+                # Pausing playback of the song only if song is playing.
+                self.pause()
+            self.is_team_guessing = True
+            self.guessing_team = winner.team
+            self.emit(GameEvent(TEAM_GUESSING, team=winner.team, press=winner))
+        return winner
+
+    def answer(self, correct: bool) -> None:
+        '''Scores answer of guessing team.'''
+        if not self.is_team_guessing:
+            return
+        team: int = self.guessing_team
+        points: int = self.points_correct if correct else self.points_incorrect
+        self.team_scores[team] += points
+        self.is_team_guessing = False
+        self.arbiter.verdict(correct)
+        self.emit(GameEvent(SCORED, team=team, points=points,
+                            score=self.team_scores[team], correct=correct))
+        if correct:
+            # Song was guessed, so it can't be resumed.
+            self.stop()
+
+    def new_game(self) -> None:
+        '''Stops the song and resets scores of all teams.'''
+        self.stop()
+        self.is_team_guessing = False
+        self.guessing_team = None
+        self.team_scores = [0] * self.number_teams
+        self.songs_played = 0
+        self.arbiter.new_round()
+        self.emit(GameEvent(NEW_GAME))
@@ -0,0 +1,374 @@
+import os
+import random
+import sqlite3
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# Logging
+import logging as l
+
+from typing import Callable
+
+import numpy as np
+
+# Envelope frames per second of audio.
+ENVELOPE_RATE = 10
+# Songs are decoded to mono at low rate, enough for loudness.
+DECODE_FREQUENCY = 11025
+# Loudness is stored in one byte per frame, between this level and full scale.
+FLOOR_DB = -60
+# Weight of onsets, so snippets with beats win over steady noise of same level.
+ONSET_WEIGHT = 2
+# Start is chosen at random from this best part of possible snippets.
+BEST_FRACTION = 0.2
+# Number of songs analysed by single task of worker process.
+ANALYSE_CHUNK = 4
+# Number of analysed songs checked for duplicates at once.
+CHECK_CHUNK = 256
+# Increased when features change, so stale ones are computed again.
+VERSION = 2
+
+# Spectrum of the song is summarised in bands between these frequencies.
+FFT_SIZE = 1024
+SPECTRUM_BANDS = 16
+LOWEST_FREQUENCY = 100
+HIGHEST_FREQUENCY = 5000
+# Frames quieter than loudest one by this many decibels are left out of spectrum.
+SPECTRUM_RANGE_DB = 40
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS features (
+    hash TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    loudness BLOB NOT NULL,
+    onsets BLOB NOT NULL,
+    spectrum BLOB NOT NULL
+);
+'''
+
+
+def envelope(samples: np.ndarray, rate: int) -> tuple:
+    '''Returns loudness and onset strength of every frame as uint8 arrays.
+
+    Samples are float array of shape (frames, channels) or (frames,).
+    '''
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    hop: int = max(1, rate // ENVELOPE_RATE)
+    frames: int = len(samples) // hop
+    if frames == 0:
+        return np.zeros(0, np.uint8), np.zeros(0, np.uint8)
+    power: np.ndarray = np.square(samples[:frames * hop].reshape(frames, hop), dtype=np.float32).mean(axis=1)
+    decibels: np.ndarray = 10 * np.log10(power + 1e-12)
+    np.clip(decibels, FLOOR_DB, 0, out=decibels)
+    loudness: np.ndarray = (decibels - FLOOR_DB) * (255 / -FLOOR_DB)
+    # Rise of loudness between frames, falls are not onsets.
+    onsets: np.ndarray = np.maximum(np.diff(loudness, prepend=loudness[0]), 0)
+    return loudness.astype(np.uint8), np.minimum(onsets, 255).astype(np.uint8)
+
+
+def spectrum(samples: np.ndarray, rate: int) -> np.ndarray:
+    '''Returns mean and variation of log energy in bands of the spectrum.
+
+    Both barely change when song is encoded again, while they differ
+    between different recordings.
+    '''
+    from audio import resample
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    samples = resample(samples[:, np.newaxis], rate, DECODE_FREQUENCY)[:, 0]
+    frames: int = len(samples) // FFT_SIZE
+    if frames == 0:
+        return np.zeros(2 * SPECTRUM_BANDS, np.float32)
+    windowed: np.ndarray = samples[:frames * FFT_SIZE].reshape(frames, FFT_SIZE) * np.hanning(FFT_SIZE)
+    power: np.ndarray = np.square(np.abs(np.fft.rfft(windowed, axis=1)))
+    edges: np.ndarray = np.geomspace(LOWEST_FREQUENCY, HIGHEST_FREQUENCY, SPECTRUM_BANDS + 1)
+    bins: np.ndarray = (edges * FFT_SIZE / DECODE_FREQUENCY).astype(np.intp)
+    bands: np.ndarray = np.add.reduceat(power, bins, axis=1)[:, :SPECTRUM_BANDS]
+    total: np.ndarray = bands.sum(axis=1, keepdims=True)
+    loud: np.ndarray = total[:, 0] >= total.max() * 10 ** (-SPECTRUM_RANGE_DB / 10)
+    # Nearly empty bands are raised to floor, so noise added by encoding doesn't change them.
+    levels: np.ndarray = np.log10(np.maximum(bands[loud], total[loud] * 10 ** (-SPECTRUM_RANGE_DB / 10)))
+    return np.concatenate((detrend(levels.mean(axis=0)), detrend(levels.std(axis=0))))
+
+
+def detrend(values: np.ndarray) -> np.ndarray:
+    '''Removes level and slope shared by most songs, leaving what tells them apart.'''
+    positions: np.ndarray = np.arange(len(values))
+    slope, level = np.polyfit(positions, values, 1)
+    values = values - (slope * positions + level)
+    return values / (values.std() + 1e-12)
+
+
+def init_worker() -> None:
+    '''Opens silent mixer in worker process, used for decoding MP3.'''
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+    from pygame import mixer
+    mixer.init(frequency=DECODE_FREQUENCY, size=-16, channels=1)
+
+
+def decode(path: str) -> tuple:
+    '''Returns samples of whole song as float array and their rate.'''
+    from audio import read_wav
+    if path.lower().endswith('.wav'):
+        with open(path, 'rb') as file:
+            return read_wav(file)
+    from pygame import mixer, sndarray
+    samples: np.ndarray = sndarray.array(mixer.Sound(file=path)).astype(np.float32) / 32768
+    return samples, mixer.get_init()[0]
+
+
+def analyse_many(songs: list) -> list:
+    '''Computes features of chunk of songs in worker process, unreadable ones are skipped.'''
+    results: list = []
+    for song_hash, path in songs:
+        try:
+            samples, rate = decode(path)
+            loudness, onsets = envelope(samples, rate)
+            profile: np.ndarray = spectrum(samples, rate).astype(np.float32)
+        except Exception as e:
+            l.error(f'Analysing {path} failed: {e}')
+            continue
+        results.append((song_hash, loudness.tobytes(), onsets.tobytes(), profile.tobytes()))
+    return results
+
+
+def pick_start(loudness: np.ndarray, onsets: np.ndarray, seconds: float,
+               rng: random.Random = random) -> float:
+    '''Returns start in seconds of loud snippet of given length.
+
+    Energy of every possible snippet is computed at once from cumulative
+    sum, start is chosen at random among the best ones, so the same song
+    doesn't always start at the same moment.
+    '''
+    length: int = int(seconds * ENVELOPE_RATE)
+    if length <= 0 or len(loudness) <= length:
+        return 0
+    energy: np.ndarray = np.cumsum(loudness + ONSET_WEIGHT * onsets.astype(np.int64), dtype=np.int64)
+    energy = np.concatenate(([0], energy))
+    windows: np.ndarray = energy[length:] - energy[:-length]
+    threshold: float = np.quantile(windows, 1 - BEST_FRACTION)
+    candidates: np.ndarray = np.flatnonzero(windows >= threshold)
+    return int(candidates[rng.randrange(len(candidates))]) / ENVELOPE_RATE
+
+
+class FeatureIndex:
+    '''Envelopes of songs stored in SQLite database by content hash.
+
+    Hash stays the same when file is moved or renamed, so songs are
+    analysed only once.
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        # Used by analyser and prefetcher threads too, so access is guarded with lock.
+        self.connection: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock: threading.Lock = threading.Lock()
+        with self.lock:
+            columns: list = [row[1] for row in self.connection.execute('PRAGMA table_info(features)')]
+            if columns and 'spectrum' not in columns:
+                # Features of older version are computed again anyway.
+                self.connection.execute('DROP TABLE features')
+            self.connection.executescript(SCHEMA)
+
+    def spectra(self) -> dict:
+        '''Returns spectrum of every song with current features by hash.'''
+        with self.lock:
+            return {
+                song_hash: np.frombuffer(profile, np.float32) for song_hash, profile in self.connection.execute(
+                    'SELECT hash, spectrum FROM features WHERE version = ?', (VERSION,))
+            }
+
+    def get(self, song_hash: str) -> tuple:
+        '''Returns loudness and onsets of the song, None if it wasn't analysed.'''
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT loudness, onsets FROM features WHERE hash = ? AND version = ?',
+                (song_hash, VERSION)).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], np.uint8), np.frombuffer(row[1], np.uint8)
+
+    def update(self, results: list) -> None:
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?)',
+                ((song_hash, VERSION, loudness, onsets, profile)
+                 for song_hash, loudness, onsets, profile in results))
+
+    def snippet_start(self, song: dict, seconds: float) -> float:
+        '''Returns start of loud snippet of the song, 0 if it wasn't analysed yet.'''
+        features: tuple = self.get(song.get('hash'))
+        if features is None:
+            return 0
+        return pick_start(*features, seconds)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class FeatureAnalyser(threading.Thread):
+    '''Analyses songs added to it in worker processes and finds duplicates among them.
+
+    Songs are analysed in order they are added, songs which already have
+    features are only checked. Paths of songs which are the same recording
+    as song added before, are passed to on_duplicates, which is called from
+    analyser thread. Thread finishes when cancelled.
+    '''
+
+    def __init__(self, index: FeatureIndex, on_duplicates: Callable[[list], None] = None,
+                 workers: int = None) -> None:
+        super().__init__(name='FeatureAnalyser', daemon=True)
+        from duplicates import DuplicateIndex
+        self.index: FeatureIndex = index
+        self.on_duplicates: Callable[[list], None] = on_duplicates
+        self.workers: int = workers
+        self.condition: threading.Condition = threading.Condition()
+        self.queue: deque = deque()  # Hash and path of added songs.
+        self.spectra: dict = {}  # Spectrum of every analysed song by hash.
+        self.analysing: dict = {}  # Paths waiting for analysis of their hash.
+        self.paths: dict = {}  # First added path of every hash.
+        self.duplicates: 'DuplicateIndex' = DuplicateIndex(self.loudness)
+        self.found: list = []  # Paths of duplicates not yet passed to on_duplicates.
+        self.cancelled: bool = False
+        self.analysed: int = 0
+
+    def add(self, songs: list) -> None:
+        '''Queues songs, can be called from any thread.'''
+        with self.condition:
+            self.queue.extend((song['hash'], song['path']) for song in songs if song.get('hash'))
+            self.condition.notify()
+
+    def forget(self) -> None:
+        '''Forgets added songs, used when list of songs changes.'''
+        with self.condition:
+            self.queue.clear()
+            self.paths.clear()
+            self.duplicates.clear()
+            self.found = []
+            for paths in self.analysing.values():
+                paths.clear()
+
+    def cancel(self) -> None:
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify()
+
+    def loudness(self, song_hash: str) -> np.ndarray:
+        return self.index.get(song_hash)[0]
+
+    def check(self, song_hash: str, path: str) -> None:
+        '''Remembers analysed song, or marks it as duplicate of one added before.'''
+        first: str = self.paths.get(song_hash)
+        if first is not None:
+            # Copy of the same file, unless the same song was added again.
+            if first != path:
+                self.found.append(path)
+            return
+        self.paths[song_hash] = path
+        if self.duplicates.add(song_hash, self.spectra[song_hash]) is not None:
+            self.found.append(path)
+
+    def take(self, count: int, block: bool = True) -> list:
+        '''Returns at most count of songs which need analysis, waiting for them if blocking.
+
+        Songs that were analysed before are checked on the way, a few at a
+        time, so songs can be added meanwhile.
+        '''
+        with self.condition:
+            while True:
+                chunk: list = []
+                checked: int = 0
+                while self.queue and len(chunk) < count and checked < CHECK_CHUNK:
+                    song_hash, path = self.queue.popleft()
+                    if song_hash in self.spectra:
+                        self.check(song_hash, path)
+                        checked += 1
+                    elif song_hash in self.analysing:
+                        self.analysing[song_hash].append(path)
+                    else:
+                        self.analysing[song_hash] = [path]
+                        chunk.append((song_hash, path))
+                if chunk or checked or self.cancelled or not block:
+                    return chunk
+                self.condition.wait()
+
+    def analysed_chunk(self, chunk: list, results: list) -> None:
+        '''Stores results of the task and checks its songs.'''
+        self.index.update(results)
+        self.analysed += len(results)
+        with self.condition:
+            for song_hash, _, _, profile in results:
+                self.spectra[song_hash] = np.frombuffer(profile, np.float32)
+            for song_hash, _ in chunk:
+                paths: list = self.analysing.pop(song_hash, [])
+                # Songs which couldn't be analysed are kept.
+                if song_hash in self.spectra:
+                    for path in paths:
+                        self.check(song_hash, path)
+
+    def report(self) -> None:
+        with self.condition:
+            found: list = self.found
+            self.found = []
+        if found:
+            l.info(f'Found {len(found)} duplicate songs.')
+            if self.on_duplicates:
+                self.on_duplicates(found)
+
+    def failed(self, chunk: list, error: Exception) -> None:
+        '''Gives up songs of the chunk, they are played without features.'''
+        l.error(f'Analysing {len(chunk)} songs failed: {error!r}')
+        self.analysed_chunk(chunk, [])
+
+    def create_executor(self) -> ProcessPoolExecutor:
+        # Forked worker would inherit audio of the game, fresh process opens its own silent mixer.
+        return ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'), init_worker)
+
+    def run(self) -> None:
+        self.spectra = self.index.spectra()
+        executor: ProcessPoolExecutor = self.create_executor()
+        limit: int = 2 * (self.workers or os.cpu_count() or 1)
+        pending: dict = {}  # Songs of each running task.
+        while not self.cancelled:
+            broken: bool = False
+            if len(pending) < limit:
+                # Blocks only when there is nothing else to wait for.
+                chunk: list = self.take(ANALYSE_CHUNK, block=not pending)
+                self.report()
+                if chunk:
+                    try:
+                        pending[executor.submit(analyse_many, chunk)] = chunk
+                        continue
+                    except (BrokenProcessPool, RuntimeError, OSError) as e:
+                        self.failed(chunk, e)
+                        broken = True
+            if pending and not broken:
+                done, _ = wait(pending, 0.1, FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    try:
+                        results: list = future.result()
+                    except BrokenProcessPool as e:
+                        # Worker died, e.g. crashed decoder or killed for memory.
+                        self.failed(chunk, e)
+                        broken = True
+                    except Exception as e:
+                        self.failed(chunk, e)
+                    else:
+                        self.analysed_chunk(chunk, results)
+                self.report()
+            if broken:
+                # Broken pool fails all its tasks at once, so they are given up together.
+                for chunk in pending.values():
+                    self.failed(chunk, BrokenProcessPool('worker of the pool died'))
+                pending.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = self.create_executor()
+                self.report()
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,173 @@
+import csv
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+from typing import Callable
+
+# Each power of two is split into this many buckets, so values are stored
+# with relative error below 1/32, like in HDR histograms.
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# Values below this are stored exactly.
+EXACT_LIMIT = 2 * SUB_BUCKETS
+
+PERCENTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def bucket_index(value: int) -> int:
+    if value < EXACT_LIMIT:
+        return value
+    shift: int = value.bit_length() - SUB_BUCKET_BITS - 1
+    return EXACT_LIMIT + (shift - 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+
+def bucket_value(index: int) -> int:
+    '''Returns middle of values stored in bucket.'''
+    if index < EXACT_LIMIT:
+        return index
+    shift, offset = divmod(index - EXACT_LIMIT, SUB_BUCKETS)
+    shift += 1
+    return ((SUB_BUCKETS + offset) << shift) + (1 << shift) // 2
+
+
+class Histogram:
+    '''Counts of durations in nanoseconds, in log-linear buckets.
+
+    Recording is constant time and memory doesn't grow with number of
+    recorded values, so it can be used on hot paths during whole game.
+    '''
+
+    def __init__(self) -> None:
+        self.counts: list = []
+        self.count: int = 0
+        self.total: int = 0
+        self.min: int = None
+        self.max: int = None
+        self.lock: threading.Lock = threading.Lock()
+
+    def record(self, value: int) -> None:
+        value = max(0, value)
+        index: int = bucket_index(value)
+        with self.lock:
+            if index >= len(self.counts):
+                self.counts.extend([0] * (index + 1 - len(self.counts)))
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, fraction: float) -> int:
+        '''Returns value below which given fraction of recorded values are.'''
+        with self.lock:
+            if not self.count:
+                return None
+            target: int = max(1, int(fraction * self.count + 0.5))
+            seen: int = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= target:
+                    return max(min(bucket_value(index), self.max), self.min)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else None
+
+    def summary(self) -> dict:
+        '''Returns count and statistics in milliseconds.'''
+        summary: dict = {'count': self.count}
+        if self.count:
+            summary['mean_ms'] = self.mean() / 1e6
+            summary['min_ms'] = self.min / 1e6
+            for fraction in PERCENTILES:
+                summary[f'p{fraction * 100:g}_ms'] = self.percentile(fraction) / 1e6
+            summary['max_ms'] = self.max / 1e6
+        return summary
+
+
+class Instruments:
+    '''Named histograms of durations of hot paths.
+
+    When disabled, timed functions only check single flag before calling
+    the original, so instrumentation can stay in the code all the time.
+    '''
+
+    def __init__(self) -> None:
+        self.enabled: bool = False
+        self.histograms: dict = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        histogram: Histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def record(self, name: str, duration_ns: int) -> None:
+        if self.enabled:
+            self.histogram(name).record(duration_ns)
+
+    def timed(self, name: str) -> Callable:
+        '''Decorator recording duration of every call of the function.
+
+        Qt slots need pyqtSlot above it, so they aren't called with arguments of signal.
+        '''
+        def decorate(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                started: int = time.perf_counter_ns()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.histogram(name).record(time.perf_counter_ns() - started)
+            return wrapper
+        return decorate
+
+    @contextmanager
+    def measure(self, name: str):
+        '''Records duration of the block.'''
+        if not self.enabled:
+            yield
+            return
+        started: int = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.histogram(name).record(time.perf_counter_ns() - started)
+
+    def summary(self) -> dict:
+        with self.lock:
+            names: list = sorted(self.histograms)
+        return {name: self.histograms[name].summary() for name in names}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.histograms = {}
+
+    def dump(self, path: str) -> None:
+        '''Writes statistics to JSON file and CSV file next to it.'''
+        if not self.histograms:
+            return
+        summary: dict = self.summary()
+        with open(path + '.json', 'w', encoding='UTF-8') as file:
+            json.dump(summary, file, indent=4)
+        columns: list = ['count', 'mean_ms', 'min_ms'] + \
+            [f'p{fraction * 100:g}_ms' for fraction in PERCENTILES] + ['max_ms']
+        with open(path + '.csv', 'w', encoding='UTF-8', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['name'] + columns)
+            for name, values in summary.items():
+                writer.writerow([name] + [values.get(column, '') for column in columns])
+
+
+# Shared by all modules, enabled from settings.
+instruments: Instruments = Instruments()
+timed = instruments.timed
@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import time
+import threading
+
+# Logging
+import logging as l
+
+from buzzers import BuzzerPress
+from engine import NEW_GAME, NO_SONGS, SCORED, GameEvent
+
+# Keys of the song that are stored, decoded audio is not.
+SONG_KEYS = ('name', 'artist', 'path', 'uri', 'start')
+
+# Score records and start of last game are found without parsing whole
+# journal, so scores are restored in milliseconds even after long evening.
+# Comma after score makes sure record wasn't torn in the middle of it.
+SCORE_RECORD = re.compile(
+    rb'\{"kind":"scored","t":\d+,"team":(\d+),"points":-?\d+,"score":(-?\d+),')
+NEW_GAME_RECORD = b'{"kind":"new_game"'
+
+
+def event_record(event: GameEvent) -> dict:
+    '''Converts game event to record of the journal.'''
+    record: dict = {'kind': event.kind, 't': time.time_ns()}
+    if event.team is not None:
+        record['team'] = event.team
+    if event.song is not None:
+        record['song'] = {key: event.song[key] for key in SONG_KEYS if key in event.song}
+    if event.kind == SCORED:
+        record['points'] = event.points
+        record['score'] = event.score
+        record['correct'] = event.correct
+    if event.press is not None:
+        record['press'] = list(event.press)
+    return record
+
+
+def event_from_record(record: dict) -> GameEvent:
+    '''Converts record back to game event, song has no decoded audio.'''
+    press: list = record.get('press')
+    return GameEvent(
+        record['kind'], team=record.get('team'), song=record.get('song'),
+        points=record.get('points', 0), score=record.get('score'),
+        press=BuzzerPress(*press) if press else None, correct=record.get('correct'))
+
+
+def read(path: str) -> list:
+    '''Returns records of the journal, skipping line torn by crash.'''
+    records: list = []
+    if not os.path.exists(path):
+        return records
+    with open(path, 'rb') as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                l.warning(f'Skipping broken record of {path}.')
+    return records
+
+
+def scoreboard(records: list, number_teams: int) -> list:
+    '''Returns scores of teams after last new game in records.'''
+    scores: list = [0] * number_teams
+    for record in records:
+        if record['kind'] == NEW_GAME:
+            scores = [0] * number_teams
+        elif record['kind'] == SCORED and record['team'] < number_teams:
+            scores[record['team']] = record['score']
+    return scores
+
+
+def restore_scores(path: str, number_teams: int) -> list:
+    '''Returns scores of teams in last game stored in journal.'''
+    scores: list = [0] * number_teams
+    if not os.path.exists(path):
+        return scores
+    with open(path, 'rb') as file:
+        data: bytes = file.read()
+    start: int = max(0, data.rfind(NEW_GAME_RECORD))
+    for match in SCORE_RECORD.finditer(data, start):
+        team: int = int(match.group(1))
+        if team < number_teams:
+            scores[team] = int(match.group(2))
+    return scores
+
+
+class Journal:
+    '''Append-only file of game events, written in background.
+
+    Events are only queued by the caller. Writer thread writes everything
+    queued since previous write at once and syncs it to disk with single
+    fsync, so many events cost one sync and the GUI never waits for disk.
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self.file = open(path, 'ab')
+        self.pending: list = []  # Encoded records waiting for writer.
+        if self.file.tell() and not self.ends_with_newline():
+            # Record torn by crash is ended, so next one starts on new line.
+            self.pending.append(b'\n')
+        self.condition: threading.Condition = threading.Condition()
+        self.write_lock: threading.Lock = threading.Lock()
+        self.stopped: bool = False
+        self.commits: int = 0  # Number of fsyncs done.
+        self.thread: threading.Thread = threading.Thread(
+            target=self.run, name='Journal', daemon=True)
+        self.thread.start()
+
+    def ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b'\n'
+
+    def append(self, record: dict) -> None:
+        '''Queues record, can be called from any thread.'''
+        line: bytes = json.dumps(record, separators=(',', ':')).encode() + b'\n'
+        with self.condition:
+            self.pending.append(line)
+            self.condition.notify()
+
+    def record_event(self, event: GameEvent) -> None:
+        '''Observer of game engine.'''
+        if event.kind == NO_SONGS:
+            return
+        if event.kind == NEW_GAME:
+            # Previous game is kept next to the journal, e.g. for replay.
+            base: str = os.path.splitext(self.path)[0]
+            self.rotate(f'{base}-{time.strftime("%Y%m%d-%H%M%S")}.jsonl')
+        self.append(event_record(event))
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if not self.pending and self.stopped:
+                    return
+            self.commit()
+
+    def commit(self) -> None:
+        '''Writes and syncs all queued records.'''
+        with self.write_lock:
+            with self.condition:
+                lines: list = self.pending
+                self.pending = []
+            if not lines:
+                return
+            try:
+                self.file.write(b''.join(lines))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.commits += 1
+            except OSError as e:
+                l.error(f'Writing journal failed: {e}')
+
+    def rotate(self, archive_path: str) -> None:
+        '''Moves written records to archive and starts empty journal.'''
+        self.commit()
+        with self.write_lock:
+            self.file.close()
+            os.replace(self.path, archive_path)
+            self.file = open(self.path, 'ab')
+        l.info(f'Archived journal to {archive_path}.')
+
+    def close(self) -> None:
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+        self.commit()
+        self.file.close()
@@ -0,0 +1,402 @@
+import os
+import time
+import sqlite3
+import hashlib
+import multiprocessing
+import threading
+import wave
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# Logging
+import logging as l
+
+from typing import Callable
+
+# Reading tags and bitrate
+from mutagen import mp3
+
+EXTENSIONS = ('mp3', 'wav')
+# Size of parts at the start and end of the file used for content hash.
+HASH_CHUNK = 64 * 1024
+# Number of files probed by single task of worker process.
+PROBE_CHUNK = 32
+# Number of songs passed to UI at once.
+BATCH_SIZE = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS songs (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    frequency INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS songs_directory ON songs (directory);
+CREATE TABLE IF NOT EXISTS played (
+    hash TEXT PRIMARY KEY,
+    time INTEGER NOT NULL
+);
+'''
+COLUMNS = ('path', 'directory', 'mtime', 'size', 'title', 'artist', 'frequency', 'duration', 'hash')
+# Number of values bound to single query, SQLite limits it.
+QUERY_CHUNK = 500
+
+
+def content_hash(path: str, size: int) -> str:
+    '''Hashes size of the file and its first and last chunks.
+
+    Reading whole files would make first scan of large library very slow,
+    while beginning and end of audio file are different for every recording.
+    '''
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as file:
+        digest.update(file.read(HASH_CHUNK))
+        if size > 2 * HASH_CHUNK:
+            file.seek(-HASH_CHUNK, os.SEEK_END)
+            digest.update(file.read(HASH_CHUNK))
+    return digest.hexdigest()
+
+
+def tag_text(tags, frame: str) -> str:
+    '''Returns text of ID3 frame or empty string.'''
+    if tags is None or frame not in tags:
+        return ''
+    return ', '.join(str(text) for text in tags[frame].text)
+
+
+def probe(path: str, mtime: int, size: int) -> dict:
+    '''Reads metadata of the song.'''
+    name, extension = os.path.splitext(os.path.basename(path))
+    extension = extension[1:].lower()
+    song: dict = {
+        'path': path,
+        'directory': os.path.dirname(path),
+        'mtime': mtime,
+        'size': size,
+        'title': name,
+        'artist': '',
+    }
+    if extension == 'mp3':
+        file = mp3.MP3(path)
+        song['title'] = tag_text(file.tags, 'TIT2') or name
+        song['artist'] = tag_text(file.tags, 'TPE1')
+        song['frequency'] = file.info.sample_rate
+        song['duration'] = file.info.length
+    else:
+        with wave.open(path) as file:
+            song['frequency'] = file.getframerate()
+            song['duration'] = file.getnframes() / file.getframerate()
+    song['hash'] = content_hash(path, size)
+    return song
+
+
+def probe_many(files: list) -> list:
+    '''Probes chunk of files in worker process, unreadable files are skipped.'''
+    songs: list = []
+    for path, mtime, size in files:
+        try:
+            songs.append(probe(path, mtime, size))
+        except Exception as e:
+            l.error(f'Reading {path} failed: {e}')
+    return songs
+
+
+def walk(directory: str, cancelled: threading.Event = None):
+    '''Recursively yields path, modification time and size of every song in directory.'''
+    stack: list = [directory]
+    while stack:
+        if cancelled is not None and cancelled.is_set():
+            return
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and entry.name.lower().endswith(EXTENSIONS):
+                        stat = entry.stat()
+                        yield entry.path, stat.st_mtime_ns, stat.st_size
+        except OSError as e:
+            l.error(f'Reading directory failed: {e}')
+
+
+def as_song(row: dict) -> dict:
+    '''Converts row of the index to song used by the game.'''
+    song: dict = dict(row)
+    song['name'] = song['title']
+    song['extension'] = os.path.splitext(song['path'])[1][1:].lower()
+    return song
+
+
+class LibraryIndex:
+    '''Metadata of songs stored in SQLite database.
+
+    Files are identified by path, modification time and size, so only new
+    and changed files are probed when directory is scanned again. Row id
+    of a song stays the same when it's updated, so it can stand for the song.
+    Hashes of played songs are kept too, so songs don't repeat across sessions.
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        # Used by scanner thread too, so access is guarded with lock.
+        self.connection: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock: threading.Lock = threading.Lock()
+        with self.lock:
+            # Song is marked as played at every round, so writes are kept cheap.
+            self.connection.execute('PRAGMA journal_mode = WAL')
+            self.connection.execute('PRAGMA synchronous = NORMAL')
+            self.connection.executescript(SCHEMA)
+
+    def known(self, directory: str) -> dict:
+        '''Returns indexed songs inside directory and its subdirectories by path.'''
+        directory = os.path.join(directory, '')
+        # Paths inside directory sort between it and next possible prefix.
+        end: str = directory[:-1] + chr(ord(directory[-1]) + 1)
+        with self.lock:
+            return {
+                row['path']: row for row in self.connection.execute(
+                    'SELECT rowid, * FROM songs WHERE path >= ? AND path < ?', (directory, end))
+            }
+
+    def known_paths(self, paths) -> dict:
+        '''Returns indexed songs at given paths or inside them by path.'''
+        known: dict = {}
+        for path in paths:
+            known.update(self.known(path))
+            with self.lock:
+                known.update((row['path'], row) for row in self.connection.execute(
+                    'SELECT rowid, * FROM songs WHERE path = ?', (path,)))
+        return known
+
+    def update(self, songs: list) -> None:
+        '''Inserts probed songs, changed ones keep their row id.'''
+        changed: str = ', '.join(f'{column} = excluded.{column}' for column in COLUMNS[1:])
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f'INSERT INTO songs VALUES ({", ".join("?" * len(COLUMNS))}) '
+                f'ON CONFLICT (path) DO UPDATE SET {changed}',
+                (tuple(song[column] for column in COLUMNS) for song in songs))
+
+    def rowids(self, paths) -> dict:
+        '''Returns row ids of indexed songs by path.'''
+        paths = list(paths)
+        rowids: dict = {}
+        with self.lock:
+            for i in range(0, len(paths), QUERY_CHUNK):
+                chunk: list = paths[i:i + QUERY_CHUNK]
+                rowids.update(self.connection.execute(
+                    f'SELECT path, rowid FROM songs WHERE path IN ({", ".join("?" * len(chunk))})',
+                    chunk))
+        return rowids
+
+    def song(self, rowid: int) -> dict:
+        '''Returns song with given row id, None if it was removed.'''
+        with self.lock:
+            row: sqlite3.Row = self.connection.execute(
+                'SELECT rowid, * FROM songs WHERE rowid = ?', (rowid,)).fetchone()
+        return as_song(row) if row is not None else None
+
+    def played(self, hashes) -> set:
+        '''Returns hashes which belong to songs played in any session.'''
+        hashes = list(hashes)
+        played: set = set()
+        with self.lock:
+            for i in range(0, len(hashes), QUERY_CHUNK):
+                chunk: list = hashes[i:i + QUERY_CHUNK]
+                played.update(row[0] for row in self.connection.execute(
+                    f'SELECT hash FROM played WHERE hash IN ({", ".join("?" * len(chunk))})',
+                    chunk))
+        return played
+
+    def mark_played(self, song_hash: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO played VALUES (?, ?)', (song_hash, int(time.time())))
+
+    def forget_played(self, rowids) -> None:
+        '''Allows songs with given row ids to be played again.'''
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'DELETE FROM played WHERE hash = (SELECT hash FROM songs WHERE rowid = ?)',
+                ((rowid,) for rowid in rowids))
+
+    def remove(self, paths) -> None:
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'DELETE FROM songs WHERE path = ?', ((path,) for path in paths))
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class LibraryScanner(threading.Thread):
+    '''Scans directory recursively in background and updates index.
+
+    Unchanged files are taken from index, new and changed ones are probed
+    in worker processes. Songs are passed to on_batch in batches as soon as
+    they are ready, with number of processed and found files passed to
+    on_progress. Songs that are gone are passed to on_removed. When paths
+    are given, only those files and directories are scanned again, so
+    changes reported by watcher are applied without walking whole directory.
+    Callbacks are called from scanner thread.
+    '''
+
+    def __init__(self, index: LibraryIndex, directory: str,
+                 on_batch: Callable[[list], None],
+                 on_progress: Callable[[int, int], None] = None,
+                 on_finished: Callable[[bool], None] = None,
+                 workers: int = None,
+                 paths: list = None,
+                 on_removed: Callable[[list], None] = None) -> None:
+        super().__init__(name='LibraryScanner', daemon=True)
+        self.index: LibraryIndex = index
+        self.directory: str = os.path.abspath(directory)
+        self.on_batch: Callable[[list], None] = on_batch
+        self.on_progress: Callable[[int, int], None] = on_progress
+        self.on_finished: Callable[[bool], None] = on_finished
+        self.workers: int = workers
+        self.paths: list = paths
+        self.on_removed: Callable[[list], None] = on_removed
+        self.cancelled: threading.Event = threading.Event()
+        self.executor: ProcessPoolExecutor = None  # Started only when there is much to probe.
+        self.pending: dict = {}  # Number of files of each running task.
+
+        self.found: int = 0  # Files found so far.
+        self.processed: int = 0  # Files which are already passed to on_batch.
+        self.updated: int = 0  # Files probed during this scan.
+        self.batch: list = []
+
+    def cancel(self) -> None:
+        '''Stops scan as soon as possible, songs passed so far stay valid.'''
+        self.cancelled.set()
+
+    def files(self):
+        '''Yields path, modification time and size of every song to scan.'''
+        if self.paths is None:
+            yield from walk(self.directory, self.cancelled)
+            return
+        for path in self.paths:
+            if os.path.isdir(path) and not os.path.islink(path):
+                yield from walk(path, self.cancelled)
+            elif os.path.isfile(path) and path.lower().endswith(EXTENSIONS):
+                stat = os.stat(path)
+                yield path, stat.st_mtime_ns, stat.st_size
+
+    def run(self) -> None:
+        try:
+            self.scan()
+        except Exception as e:
+            l.error(f'Scanning {self.directory} failed: {e!r}')
+        finally:
+            if self.executor:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+            # Owner waits for this to apply changes found meanwhile, so it's called whatever happened.
+            if self.on_finished:
+                self.on_finished(self.cancelled.is_set())
+
+    def scan(self) -> None:
+        if self.paths is None:
+            known: dict = self.index.known(self.directory)
+        else:
+            known: dict = self.index.known_paths(self.paths)
+        # Limit of running tasks, so results keep coming while directories are walked.
+        limit: int = 4 * (self.workers or os.cpu_count() or 1)
+        chunk: list = []
+        for path, mtime, size in self.files():
+            if self.cancelled.is_set():
+                break
+            self.found += 1
+            row = known.pop(path, None)
+            if row is not None and row['mtime'] == mtime and row['size'] == size:
+                self.add([as_song(row)])
+                continue
+            chunk.append((path, mtime, size))
+            if len(chunk) >= PROBE_CHUNK:
+                self.submit(chunk)
+                chunk = []
+                self.collect(None if len(self.pending) >= limit else 0)
+
+        if chunk and not self.cancelled.is_set():
+            if self.executor:
+                self.submit(chunk)
+            else:
+                # Few changed files are probed right away, starting workers would take longer.
+                self.probed(probe_many(chunk))
+        while self.pending and not self.cancelled.is_set():
+            self.collect(None)
+        if self.executor:
+            self.executor.shutdown(wait=not self.cancelled.is_set(), cancel_futures=True)
+            self.executor = None
+
+        cancelled: bool = self.cancelled.is_set()
+        if not cancelled:
+            # Files that are no longer in directory, unknown after cancelled scan.
+            self.index.remove(known)
+        self.flush()
+        if known and not cancelled and self.on_removed:
+            self.on_removed([as_song(row) for row in known.values()])
+        l.info(f'Scanned {self.directory}: {self.found} found, {self.updated} updated, '
+               f'{0 if cancelled else len(known)} removed.')
+
+    def create_executor(self) -> ProcessPoolExecutor:
+        # Forked worker would inherit threads and audio of the game, fresh process imports only this module.
+        return ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'))
+
+    def submit(self, chunk: list) -> None:
+        self.executor = self.executor or self.create_executor()
+        try:
+            self.pending[self.executor.submit(probe_many, chunk)] = len(chunk)
+        except BrokenProcessPool as e:
+            self.failed(len(chunk), e)
+
+    def collect(self, timeout: float) -> None:
+        '''Passes songs from finished tasks.'''
+        if not self.pending:
+            return
+        done, _ = wait(self.pending, timeout, FIRST_COMPLETED)
+        for future in done:
+            count: int = self.pending.pop(future)
+            try:
+                songs: list = future.result()
+            except BrokenProcessPool as e:
+                # Worker died, e.g. crashed decoder or killed for memory.
+                self.failed(count, e)
+                return
+            self.probed(songs)
+
+    def failed(self, count: int, error: Exception) -> None:
+        '''Gives up files of broken pool, they are probed at next scan, and starts new pool.'''
+        # Broken pool fails all its tasks at once, so they are given up together.
+        count += sum(self.pending.values())
+        self.pending.clear()
+        l.error(f'Probing {count} files failed: {error!r}')
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+
+    def probed(self, songs: list) -> None:
+        self.index.update(songs)
+        rowids: dict = self.index.rowids(song['path'] for song in songs)
+        for song in songs:
+            song['rowid'] = rowids[song['path']]
+        self.updated += len(songs)
+        self.add([as_song(song) for song in songs])
+
+    def add(self, songs: list) -> None:
+        self.batch.extend(songs)
+        self.processed += len(songs)
+        if len(self.batch) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.batch:
+            self.on_batch(self.batch)
+            self.batch = []
+        if self.on_progress:
+            self.on_progress(self.processed, self.found)
@@ -1,70 +1,170 @@
 import os
 import sys
+import time
+import threading
+
+# Moment of start, used for measuring startup time.
+STARTED = time.perf_counter()
 
 # Logging
 import logging as l
 
 # Random number generation
-import random
+import secrets
 
 # Handling configuration file
 import configparser
 import codecs
 
-# Audio playback and bitrate check
-import wave
-from pygame import mixer
-from mutagen import mp3
+from typing import TYPE_CHECKING, Callable
 
-# PyQt5
-from PyQt5 import uic, QtTest
+# PyQt5, QtWebEngine is imported only when browser is needed.
+from PyQt5 import uic
 from PyQt5.QtGui import QFontDatabase, QFont, QKeyEvent
 from PyQt5.QtWidgets import *
-from PyQt5.QtWebEngineWidgets import *
-from PyQt5.QtCore import QTimer, QUrl, Qt
+from PyQt5.QtCore import QTimer, QUrl, Qt, pyqtSignal, pyqtSlot
 
 # Serial connection handling
-import serial
 from serial.tools import list_ports
+from buzzers import BuzzerPress, SerialMultiplexer
+from instrumentation import instruments, timed
+from journal import Journal, restore_scores
+from scoreboard import RankingModel, ScoreboardModel, ScoreboardView
+from engine import (GameEngine, GameEvent, NEW_GAME, NO_SONGS, PAUSED, RESUMED, SCORED,
+                    SONG_STARTED, STOPPED, S_PLAYING, TEAM_GUESSING, Silencer)
+
+# Audio playback, library and Spotify are slow to import, so they are
+# imported in background once window is shown.
+if TYPE_CHECKING:
+    from audio import AudioOutput, SongPrefetcher
+    from features import FeatureAnalyser, FeatureIndex
+    from library import LibraryIndex, LibraryScanner
+    from song_queue import SongQueue
+    from watcher import LibraryWatcher
+    from netbuzz import NetworkBuzzerServer
+    from spotipy.client import Spotify
+    from spotipy.oauth2 import SpotifyOAuth
+
+from spotify_worker import LOAD, NEXT, PAUSE, RESUME, SpotifyWorker
+
+DEFAULT_REFRESH_RATE = 60  # Used when screen doesn't report its refresh rate.
+
+
+class StartupProfiler:
+    '''Measures time spent in each phase of startup, enabled with --profile-startup.'''
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled: bool = enabled
+        self.last: float = STARTED  # End of previous phase.
+        self.phases: list = []  # Name, duration and time since start of each phase.
+        self.running: dict = {}  # Start of each background phase that is running.
+        self.reported: bool = False
+        self.lock: threading.Lock = threading.Lock()
+
+    def mark(self, phase: str) -> None:
+        '''Ends phase done in main thread.'''
+        now: float = time.perf_counter()
+        with self.lock:
+            self.phases.append((phase, now - self.last, now - STARTED))
+        self.last = now
+
+    def begin(self, phase: str) -> None:
+        '''Starts phase done in background.'''
+        with self.lock:
+            self.running[phase] = time.perf_counter()
+
+    def end(self, phase: str) -> None:
+        '''Ends phase done in background, reports once all of them ended.'''
+        now: float = time.perf_counter()
+        with self.lock:
+            self.phases.append((f'{phase} (background)', now - self.running.pop(phase), now - STARTED))
+            done: bool = not self.running
+        if done:
+            self.report()
+
+    def report(self) -> None:
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        print('Startup phases:')
+        for phase, duration, total in self.phases:
+            print(f'  {phase:<32} {duration * 1000:9.1f} ms {total * 1000:9.1f} ms since start', flush=True)
 
-# Spotify
-import spotipy
-from spotipy import cache_handler
-from spotipy.cache_handler import CacheFileHandler
-from spotipy.client import Spotify
-from spotipy.oauth2 import SpotifyOAuth
-
-MAX_TEAM_NUMBER = 6
 
 class Ui(QMainWindow):
-    '''Main Window'''
-
-    S_PLAYING = 0
-    S_PAUSED = 1
-    S_STOPPED = 2
-
-    def __init__(self) -> None:
+    '''Main Window, shows state of the game engine and passes actions to it.'''
+
+    # Emitted from reader threads, delivered to GUI thread.
+    buzzer_pressed = pyqtSignal(object)
+    # Emitted from library scanner with number of scan they come from.
+    songs_found = pyqtSignal(int, list)
+    scan_progress = pyqtSignal(int, int, int)
+    scan_finished = pyqtSignal(int, bool)
+    songs_removed = pyqtSignal(int, list)
+    library_changed = pyqtSignal(list)
+    # Emitted from feature analyser with paths of songs that are already loaded.
+    duplicates_found = pyqtSignal(list)
+    # Emitted from Spotify worker.
+    spotify_track = pyqtSignal(dict)
+    spotify_error = pyqtSignal(str, str)
+    # Emitted from remote engine with events of attached room.
+    room_event = pyqtSignal(object)
+    # Emitted from background initialisation with name, function to call and its argument.
+    background_done = pyqtSignal(str, object, object)
+
+    def __init__(self, profiler: StartupProfiler = None, room: str = None,
+                 time_ns: Callable[[], int] = time.monotonic_ns) -> None:
         super().__init__()
+        self.profiler: StartupProfiler = profiler or StartupProfiler(False)
+        # Clock of the game, replaced by virtual one in simulation.
+        self.time_ns: Callable[[], int] = time_ns
+        # Address of room of room server, window is then only its front end.
+        self.room: str = room
         uic.loadUi('data/window.ui', self)
+        self.profiler.mark('window loaded')
 
         # Logging.
         l.basicConfig()
         l.info('Starting program.')
 
-        self.serial = serial.Serial()  # Used for serial connection to Arduino.
-
-        # Used for playing music
-        mixer.init()
-
-        # Stores dictionary conaining data of currently playing song
-        self.current_song: str = None
-        self.guessing_team: int = None  # Stores index of team that pressed button first
-        # Stores current state of game (S_PLAYING, S_STOPPED, S_PAUSED, S_GUESSING)
-        self.playback_state: int = self.S_PAUSED
-        self.is_team_guessing: bool = False
-        self.millis: int = 0  # Position of the song
-        self.team_scores: list[int] = [0, 0, 0, 0, 0, 0]  # Scores of each team
+        # Reads presses from all connected Arduinos.
+        self.serial_multiplexer: SerialMultiplexer = SerialMultiplexer(self.submit_press)
+
+        # Used for playing music, opened in background.
+        self.output: AudioOutput = None
+        # Metadata of local songs, opened in background.
+        self.library: LibraryIndex = None
+        # Loudness of local songs, used to start them in their loud part.
+        self.features: FeatureIndex = None
+        self.analyser: FeatureAnalyser = None
+
+        # Game state, created once settings are loaded.
+        self.engine: GameEngine = None
+        # Last values shown by timer label and progress bar, used to skip redundant redraws.
+        self.shown_timer_text: str = None
+        self.shown_progress: int = None
         self.arduino_connected = False
+        # Sends commands to Spotify in background.
+        self.spotify_worker: SpotifyWorker = None
+        self.song_queue: SongQueue = None  # Local songs waiting to be played.
+        self.queued_directory: str = None  # Directory of songs in the queue.
+        # Scans songs directory in background.
+        self.scanner: LibraryScanner = None
+        self.scan_id: int = 0  # Number of last scan, used to ignore results of old ones.
+        # Reports changes of songs directory, so they are applied without full scan.
+        self.watcher: LibraryWatcher = None
+        self.changed_paths: set = set()  # Changes waiting for running scan to finish.
+        # Reads next song in background, so it starts without delay.
+        self.prefetcher: SongPrefetcher = None
+        self.debug_dialog: DebugDialog = None  # Hidden panel with latency histograms.
+        self.journal: Journal = None  # Game events, so scores survive crash.
+        self.network_server: NetworkBuzzerServer = None
+        # Moment when next song was requested.
+        self.next_clicked_ns: int = None
+        # Delay between clicking next and first audio of last song.
+        self.start_latency_ms: float = None
+        # Silences song at first press and measures delay between them.
+        self.silencer: Silencer = Silencer(time_ns)
 
         # Loading widgets
         # Title of the song.
@@ -77,30 +177,10 @@ class Ui(QMainWindow):
         self.label_timer: QLabel = self.findChild(QLabel, 'l_timer')
         # Status of connection to Arduino.
         self.label_status: QLabel = self.findChild(QLabel, 'l_status')
-        self.label_team_names: list[QLabel] = [
-            self.findChild(QLabel, 'l_team1n'),
-            self.findChild(QLabel, 'l_team2n'),
-            self.findChild(QLabel, 'l_team3n'),
-            self.findChild(QLabel, 'l_team4n'),
-            self.findChild(QLabel, 'l_team5n'),
-            self.findChild(QLabel, 'l_team6n'),
-        ]  # Names of the teams.
-        self.label_team_scores: list[QLabel] = [
-            self.findChild(QLabel, 'l_team1s'),
-            self.findChild(QLabel, 'l_team2s'),
-            self.findChild(QLabel, 'l_team3s'),
-            self.findChild(QLabel, 'l_team4s'),
-            self.findChild(QLabel, 'l_team5s'),
-            self.findChild(QLabel, 'l_team6s'),
-        ]  # Scores of the teams.
-        self.widget_team: list[QWidget] = [
-            self.findChild(QWidget, 'w_team1'),
-            self.findChild(QWidget, 'w_team2'),
-            self.findChild(QWidget, 'w_team3'),
-            self.findChild(QWidget, 'w_team4'),
-            self.findChild(QWidget, 'w_team5'),
-            self.findChild(QWidget, 'w_team6'),
-        ]
+        # Progress of library scan.
+        self.label_library: QLabel = self.findChild(QLabel, 'l_library')
+        # Names and scores of the teams.
+        self.view_scoreboard: ScoreboardView = self.findChild(ScoreboardView, 'v_scoreboard')
         # Opens settings dialog.
         self.button_settings: QPushButton = self.findChild(
             QPushButton, 'b_settings')
@@ -118,10 +198,17 @@ class Ui(QMainWindow):
             QProgressBar, 'p_progress')
 
         # Creating timers
-        # Reads serial date every 100ms.
-        self.timer_serial: QTimer = QTimer(self)
-        # Updates progress bar and checks if song is over.
+        # Updates progress bar once per frame of the display.
         self.timer_song: QTimer = QTimer(self)
+        self.timer_song.setInterval(self.refresh_interval())
+        # Stops the song once playback time is over.
+        self.timer_cutoff: QTimer = QTimer(self)
+        self.timer_cutoff.setSingleShot(True)
+        self.timer_cutoff.setTimerType(Qt.PreciseTimer)
+        # Chooses team that pressed first once tie window is over.
+        self.timer_arbiter: QTimer = QTimer(self)
+        self.timer_arbiter.setSingleShot(True)
+        self.timer_arbiter.setTimerType(Qt.PreciseTimer)
 
         # Attaching functions to widgets
         self.button_settings.clicked.connect(self.open_settings)
@@ -130,15 +217,171 @@ class Ui(QMainWindow):
         self.button_yes.clicked.connect(self.answer_correct)
         self.button_no.clicked.connect(self.answer_incorrect)
 
-        self.timer_serial.timeout.connect(self.update_serial)
+        self.buzzer_pressed.connect(self.schedule_arbitration)
+        self.timer_arbiter.timeout.connect(self.resolve_presses)
+        self.songs_found.connect(self.add_songs)
+        self.scan_progress.connect(self.update_scan_progress)
+        self.scan_finished.connect(self.finish_scan)
+        self.songs_removed.connect(self.remove_songs)
+        self.library_changed.connect(self.update_songs)
+        self.duplicates_found.connect(self.remove_duplicates)
+        self.spotify_track.connect(self.start_spotify_song)
+        self.spotify_error.connect(self.spotify_failed)
+        self.room_event.connect(self.on_game_event)
+        self.background_done.connect(self.finish_background)
         self.timer_song.timeout.connect(self.update_song)
+        self.timer_cutoff.timeout.connect(self.playback_time_over)
 
-        # Loading settings and songs
+        # Loading settings, songs are loaded once window is shown
         self.config: configparser.ConfigParser = configparser.ConfigParser()
         self.load_settings()
-        self.load_songs()
+        self.refresh_buttons()
+        self.profiler.mark('settings loaded')
 
         self.show()
+        self.profiler.mark('window shown')
+        QTimer.singleShot(0, self.start_subsystems)
+
+    def run_in_background(self, name: str, function, callback) -> None:
+        '''Calls function in background thread, then passes its result to callback in GUI thread.'''
+        def run() -> None:
+            self.profiler.begin(name)
+            try:
+                result = function()
+            except Exception as e:
+                l.error(f'Initialising {name} failed: {e}')
+                self.profiler.end(name)
+                return
+            self.background_done.emit(name, callback, result)
+        threading.Thread(target=run, name=name, daemon=True).start()
+
+    def finish_background(self, name: str, callback, result) -> None:
+        callback(result)
+        self.profiler.end(name)
+
+    def start_subsystems(self) -> None:
+        '''Initialises slow subsystems in background once window is shown.'''
+        self.profiler.mark('first events processed')
+        if self.room:
+            self.engine.start()
+            return
+        if self.use_spotify:
+            self.run_in_background('spotify', self.open_spotify_oauth, self.connect_spotify)
+        else:
+            self.run_in_background('audio', self.open_audio, self.audio_opened)
+            self.run_in_background('library', self.open_library, self.library_opened)
+            # Analysis finds duplicates even when songs start at the beginning.
+            self.run_in_background('features', self.open_features, self.features_opened)
+        if self.config['Network'].getboolean('enabled'):
+            self.start_network_server()
+
+    def start_network_server(self) -> None:
+        '''Accepts presses from phones and wireless buzzers, in its own thread.'''
+        from netbuzz import NetworkBuzzerServer
+        codes: dict = {
+            i: self.config['Team Codes'][f'team_{i + 1}'] for i in range(self.number_teams)
+        }
+        self.network_server = NetworkBuzzerServer(
+            codes, self.submit_press,
+            self.config['Network']['host'],
+            int(self.config['Network']['port']),
+            int(self.config['Network']['udp_port']))
+        self.network_server.start()
+
+    def open_audio(self) -> 'AudioOutput':
+        from audio import AudioOutput
+        return AudioOutput(
+            int(self.config['Settings']['output_frequency']),
+            int(self.config['Settings']['output_buffer']))
+
+    def audio_opened(self, output: 'AudioOutput') -> None:
+        from audio import SongPrefetcher
+        self.output = output
+        self.prefetcher = SongPrefetcher(self.pop_song)
+        self.prefetcher.max_seconds = self.playback_time
+        if self.features and self.loud_snippets:
+            self.prefetcher.snippet_start = self.features.snippet_start
+        self.prefetcher.prefetch()
+
+    def open_library(self) -> 'LibraryIndex':
+        from library import LibraryIndex
+        return LibraryIndex(os.path.join('cache', 'library.sqlite'))
+
+    def library_opened(self, library: 'LibraryIndex') -> None:
+        from song_queue import SongQueue
+        self.library = library
+        self.song_queue = SongQueue(library)
+        self.load_songs()
+
+    def open_features(self) -> 'FeatureIndex':
+        from features import FeatureIndex
+        return FeatureIndex(os.path.join('cache', 'features.sqlite'))
+
+    def features_opened(self, features: 'FeatureIndex') -> None:
+        from features import FeatureAnalyser
+        self.features = features
+        if self.prefetcher and self.loud_snippets:
+            self.prefetcher.snippet_start = features.snippet_start
+        # Songs are analysed once in background, picking snippet costs nothing later.
+        self.analyser = FeatureAnalyser(features, self.duplicates_found.emit)
+        self.analyser.start()
+        # Songs scanned so far are passed again, queue skips them.
+        if self.queued_directory:
+            self.load_songs(rescan=True)
+
+    def open_spotify_oauth(self) -> tuple:
+        '''Creates Spotify authorisation, returns it with validity of cached token.'''
+        from spotipy.cache_handler import CacheFileHandler
+        from spotipy.oauth2 import SpotifyOAuth
+        from spotipy.client import Spotify  # Imported here, so it's ready when connecting.
+
+        scope = 'user-read-playback-state user-modify-playback-state user-read-currently-playing app-remote-control'
+        cache: CacheFileHandler = CacheFileHandler(
+            cache_path=os.path.join(os.getcwd(), 'cache/.spotify_cache')
+        )
+        oauth: SpotifyOAuth = SpotifyOAuth(
+            client_id=self.config['Settings']['spotify_client_id'],
+            client_secret=self.config['Settings']['spotify_client_secret'],
+            redirect_uri=self.config['Settings']['spotify_redirect_uri'],
+            scope=scope,
+            open_browser=False,
+            cache_handler=cache
+        )
+        return oauth, bool(oauth.validate_token(cache.get_cached_token()))
+
+    def connect_spotify(self, result: tuple) -> None:
+        '''Logs in if needed and starts Spotify worker.'''
+        from spotipy.client import Spotify
+        from spotify_worker import SpotifyCatalog, create_session
+
+        self.spotify_oauth, valid = result
+        if not valid:
+            url: QUrl = QUrl(self.spotify_oauth.get_authorize_url())
+            dialog: QDialog = BrowserDialog(self, url)
+            dialog.exec_()
+            response_url: str = dialog.browser.url().toString()
+            code: str = self.spotify_oauth.parse_response_code(response_url)
+            self.spotify_oauth.get_access_token(code, as_dict=False)
+        self.spotify: Spotify = Spotify(
+            oauth_manager=self.spotify_oauth, requests_session=create_session())
+        # Web API can be replaced with local stand-in, e.g. by benchmarks.
+        if self.config['Settings'].get('spotify_api_url'):
+            self.spotify.prefix = self.config['Settings']['spotify_api_url']
+        # Tracks of active playlist, so rounds are started with single request.
+        catalog: SpotifyCatalog = SpotifyCatalog(
+            os.path.join(os.getcwd(), 'cache/spotify_tracks.json'))
+        self.spotify_worker = SpotifyWorker(
+            self.spotify, self.spotify_track.emit, self.spotify_error.emit, catalog,
+            self.silencer.report)
+        self.spotify_worker.start()
+        self.spotify_worker.send(PAUSE)
+        self.spotify_worker.send(LOAD)
+
+    def send_spotify(self, command: str) -> None:
+        if self.spotify_worker:
+            self.spotify_worker.send(command)
+        else:
+            l.warning('Spotify is not connected yet.')
 
     def load_settings(self) -> None:
         '''Loads settings from custom or default config file and applies them.'''
@@ -156,14 +399,19 @@ class Ui(QMainWindow):
         self.songs_directory: str = str(
             self.config['Settings']['songs_directory'])
 
-        self.serial_port: str = str(
-            self.config['Settings']['serial_port'])
+        # Older config files have single port.
+        self.serial_ports: list = [
+            port.strip() for port in (self.config['Settings'].get('serial_ports')
+                                      or self.config['Settings'].get('serial_port', '')).split(',')
+            if port.strip()
+        ]
 
         self.use_spotify: bool = bool(
             self.config['Settings']['use_spotify'])
 
-        self.playback_time: int = int(
-            self.config['Rules']['playback_time'])
+        instruments.enabled = self.config['Settings'].getboolean('instrumentation')
+
+        self.loud_snippets: bool = self.config['Rules'].getboolean('loud_snippets')
 
         self.points_correct: int = int(
             self.config['Rules']['points_correct'])
@@ -171,97 +419,259 @@ class Ui(QMainWindow):
         self.points_incorrect: int = int(
             self.config['Rules']['points_incorrect'])
 
-        for i, name in enumerate(self.config['Team Names'].values()):
-            self.label_team_names[i].setText(str(name))
-        
         self.number_teams: int = int(self.config['Rules']['number_teams'])
-        # Disabling unused team labels
-        for i in range(self.number_teams, 6):
-            self.widget_team[i].hide()
 
-        self.use_spotify: bool = self.config['Settings'].getboolean('use_spotify')
+        # Codes of teams for network buzzers, generated once and saved with settings.
+        for i in range(self.number_teams):
+            if not self.config['Team Codes'].get(f'team_{i + 1}'):
+                self.config['Team Codes'][f'team_{i + 1}'] = secrets.token_hex(3)
 
-        if self.use_spotify:
-            scope = 'user-read-playback-state user-modify-playback-state user-read-currently-playing app-remote-control'
-            self.spotify_cache: CacheFileHandler = CacheFileHandler(
-                cache_path=os.path.join(os.getcwd(), 'cache/.spotify_cache')
-            )
-            self.spotify_oauth: SpotifyOAuth = SpotifyOAuth(
-                client_id=self.config['Settings']['spotify_client_id'],
-                client_secret=self.config['Settings']['spotify_client_secret'],
-                redirect_uri=self.config['Settings']['spotify_redirect_uri'],
-                scope=scope,
-                open_browser=False,
-                cache_handler=self.spotify_cache
-            )
-            if not self.spotify_oauth.validate_token(self.spotify_cache.get_cached_token()):
-                url: QUrl = QUrl(self.spotify_oauth.get_authorize_url())
-                dialog: QDialog = BrowserDialog(self, url)
-                dialog.exec_()
-                response_url: str = dialog.browser.url().toString()
-                code: str = self.spotify_oauth.parse_response_code(response_url)
-                self.spotify_oauth.get_access_token(code, as_dict=False)
-            self.spotify: Spotify = Spotify(oauth_manager=self.spotify_oauth)
+        # Read once, presses look names up by index.
+        self.team_names: list[str] = [
+            self.config['Team Names'].get(f'team_{i + 1}', f'Team {i + 1}')
+            for i in range(self.number_teams)
+        ]
+
+        if self.room:
             try:
-                self.spotify.pause_playback()
-            except Exception as e:
-                print(e)
+                self.attach_room()
+                return
+            except (OSError, ValueError) as e:
+                # Own game is played instead, so the window is still usable.
+                l.error(f'Attaching to room {self.room} failed: {e}')
+                QMessageBox.warning(self, 'Room', f'Attaching to room {self.room} failed:\n{e}')
+                self.room = None
+
+        # Owns state of the game, window only observes it.
+        self.engine = GameEngine(
+            self.number_teams,
+            int(self.config['Rules']['playback_time']),
+            self.points_correct,
+            self.points_incorrect,
+            int(self.config['Rules']['tie_window_us']),
+            self.config['Rules'].getboolean('lockout_incorrect'),
+            self.take_song,
+            self.time_ns)
+        self.engine.subscribe(self.on_game_event)
+
+        # Scores of interrupted game are restored from journal.
+        journal_path: str = os.path.join('cache', 'journal.jsonl')
+        self.engine.team_scores = restore_scores(journal_path, self.number_teams)
+        self.scoreboard: ScoreboardModel = ScoreboardModel(self.team_names, self.engine.team_scores)
+        self.ranking: RankingModel = None
+        self.show_ranking(self.config['Settings'].getboolean('rank_teams'))
+        self.journal = Journal(journal_path)
+        self.engine.subscribe(self.journal.record_event)
+
+        self.use_spotify: bool = self.config['Settings'].getboolean('use_spotify')
 
-    def load_songs(self) -> None:
-        '''Loads songs and shuffles them automatically.'''
+    def attach_room(self) -> None:
+        '''Uses game of the room instead of own one, room plays the songs.'''
+        from remote import RemoteEngine
+        self.engine = RemoteEngine(self.room)
+        self.engine.subscribe(self.room_event.emit)
+        self.number_teams = self.engine.number_teams
+        self.team_names = self.engine.team_names
+        self.scoreboard: ScoreboardModel = ScoreboardModel(self.team_names, self.engine.team_scores)
+        self.ranking: RankingModel = None
+        self.show_ranking(self.config['Settings'].getboolean('rank_teams'))
+        self.use_spotify = False
+
+    def load_songs(self, rescan: bool = False) -> None:
+        '''Starts scanning songs directory, unless its songs are already queued.'''
         # Check if song dir is selected and if its real
-        if not self.use_spotify:
+        if not self.use_spotify and self.library is not None:
             if self.songs_directory and os.path.exists(self.songs_directory):
-                # Clear and create new songs list
-                self.loaded_songs: list = []
-                for file in os.listdir(self.songs_directory):
-                    if file.endswith('.mp3') or file.endswith('.wav'):
-                        self.loaded_songs.append(
-                            {
-                                'path': os.path.join(self.songs_directory, file),
-                                'name': file[:-4],
-                                'extension': file[-3:]
-                            }
-                        )
-                random.shuffle(self.loaded_songs)
-                l.info(f'Loaded {len(self.loaded_songs)} songs')
-
-    def team_pressed(self, n: int) -> None:
-        if not self.is_team_guessing:
-            if self.playback_state == self.S_PLAYING:
-                # Pausing playback of the song only if song is playing.
-                self.pause_playback()
-
-            self.is_team_guessing = True
-            self.guessing_team = n
-
-            # Updating visuals.
-            team_name = list(self.config['Team Names'].values())[n]
-            self.label_team.setText(team_name)
-            self.button_yes.setEnabled(True)
-            self.button_no.setEnabled(True)
-            self.button_next.setEnabled(False)
-            self.button_pause_resume.setEnabled(False)
-
-    def update_serial(self) -> None:
-        if self.serial.inWaiting():
-            team = int(self.serial.read()) 
-            print(team)
-            self.team_pressed(team)
-
+                if self.songs_directory == self.queued_directory and not rescan:
+                    return
+                if self.scanner:
+                    self.scanner.cancel()
+
+                if self.songs_directory != self.queued_directory:
+                    from watcher import LibraryWatcher
+                    # Clear queue of other directory, only changed files are read.
+                    self.song_queue.clear()
+                    self.queued_directory = self.songs_directory
+                    if self.analyser:
+                        self.analyser.forget()
+                    # Song prepared from previous queue comes from other directory.
+                    if self.prefetcher:
+                        self.prefetcher.reset()
+                    # Changes during scan are applied once it finishes.
+                    if self.watcher:
+                        self.watcher.stop()
+                    self.changed_paths.clear()
+                    self.watcher = LibraryWatcher(self.songs_directory, self.library_changed.emit)
+                    self.watcher.start()
+                self.start_scanner()
+
+    def start_scanner(self, paths: list = None) -> None:
+        '''Scans songs directory, or only given paths inside it.'''
+        from library import LibraryScanner
+        self.scan_id += 1
+        scan_id: int = self.scan_id
+        self.scanner = LibraryScanner(
+            self.library, self.songs_directory,
+            lambda songs: self.songs_found.emit(scan_id, songs),
+            lambda processed, found: self.scan_progress.emit(scan_id, processed, found),
+            lambda cancelled: self.scan_finished.emit(scan_id, cancelled),
+            paths=paths,
+            on_removed=lambda songs: self.songs_removed.emit(scan_id, songs))
+        self.scanner.start()
+
+    def update_songs(self, paths: list) -> None:
+        '''Applies changes reported by watcher, queue keeps its order.'''
+        self.changed_paths.update(paths)
+        if self.scanner is None and self.changed_paths:
+            l.info(f'Applying {len(self.changed_paths)} changes of songs directory.')
+            self.start_scanner(sorted(self.changed_paths))
+            self.changed_paths.clear()
+
+    def add_songs(self, scan_id: int, songs: list) -> None:
+        '''Adds batch of scanned songs to the queue.'''
+        if scan_id != self.scan_id:
+            return
+        self.song_queue.add(songs)
+        if self.analyser:
+            self.analyser.add(songs)
+        if self.prefetcher:
+            self.prefetcher.prefetch()
+
+    def remove_duplicates(self, paths: list) -> None:
+        '''Leaves single copy of every song in the queue.'''
+        self.song_queue.remove(self.library.rowids(paths).values())
+        if self.scanner is None:
+            self.label_library.setText(f'{len(self.song_queue)} songs')
+
+    def remove_songs(self, scan_id: int, songs: list) -> None:
+        '''Removes songs whose files are gone.'''
+        if scan_id == self.scan_id:
+            self.song_queue.forget(song['rowid'] for song in songs)
+
+    def update_scan_progress(self, scan_id: int, processed: int, found: int) -> None:
+        if scan_id == self.scan_id:
+            self.label_library.setText(f'Scanning songs: {processed}/{found}')
+
+    def finish_scan(self, scan_id: int, cancelled: bool) -> None:
+        if scan_id == self.scan_id:
+            self.scanner = None
+            self.label_library.setText(f'{len(self.song_queue)} songs')
+            l.info(f'Loaded {len(self.song_queue)} songs')
+            self.update_songs([])
+
+    def take_song(self) -> dict:
+        '''Returns next decoded song for the engine.'''
+        # Song was decoded in background while previous one was playing.
+        return self.prefetcher.take() if self.prefetcher else None
+
+    def pop_song(self) -> dict:
+        '''Removes next song from the queue and returns it.'''
+        if self.song_queue is not None:
+            return self.song_queue.take()
+        return None
+
+    @timed('submit_press')
+    def submit_press(self, press: BuzzerPress) -> None:
+        '''Passes press to engine, can be called from any thread.'''
+        if self.engine.press(press):
+            self.silence(press)
+            self.buzzer_pressed.emit(press)
+
+    @timed('team_pressed')
+    def team_pressed(self, press: BuzzerPress) -> None:
+        '''Handles press made in GUI thread.'''
+        if self.engine.press(press):
+            self.silence(press)
+            self.schedule_arbitration()
+
+    def silence(self, press: BuzzerPress) -> None:
+        '''Silences the song right after first press, can be called from any thread.'''
+        self.silencer.silence(
+            press, self.engine.playback_state,
+            (lambda: self.send_spotify(PAUSE)) if self.use_spotify else None, self.output)
+
+    def schedule_arbitration(self) -> None:
+        '''Resolves presses once tie window of current contest is over.'''
+        deadline: int = self.engine.arbitration_deadline()
+        if deadline is not None:
+            delay: int = max(0, -(-(deadline - self.time_ns()) // 1_000_000))
+            if not self.timer_arbiter.isActive() or self.timer_arbiter.remainingTime() > delay:
+                self.timer_arbiter.start(delay)
+
+    @timed('timer resolve_presses')
+    def resolve_presses(self) -> None:
+        if self.engine.resolve(self.time_ns()) is None:
+            # Timer fired before the end of tie window.
+            self.schedule_arbitration()
+
+    def open_serial_ports(self) -> int:
+        '''Opens all selected serial ports, returns number of open ports.'''
+        for port in self.serial_ports:
+            if port not in self.serial_multiplexer.open_ports:
+                try:
+                    self.serial_multiplexer.open(port)
+                except Exception as e:
+                    l.error(f'Opening {port} failed: {e}')
+        return len(self.serial_multiplexer.open_ports)
+
+    def close_serial_ports(self) -> None:
+        self.serial_multiplexer.close_all()
+
+    @property
+    def millis(self) -> int:
+        '''Position of the song in milliseconds.'''
+        return self.engine.millis
+
+    @property
+    def playback_time(self) -> int:
+        return self.engine.playback_time
+
+    @playback_time.setter
+    def playback_time(self, value: int) -> None:
+        self.engine.playback_time = value
+
+    def refresh_interval(self) -> int:
+        '''Returns interval in milliseconds matching refresh rate of the screen.'''
+        screen = QApplication.primaryScreen()
+        rate: float = screen.refreshRate() if screen else 0
+        if rate <= 0:
+            rate = DEFAULT_REFRESH_RATE
+        return max(1, int(1000 / rate))
+
+    def start_song_timers(self) -> None:
+        '''Starts refreshing visuals and schedules stop at the end of playback time.'''
+        remaining: int = max(0, self.playback_time*1000 - self.millis)
+        self.timer_cutoff.start(remaining)
+        self.timer_song.start()
+        self.update_song()
+
+    def stop_song_timers(self) -> None:
+        self.timer_cutoff.stop()
+        self.timer_song.stop()
+        self.update_song()
+
+    @timed('timer update_song')
     def update_song(self) -> None:
-        '''Updates progress bar and checks if song should be stopped.'''
-        self.millis += 1
-        seconds: int = int((self.millis/1000) % 60)
-        minutes: int = int((self.millis/(1000*60)) % 60)
+        '''Updates timer label and progress bar, redrawing only values that changed.'''
+        millis: int = min(self.millis, self.playback_time*1000)
+        seconds: int = int((millis/1000) % 60)
+        minutes: int = int((millis/(1000*60)) % 60)
         text: str = f'{minutes:02d}:{seconds:02d}'
-        value: int = int(self.millis/self.playback_time/10)
-
-        self.label_timer.setText(text)
-        self.progress_bar.setValue(value)
-
-        if self.millis >= self.playback_time*1000:
-            self.stop_playback()
+        value: int = int(millis/self.playback_time/10) if self.playback_time else 100
+
+        if text != self.shown_timer_text:
+            self.shown_timer_text = text
+            self.label_timer.setText(text)
+        if value != self.shown_progress:
+            self.shown_progress = value
+            self.progress_bar.setValue(value)
+
+    @timed('timer playback_time_over')
+    def playback_time_over(self) -> None:
+        '''Stops the song when playback time is over.'''
+        # Timer may fire slightly early, so it's rescheduled for remaining time.
+        if not self.engine.check_time():
+            self.timer_cutoff.start(max(0, self.engine.remaining_ms()))
 
     def open_settings(self) -> None:
         '''Opens dialog for selecting settings.'''
@@ -269,200 +679,192 @@ class Ui(QMainWindow):
         dialog: QDialog = SettingsDialog(self)
         dialog.exec_()
         l.info('Settings dialog closed.')
+        # Song prepared before was cut to previous playback time.
+        if self.prefetcher and self.prefetcher.max_seconds != self.playback_time:
+            self.prefetcher.max_seconds = self.playback_time
+            self.prefetcher.refresh()
+        # Queue is kept unless directory changed.
         self.load_songs()
 
+    @pyqtSlot()
+    @timed('next_playback')
     def next_playback(self) -> None:
         if self.use_spotify:
-            try:
-                self.spotify.next_track()
-                QtTest.QTest.qWait(200)
-                response = self.spotify.currently_playing()
-                name = response['item']['name']
-                artists = ''
-                for artist in response['item']['artists']:
-                    if artists:
-                        artists += ', '
-                    artists += str(artist['name'])
-                print(name, artists)
-
-                self.current_song = song = {'name': name, 'arists': artists}
-                self.millis = 0
-                self.playback_state = self.S_PLAYING
-
-                # Updating visuals
-                self.progress_bar.setValue(0)
-                self.label_title.setText(song['name'])
-                self.label_artist.setText(song['arists'])
-                self.label_team.setText('')
+            # Song is started once Spotify reports that track changed.
+            if self.spotify_worker and self.engine.can_play_next:
                 self.button_next.setEnabled(False)
-                self.button_pause_resume.setEnabled(True)
-                self.button_pause_resume.setText('Pause')
-
-                # Starting song timer
-                self.timer_song.start(1)
-
-            except Exception as e:
-                print(e)
+                self.send_spotify(NEXT)
         else:
-            if self.loaded_songs:
-                song = self.loaded_songs.pop()
-
-                # Defining song frequency to playback at right speed
-                freq = 44100
-                if song['extension'] == 'mp3':
-                    file = mp3.MP3(song['path'])
-                    freq = file.info.sample_rate
-                elif song['extension'] == 'wav':
-                    file = wave.open(song['path'])
-                    freq = file.getframerate()
-
-                # Setting right frequency and starting playback
-                mixer.quit()
-                mixer.init(frequency=freq)
-                mixer.music.load(song['path'])
-                mixer.music.play()
-
-                # Updating some variables
-                self.current_song = song
-                self.millis = 0
-                self.playback_state = self.S_PLAYING
-
-                # Updating visuals
-                self.progress_bar.setValue(0)
-                self.label_title.setText(song['name'])
-                self.label_artist.setText('')
-                self.label_team.setText('')
-                self.button_next.setEnabled(False)
-                self.button_pause_resume.setEnabled(True)
-                self.button_pause_resume.setText('Pause')
-
-                # Starting song timer
-                self.timer_song.start(1)
+            self.next_clicked_ns = self.time_ns()
+            self.engine.next_song()
 
-                l.info('Started playback.')
-            else:
-                # TODO Display warning dialog.
-                l.warning('No songs loaded!')
+    def start_spotify_song(self, song: dict) -> None:
+        '''Starts round after Spotify switched to next track.'''
+        l.info(f'Spotify switched to {song["name"]} by {song["artist"]}.')
+        self.engine.start_song(song)
 
+    def spotify_failed(self, command: str, error: str) -> None:
+        l.error(f'Spotify {command} failed: {error}')
+        if command == NEXT:
+            # Allowing to try again.
+            self.refresh_buttons()
 
     def pause_resume(self) -> None:
-        if self.playback_state == self.S_PLAYING:
-            self.pause_playback()
-        elif self.playback_state == self.S_PAUSED:
-            self.resume_playback()
+        self.engine.pause_resume()
 
-        
     def pause_playback(self) -> None:
-        if self.playback_state == self.S_PLAYING:
-            # Pausing playback and timer
-            if self.use_spotify:
-                try:
-                    self.spotify.pause_playback()
-                except Exception as e:
-                    print(e)
-            else:
-                mixer.music.pause()
-            
-            self.timer_song.stop()
+        self.engine.pause()
 
-            # Updating playback state
-            self.playback_state = self.S_PAUSED
+    def stop_playback(self) -> None:
+        self.engine.stop()
 
-            # Updating visuals
-            self.button_next.setEnabled(True)
-            self.button_pause_resume.setText('Resume')
-        else:
-            l.warning('Song is not playing.')
+    def resume_playback(self) -> None:
+        self.engine.resume()
 
-    def stop_playback(self) -> None:
-        if self.playback_state == self.S_PLAYING:
-            # Stopping playback and timer
-            if self.use_spotify:
-                try:
-                    self.spotify.pause_playback()
-                except Exception as e:
-                    print(e)
-            else:
-                mixer.music.stop()
-            
-            self.timer_song.stop()
+    def answer_correct(self) -> None:
+        self.engine.answer(True)
 
-            # Updating playback state
-            self.playback_state = self.S_STOPPED
+    def answer_incorrect(self) -> None:
+        self.engine.answer(False)
+
+    def on_game_event(self, event: GameEvent) -> None:
+        '''Plays audio and updates visuals after change of game state.'''
+        if event.kind == SONG_STARTED:
+            song: dict = event.song
+            self.silencer.reset()
+            if not self.use_spotify and self.output:
+                self.output.play(song['sound'])
+                self.song_queue.mark_played(song)
+                # Audio starts after the output buffer is played.
+                self.start_latency_ms = \
+                    (self.time_ns() - self.next_clicked_ns) / 1_000_000 + self.output.buffer_ms
+                l.info(f'Next to first audio latency: {self.start_latency_ms:.1f} ms.')
 
             # Updating visuals
-            self.button_next.setEnabled(True)
-            self.button_pause_resume.setEnabled(False)
-        else:
-            l.warning('Song is not playing.')
+            self.progress_bar.setValue(0)
+            self.label_title.setText(song['name'])
+            self.label_artist.setText(song['artist'])
+            self.label_team.setText('')
 
-    def resume_playback(self) -> None:
-        if self.playback_state == self.S_PAUSED:
-            # Resuming playback and timer
-            if self.use_spotify:
-                try:
-                    self.spotify.start_playback()
-                except Exception as e:
-                    print(e)
-            else:
-                mixer.music.unpause()
+            # Starting song timers
+            self.start_song_timers()
+            l.info('Started playback.')
 
-            self.timer_song.start(1)
+        elif event.kind == PAUSED:
+            if self.use_spotify:
+                self.send_spotify(PAUSE)
+            elif self.output:
+                self.output.pause()
+            self.stop_song_timers()
 
-            # Updating playback state.
-            self.playback_state = self.S_PLAYING
+        elif event.kind == RESUMED:
+            self.silencer.reset()
+            if self.use_spotify:
+                self.send_spotify(RESUME)
+            elif self.output:
+                self.output.unpause()
+            self.start_song_timers()
 
-            # Updating visuals
-            self.button_next.setEnabled(False)
-            self.button_pause_resume.setText('Pause')
-        else:
-            l.warning('Song is already playing.')
+        elif event.kind == STOPPED:
+            if self.use_spotify:
+                self.send_spotify(PAUSE)
+            elif self.output:
+                self.output.stop()
+            self.stop_song_timers()
 
-    def answer_correct(self) -> None:
-        if self.is_team_guessing:
-            # Changing score of team
-            team: int = self.guessing_team
-            self.team_scores[team] += self.points_correct
-            self.label_team_scores[team].setText(str(self.team_scores[team]))
+        elif event.kind == TEAM_GUESSING:
+            self.label_team.setText(self.team_names[event.team])
 
-            self.is_team_guessing = False
+        elif event.kind == SCORED:
+            self.scoreboard.set_score(event.team, event.score)
 
-            # Updating visuals
-            self.button_no.setEnabled(False)
-            self.button_yes.setEnabled(False)
-            self.button_next.setEnabled(True)
-            self.button_pause_resume.setEnabled(False)
+        elif event.kind == NEW_GAME:
+            self.scoreboard.set_scores(self.engine.team_scores)
 
-    def answer_incorrect(self) -> None:
-        if self.is_team_guessing:
-            # Changing score of team
-            team: int = self.guessing_team
-            self.team_scores[team] += self.points_incorrect
-            self.label_team_scores[team].setText(str(self.team_scores[team]))
+        elif event.kind == NO_SONGS:
+            # TODO Display warning dialog.
+            l.warning('No songs loaded!')
 
-            self.is_team_guessing = False
+        self.refresh_buttons()
 
-            # Updating visuals
-            self.button_no.setEnabled(False)
-            self.button_yes.setEnabled(False)
-            self.button_next.setEnabled(True)
-            if self.playback_state == self.S_PAUSED:
-                self.button_pause_resume.setEnabled(True)
+    def refresh_buttons(self) -> None:
+        '''Enables buttons of actions that are possible in current state.'''
+        guessing: bool = self.engine.is_team_guessing
+        self.button_yes.setEnabled(guessing)
+        self.button_no.setEnabled(guessing)
+        self.button_next.setEnabled(self.engine.can_play_next)
+        self.button_pause_resume.setEnabled(self.engine.can_pause_resume)
+        self.button_pause_resume.setText(
+            'Pause' if self.engine.playback_state == S_PLAYING else 'Resume')
 
     def closeEvent(self, event) -> None:
         self.config['Settings']['songs_directory'] = str(
             self.songs_directory)
-        self.config['Settings']['serial_port'] = str(self.serial_port)
+        self.config['Settings']['serial_ports'] = ', '.join(self.serial_ports)
+        self.config.remove_option('Settings', 'serial_port')
 
         self.config['Rules']['playback_time'] = str(self.playback_time)
 
+        self.serial_multiplexer.stop()
+        if self.network_server:
+            self.network_server.stop()
+        if self.prefetcher:
+            self.prefetcher.shutdown()
+        if self.spotify_worker:
+            self.spotify_worker.stop()
+        if self.watcher:
+            self.watcher.stop()
+        if self.scanner:
+            self.scanner.cancel()
+            self.scanner.join(1)
+        if self.library:
+            self.library.close()
+        if self.analyser:
+            self.analyser.cancel()
+            self.analyser.join(1)
+        if self.features:
+            self.features.close()
+        instruments.dump(os.path.join('cache', 'instrumentation'))
+        if self.journal:
+            self.journal.close()
+        if self.room:
+            self.engine.close()
+
         with open('config.ini', 'w', encoding='UTF-8') as file:
             self.config.write(file)
 
+    def new_game(self) -> None:
+        '''Resets scores after confirmation, previous game stays in archived journal.'''
+        answer = QMessageBox.question(self, 'New game', 'Reset scores of all teams?')
+        if answer == QMessageBox.Yes:
+            self.engine.new_game()
+
+    def show_ranking(self, ranking: bool) -> None:
+        '''Shows teams ordered from highest score or in their order.'''
+        if ranking and self.ranking is None:
+            self.ranking = RankingModel(self.scoreboard)
+        self.view_scoreboard.setModel(self.ranking if ranking else self.scoreboard)
+        self.config['Settings']['rank_teams'] = str(int(ranking))
+
+    def toggle_debug_dialog(self) -> None:
+        if self.debug_dialog is None:
+            self.debug_dialog = DebugDialog(self)
+        self.debug_dialog.setVisible(not self.debug_dialog.isVisible())
+
     def keyPressEvent(self, e: QKeyEvent) -> None:
         '''Handling keypresses'''
         if e.key() - Qt.Key.Key_1 in range(self.number_teams):
-            self.team_pressed(e.key() - Qt.Key.Key_1)
+            self.team_pressed(BuzzerPress(
+                e.key() - Qt.Key.Key_1, self.time_ns(), 'keyboard'))
+
+        if e.key() == Qt.Key.Key_F12:
+            self.toggle_debug_dialog()
+
+        if e.key() == Qt.Key.Key_R and e.modifiers() & Qt.ControlModifier:
+            self.show_ranking(self.view_scoreboard.model() is not self.ranking)
+
+        if e.key() == Qt.Key.Key_N and e.modifiers() & Qt.ControlModifier:
+            self.new_game()
 
         # if e.key() == Qt.Key.Key_Space:
         #     self.pause_resume( )
@@ -496,7 +898,9 @@ class SettingsDialog(QDialog):
         self.button_connect.clicked.connect(self.connect_serial)
         self.button_save.clicked.connect(self.save_exit)
         self.button_directory.clicked.connect(self.open_directory)
-        self.combobox_port.activated.connect(self.update_port)
+        # Several ports can be typed, separated with commas.
+        self.combobox_port.setEditable(True)
+        self.combobox_port.currentTextChanged.connect(self.update_port)
         self.input_songs_dir.returnPressed.connect(self.update_songs_dir)
         self.input_songs_dir.editingFinished.connect(self.update_songs_dir)
         self.slider_playback_time.valueChanged.connect(
@@ -506,9 +910,29 @@ class SettingsDialog(QDialog):
         self.slider_playback_time.setValue(self.parent.playback_time)
 
         self.update_ports(True)
+        self.show_connection()
+        self.show_network_codes()
+
+    def show_network_codes(self) -> None:
+        '''Shows address of buzzer page and code of each team, so they can be handed out.'''
+        server: NetworkBuzzerServer = self.parent.network_server
+        if not server or not server.is_alive():
+            return
+        lines: list = [f'Buzzer page: {server.page_address()}']
+        for i, code in sorted(server.protocol.codes.items()):
+            lines.append(f'Team {i + 1} ({self.parent.team_names[i]}): {code}')
+        self.label_network: QLabel = QLabel('\n'.join(lines), self)
+        self.label_network.setObjectName('l_network')
+        self.label_network.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        # Above the save button, dialog has fixed size so it grows by the label.
+        layout: QLayout = self.layout()
+        layout.insertWidget(layout.count() - 1, self.label_network)
+        self.setFixedHeight(self.height() + self.label_network.sizeHint().height()
+                            + layout.spacing())
 
     def update_port(self):
-        self.parent.serial_port = self.combobox_port.currentText()
+        ports: str = self.combobox_port.currentText()
+        self.parent.serial_ports = [port.strip() for port in ports.split(',') if port.strip()]
 
     def update_ports(self, get_from_parent: bool = False) -> None:
         ports = [port.device for port in list_ports.comports()]
@@ -516,44 +940,34 @@ class SettingsDialog(QDialog):
 
         self.combobox_port.clear()
 
-        if get_from_parent and self.parent.serial_port in ports:
-            self.combobox_port.addItem(self.parent.serial_port)
+        if get_from_parent and self.parent.serial_ports:
+            self.combobox_port.addItem(', '.join(self.parent.serial_ports))
         else:
             self.combobox_port.addItems(ports)
+            if len(ports) > 1:
+                # All Arduinos of the rig at once.
+                self.combobox_port.addItem(', '.join(ports))
             self.button_connect.setEnabled(True)
 
+    def show_connection(self) -> None:
+        connected: bool = self.parent.arduino_connected
+        self.button_connect.setText('Disconnect' if connected else 'Connect')
+        self.combobox_port.setEnabled(not connected)
+        self.button_refresh.setEnabled(not connected)
+
     def connect_serial(self) -> None:
         if self.parent.arduino_connected:
-            self.parent.timer_serial.stop()
+            self.parent.close_serial_ports()
             self.parent.arduino_connected = False
-            self.parent.serial.close()
-
-            self.button_connect.setText('Connect')
-            self.combobox_port.setEnabled(True)
-            self.button_refresh.setEnabled(True)
-
             self.parent.label_status.setText('DISCONNECTED')
         else:
-            try:
-                self.parent.serial.port = self.parent.serial_port
-                self.parent.serial.baudrate = 115200
-                self.parent.serial.parity = serial.PARITY_EVEN
-                self.parent.serial.stopbits = serial.STOPBITS_ONE
-                self.parent.serial.bytesize = serial.EIGHTBITS
-                self.parent.serial.open()
-            except Exception as e:
-                print(e)
+            if not self.parent.open_serial_ports():
                 return
-
-            self.parent.timer_serial.start(10)
             self.parent.arduino_connected = True
-
-            self.button_connect.setText('Disconnect')
-            self.combobox_port.setEnabled(False)
-            self.button_refresh.setEnabled(False)
-
             self.parent.label_status.setText('CONNECTED')
 
+        self.show_connection()
+
     def save_exit(self) -> None:
         self.close()
 
@@ -580,6 +994,47 @@ class SettingsDialog(QDialog):
         self.save_exit()
 
 
+class DebugDialog(QDialog):
+    '''Statistics of instrumented hot paths, refreshed while dialog is shown.'''
+
+    COLUMNS = ('count', 'mean_ms', 'p50_ms', 'p99_ms', 'p99.9_ms', 'max_ms')
+
+    def __init__(self, parent: Ui):
+        super().__init__(parent)
+
+        self.setMinimumSize(700, 300)
+        self.setWindowTitle('Instrumentation' if instruments.enabled
+                            else 'Instrumentation (disabled in settings)')
+
+        self.table: QTableWidget = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+
+        self.layout: QVBoxLayout = QVBoxLayout()
+        self.layout.addWidget(self.table)
+        self.setLayout(self.layout)
+
+        self.timer: QTimer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event) -> None:
+        self.refresh()
+        self.timer.start(500)
+
+    def hideEvent(self, event) -> None:
+        self.timer.stop()
+
+    def refresh(self) -> None:
+        summary: dict = instruments.summary()
+        self.table.setRowCount(len(summary))
+        self.table.setVerticalHeaderLabels(list(summary))
+        for row, values in enumerate(summary.values()):
+            for column, key in enumerate(self.COLUMNS):
+                value = values.get(key, '')
+                text: str = f'{value:.3f}' if isinstance(value, float) else str(value)
+                self.table.setItem(row, column, QTableWidgetItem(text))
+
+
 class BrowserDialog(QDialog):
     def __init__(self, parent: Ui, link: QUrl):
         super().__init__()
@@ -589,6 +1044,8 @@ class BrowserDialog(QDialog):
         self.setMinimumSize(500, 1000)
         self.setWindowTitle('Login to Spotify')
 
+        # Importing QtWebEngine is slow, so it's done only when logging in.
+        from PyQt5.QtWebEngineWidgets import QWebEngineView
         self.browser: QWebEngineView = QWebEngineView()
         self.browser.page().profile().cookieStore().deleteAllCookies()
         self.browser.setUrl(link)
@@ -609,14 +1066,24 @@ class BrowserDialog(QDialog):
         
 
 
-app = QApplication(sys.argv)
+# Guarded, because library scanner's worker processes may import this module.
+if __name__ == '__main__':
+    profiler = StartupProfiler('--profile-startup' in sys.argv)
+    profiler.mark('imports')
+
+    # Needed for importing QtWebEngine after application is created.
+    QApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
+    app = QApplication(sys.argv)
 
-_font_id = QFontDatabase.addApplicationFont(
-    os.path.join(os.getcwd(), "data/Manrope-Regular.ttf"))
-_fontstr = QFontDatabase.applicationFontFamilies(_font_id)[0]
-_font = QFont(_fontstr, 8)
-app.setFont(_font)
+    _font_id = QFontDatabase.addApplicationFont(
+        os.path.join(os.getcwd(), "data/Manrope-Regular.ttf"))
+    _fontstr = QFontDatabase.applicationFontFamilies(_font_id)[0]
+    _font = QFont(_fontstr, 8)
+    app.setFont(_font)
+    profiler.mark('application created')
 
-window = Ui()
+    # Window can be front end of room of room server, see rooms.py.
+    room: str = sys.argv[sys.argv.index('--room') + 1] if '--room' in sys.argv[:-1] else None
+    window = Ui(profiler, room)
 
-app.exec_()
+    app.exec_()
@@ -0,0 +1,387 @@
+import os
+import hmac
+import json
+import time
+import base64
+import struct
+import asyncio
+import hashlib
+import socket
+import threading
+
+# Logging
+import logging as l
+
+from typing import Callable
+
+from buzzers import BuzzerPress
+
+# WebSocket protocol, RFC 6455.
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+# Messages of buzzers are tiny, anything longer is rejected.
+MAX_MESSAGE = 4096
+
+# Clock of every client is measured with ping sent this often, in seconds.
+PING_INTERVAL = 1
+# Number of recent clock measurements from which best one is used.
+CLOCK_SAMPLES = 8
+# Seconds after which silent client is disconnected.
+CLIENT_TIMEOUT = 10
+# Page served to browsers, so a phone becomes a buzzer.
+BUZZER_PAGE = 'data/buzzer.html'
+
+
+def accept_key(key: str) -> str:
+    '''Returns value of Sec-WebSocket-Accept for key sent by client.'''
+    digest: bytes = hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+
+def local_address() -> str:
+    '''Returns address of this computer in local network, for links given to phones.'''
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        try:
+            # Nothing is sent, connecting only picks interface of the default route.
+            probe.connect(('192.0.2.1', 9))
+            return probe.getsockname()[0]
+        except OSError:
+            return '127.0.0.1'
+
+
+def apply_mask(payload: bytes, key: bytes) -> bytes:
+    length: int = len(payload)
+    repeated: bytes = (key * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+
+
+def encode_frame(payload: bytes, opcode: int = OP_TEXT, mask: bool = False) -> bytes:
+    '''Encodes single WebSocket frame, clients must mask their frames.'''
+    header: bytearray = bytearray([0x80 | opcode])
+    mask_bit: int = 0x80 if mask else 0
+    length: int = len(payload)
+    if length < 126:
+        header.append(mask_bit | length)
+    elif length < 1 << 16:
+        header.append(mask_bit | 126)
+        header += struct.pack('!H', length)
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack('!Q', length)
+    if mask:
+        key: bytes = os.urandom(4)
+        header += key
+        payload = apply_mask(payload, key)
+    return bytes(header) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple:
+    '''Reads single unfragmented WebSocket frame, returns its opcode and payload.'''
+    first, second = await reader.readexactly(2)
+    if not first & 0x80:
+        raise ValueError('Fragmented messages are not supported.')
+    length: int = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if length > MAX_MESSAGE:
+        raise ValueError('Message is too long.')
+    key: bytes = await reader.readexactly(4) if second & 0x80 else None
+    payload: bytes = await reader.readexactly(length)
+    if key:
+        payload = apply_mask(payload, key)
+    return first & 0x0F, payload
+
+
+class Client:
+    '''Connected buzzer with estimate of its clock.'''
+
+    def __init__(self, address: str, send: Callable[[dict], None],
+                 close: Callable[[], None]) -> None:
+        self.address: str = address
+        self.send: Callable[[dict], None] = send
+        self.close: Callable[[], None] = close
+        self.team: int = None  # Set once client is authenticated.
+        self.pings: dict = {}  # Moment of sending of each unanswered ping by id.
+        self.samples: list = []  # Round trip time and offset of recent pings.
+        self.last_seen: float = time.monotonic()
+        self.last_press: object = None  # Id of last press, repeated presses are ignored.
+
+    @property
+    def rtt_ns(self) -> int:
+        return min(self.samples)[0] if self.samples else None
+
+    @property
+    def offset_ns(self) -> int:
+        '''Offset of client clock, measured by ping with shortest round trip.'''
+        return min(self.samples)[1] if self.samples else None
+
+    def measured(self, sent_ns: int, client_ns: int, received_ns: int) -> None:
+        # Client read its clock half way through the round trip.
+        self.samples.append((received_ns - sent_ns, client_ns - (sent_ns + received_ns) // 2))
+        del self.samples[:-CLOCK_SAMPLES]
+
+    def press_time(self, client_ns: int, received_ns: int) -> int:
+        '''Converts moment of press on client to monotonic clock of the game.'''
+        if client_ns is None or not self.samples:
+            return received_ns
+        # Press can't happen after it arrived, nor long before it, whatever client claims.
+        return min(received_ns, max(received_ns - self.rtt_ns, client_ns - self.offset_ns))
+
+
+class BuzzerProtocol:
+    '''Messages exchanged with buzzers, same over WebSocket and UDP.
+
+    Client sends hello with index of its team and its code, server answers
+    with welcome or error. Server pings client every second and client
+    answers with reading of its clock, so moments of presses are converted
+    to clock of the game. Every press is acknowledged, UDP clients repeat
+    press with the same id until it is.
+    '''
+
+    def __init__(self, codes: dict, on_press: Callable[[BuzzerPress], None],
+                 on_clients: Callable[[int], None] = None) -> None:
+        self.codes: dict = codes  # Code of each team by index.
+        self.on_press: Callable[[BuzzerPress], None] = on_press
+        self.on_clients: Callable[[int], None] = on_clients
+        self.clients: set = set()
+        self.next_ping: int = 0
+
+    def handle(self, client: Client, message: dict, received_ns: int) -> bool:
+        '''Handles message of the client, returns whether it stays connected.'''
+        if not isinstance(message, dict):
+            return False
+        client.last_seen = time.monotonic()
+        kind: str = message.get('type')
+        if kind == 'hello':
+            return self.authenticate(client, message)
+        if client.team is None:
+            client.send({'type': 'error', 'message': 'Not authenticated.'})
+            return False
+        if kind == 'pong':
+            sent: int = client.pings.pop(message.get('id'), None)
+            if sent is not None and isinstance(message.get('client_ns'), int):
+                client.measured(sent, message['client_ns'], received_ns)
+        elif kind == 'press':
+            if message.get('id') is None or message['id'] != client.last_press:
+                client.last_press = message.get('id')
+                client_ns = message.get('client_ns')
+                timestamp: int = client.press_time(
+                    client_ns if isinstance(client_ns, int) else None, received_ns)
+                self.on_press(BuzzerPress(client.team, timestamp, client.address))
+            client.send({'type': 'ack', 'id': message.get('id'),
+                         'rtt_ns': client.rtt_ns, 'offset_ns': client.offset_ns})
+        return True
+
+    def authenticate(self, client: Client, message: dict) -> bool:
+        team = message.get('team')
+        code: str = self.codes.get(team) if isinstance(team, int) else None
+        if not code or not hmac.compare_digest(str(message.get('code', '')).encode(), code.encode()):
+            l.warning(f'Rejected buzzer {client.address}.')
+            client.send({'type': 'error', 'message': 'Wrong team or code.'})
+            return False
+        client.team = team
+        self.clients.add(client)
+        l.info(f'Buzzer {client.address} connected as team {team}.')
+        client.send({'type': 'welcome', 'team': team})
+        # Clock is measured right away, so first press is already compared fairly.
+        self.ping(client)
+        self.changed()
+        return True
+
+    def remove(self, client: Client) -> None:
+        if client in self.clients:
+            self.clients.discard(client)
+            self.changed()
+
+    def changed(self) -> None:
+        if self.on_clients:
+            self.on_clients(len(self.clients))
+
+    def ping(self, client: Client) -> None:
+        self.next_ping += 1
+        client.pings[self.next_ping] = time.monotonic_ns()
+        if len(client.pings) > CLOCK_SAMPLES:
+            # Oldest ping was lost.
+            client.pings.pop(next(iter(client.pings)))
+        client.send({'type': 'ping', 'id': self.next_ping})
+
+    def ping_all(self) -> None:
+        '''Pings every client, disconnecting ones that are silent for too long.'''
+        deadline: float = time.monotonic() - CLIENT_TIMEOUT
+        for client in list(self.clients):
+            if client.last_seen < deadline:
+                l.info(f'Buzzer {client.address} timed out.')
+                client.close()
+                self.remove(client)
+            else:
+                self.ping(client)
+
+
+class UdpBuzzers(asyncio.DatagramProtocol):
+    '''Buzzers sending JSON messages in datagrams, identified by address.'''
+
+    def __init__(self, protocol: BuzzerProtocol) -> None:
+        self.protocol: BuzzerProtocol = protocol
+        self.clients: dict = {}
+        self.transport: asyncio.DatagramTransport = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address: tuple) -> None:
+        received_ns: int = time.monotonic_ns()
+        try:
+            message: dict = json.loads(data)
+        except ValueError:
+            return
+        client: Client = self.clients.get(address)
+        if client is None:
+            client = Client(
+                f'udp {address[0]}:{address[1]}',
+                lambda response: self.transport.sendto(json.dumps(response).encode(), address),
+                lambda: self.clients.pop(address, None))
+        if self.protocol.handle(client, message, received_ns):
+            self.clients[address] = client
+        else:
+            self.clients.pop(address, None)
+            self.protocol.remove(client)
+
+
+class NetworkBuzzerServer(threading.Thread):
+    '''Accepts buzzers over WebSocket and UDP in its own event loop.
+
+    Browser opening address of the server gets page with a buzzer, so
+    phones need nothing installed. Nothing runs in GUI thread, presses are
+    passed to on_press from server thread, so it must be thread-safe.
+    '''
+
+    def __init__(self, codes: dict, on_press: Callable[[BuzzerPress], None],
+                 host: str = '0.0.0.0', port: int = 8766, udp_port: int = None,
+                 on_clients: Callable[[int], None] = None) -> None:
+        super().__init__(name='NetworkBuzzerServer', daemon=True)
+        self.protocol: BuzzerProtocol = BuzzerProtocol(codes, on_press, on_clients)
+        self.host: str = host
+        self.port: int = port
+        self.udp_port: int = udp_port
+        self.loop: asyncio.AbstractEventLoop = None
+        self.stopping: asyncio.Event = None
+        self.writers: set = set()
+        self.ready: threading.Event = threading.Event()  # Set once ports are open.
+        try:
+            with open(BUZZER_PAGE, 'rb') as file:
+                self.page: bytes = file.read()
+        except OSError as e:
+            l.warning(f'Buzzer page is not available: {e}')
+            self.page = None
+
+    def run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.serve())
+        except OSError as e:
+            l.error(f'Starting buzzer server failed: {e}')
+        finally:
+            self.ready.set()
+            self.loop.close()
+
+    def page_address(self) -> str:
+        '''Returns address of buzzer page, valid once server is ready.'''
+        host: str = self.host
+        if host in ('', '0.0.0.0', '::'):
+            host = local_address()
+        return f'http://{host}:{self.port}/'
+
+    def stop(self) -> None:
+        if self.loop and self.stopping and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        self.join(2)
+
+    async def serve(self) -> None:
+        self.stopping = asyncio.Event()
+        server: asyncio.AbstractServer = await asyncio.start_server(
+            self.handle_websocket, self.host, self.port)
+        # Actual ports, in case any free port was requested.
+        self.port = server.sockets[0].getsockname()[1]
+        udp: UdpBuzzers = None
+        if self.udp_port is not None:
+            transport, udp = await self.loop.create_datagram_endpoint(
+                lambda: UdpBuzzers(self.protocol), local_addr=(self.host, self.udp_port))
+            self.udp_port = transport.get_extra_info('sockname')[1]
+        l.info(f'Buzzer server listening on port {self.port}'
+               + (f' and UDP port {self.udp_port}.' if udp else '.'))
+        self.ready.set()
+
+        pinger: asyncio.Task = self.loop.create_task(self.ping_clients())
+        await self.stopping.wait()
+        pinger.cancel()
+        server.close()
+        for writer in list(self.writers):
+            writer.close()
+        if udp:
+            udp.transport.close()
+        await server.wait_closed()
+
+    async def ping_clients(self) -> None:
+        while True:
+            await asyncio.sleep(PING_INTERVAL)
+            self.protocol.ping_all()
+
+    async def handle_websocket(self, reader: asyncio.StreamReader,
+                               writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info('peername')
+        address: str = f'ws {peer[0]}:{peer[1]}' if peer else 'ws'
+        self.writers.add(writer)
+        client: Client = None
+        try:
+            request: bytes = await reader.readuntil(b'\r\n\r\n')
+            headers: dict = {}
+            for line in request.decode('latin-1').split('\r\n')[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            key: str = headers.get('sec-websocket-key')
+            if not key:
+                path: str = request.split(b' ', 2)[1].decode('latin-1') if request.count(b' ') >= 2 else ''
+                if request.startswith(b'GET ') and path in ('/', '/index.html') and self.page:
+                    # Plain request of a browser gets the buzzer page.
+                    writer.write((
+                        'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n'
+                        f'Content-Length: {len(self.page)}\r\nConnection: close\r\n\r\n').encode()
+                        + self.page)
+                    await writer.drain()
+                else:
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+                return
+            writer.write((
+                'HTTP/1.1 101 Switching Protocols\r\n'
+                'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                f'Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n').encode())
+
+            client = Client(
+                address,
+                lambda message: writer.write(encode_frame(json.dumps(message).encode())),
+                writer.close)
+            while True:
+                opcode, payload = await read_frame(reader)
+                received_ns: int = time.monotonic_ns()
+                if opcode == OP_TEXT:
+                    if not self.protocol.handle(client, json.loads(payload), received_ns):
+                        break
+                elif opcode == OP_PING:
+                    writer.write(encode_frame(payload, OP_PONG))
+                elif opcode == OP_CLOSE:
+                    writer.write(encode_frame(b'', OP_CLOSE))
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except ValueError as e:
+            l.warning(f'Disconnecting buzzer {address}: {e}')
+        finally:
+            if client:
+                self.protocol.remove(client)
+            self.writers.discard(writer)
+            writer.close()
@@ -0,0 +1,192 @@
+import json
+import time
+import socket
+import threading
+
+# Logging
+import logging as l
+
+from typing import Callable
+
+from buzzers import BuzzerPress
+from engine import S_PAUSED, S_PLAYING, S_STOPPED, GameEvent
+from journal import event_from_record
+
+# Front end and room server exchange JSON messages, one per line.
+MAX_MESSAGE = 64 * 1024
+DEFAULT_PORT = 8770
+CONNECT_TIMEOUT = 5
+
+
+def encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+
+def parse_address(address: str) -> tuple:
+    '''Splits '[code@]host[:port]/room' into host, port, room and code.'''
+    code, _, rest = address.rpartition('@')
+    location, _, room = rest.partition('/')
+    host, _, port = location.partition(':')
+    if not host or not room:
+        raise ValueError(f'Address of room must look like [code@]host[:port]/room, not {address!r}.')
+    return host, int(port or DEFAULT_PORT), room, code
+
+
+class RemoteEngine:
+    '''Game of a room run by room server, with interface of GameEngine.
+
+    Commands are sent to the room and state is copied from its events, so
+    window works the same as with its own engine. Presses and playback time
+    are decided by the room, so press is only passed on. Observers are
+    called from receiving thread.
+    '''
+
+    def __init__(self, address: str) -> None:
+        host, port, self.room, code = parse_address(address)
+        self.socket: socket.socket = socket.create_connection((host, port), CONNECT_TIMEOUT)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.socket.makefile('rb')
+        self.send_lock: threading.Lock = threading.Lock()
+        self.send({'type': 'attach', 'room': self.room, 'code': code})
+        response: dict = json.loads(self.file.readline(MAX_MESSAGE) or b'{}')
+        if response.get('type') != 'state':
+            self.socket.close()
+            raise ConnectionError(response.get('message', 'Room server closed connection.'))
+        self.socket.settimeout(None)
+
+        self.observers: list = []
+        self.team_names: list = response['state']['team_names']
+        self.number_teams: int = len(self.team_names)
+        self.team_scores: list = [0] * self.number_teams
+        self.current_song: dict = None
+        self.playback_state: int = S_STOPPED
+        self.is_team_guessing: bool = False
+        self.guessing_team: int = None
+        self._playback_time: int = 0
+        self.position_ms: int = 0  # Position of the song when state was received.
+        self.received_ns: int = 0
+        self.closed: bool = False
+        self.apply(response['state'])
+        self.thread: threading.Thread = threading.Thread(
+            target=self.receive, name='RemoteEngine', daemon=True)
+        l.info(f'Attached to room {self.room} at {host}:{port}.')
+
+    def subscribe(self, observer: Callable[[GameEvent], None]) -> None:
+        self.observers.append(observer)
+
+    def start(self) -> None:
+        '''Starts receiving events, once observers are subscribed.'''
+        self.thread.start()
+
+    def send(self, message: dict) -> None:
+        try:
+            with self.send_lock:
+                self.socket.sendall(encode(message))
+        except OSError as e:
+            l.error(f'Sending to room {self.room} failed: {e}')
+
+    def command(self, command: str, **arguments) -> None:
+        self.send(dict(arguments, type='command', command=command))
+
+    def apply(self, state: dict) -> None:
+        '''Copies state of the room.'''
+        self.received_ns = time.monotonic_ns()
+        # Updated in place, scoreboard reads the same list.
+        self.team_scores[:] = state['team_scores']
+        self.current_song = state['song']
+        self.playback_state = state['playback_state']
+        self.is_team_guessing = state['is_team_guessing']
+        self.guessing_team = state['guessing_team']
+        self._playback_time = state['playback_time']
+        self.position_ms = state['millis']
+
+    def receive(self) -> None:
+        for line in self.file:
+            try:
+                message: dict = json.loads(line)
+            except ValueError:
+                l.warning(f'Ignoring broken message of room {self.room}.')
+                continue
+            if message.get('type') != 'event':
+                continue
+            self.apply(message['state'])
+            event: GameEvent = event_from_record(message['event'])
+            for observer in self.observers:
+                observer(event)
+        if not self.closed:
+            l.error(f'Connection to room {self.room} was closed.')
+
+    def close(self) -> None:
+        self.closed = True
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+    @property
+    def playback_time(self) -> int:
+        return self._playback_time
+
+    @playback_time.setter
+    def playback_time(self, value: int) -> None:
+        if value != self._playback_time:
+            self._playback_time = value
+            self.command('playback_time', seconds=value)
+
+    @property
+    def millis(self) -> int:
+        '''Position of the song, moved on locally between events.'''
+        if self.playback_state != S_PLAYING:
+            return self.position_ms
+        return self.position_ms + (time.monotonic_ns() - self.received_ns) // 1_000_000
+
+    @property
+    def can_play_next(self) -> bool:
+        return not self.is_team_guessing and self.playback_state != S_PLAYING
+
+    @property
+    def can_pause_resume(self) -> bool:
+        return not self.is_team_guessing and self.playback_state != S_STOPPED
+
+    def press(self, press: BuzzerPress) -> bool:
+        '''Passes press to the room, it's arbitrated there.'''
+        self.command('press', team=press.team)
+        return False
+
+    def arbitration_deadline(self) -> int:
+        return None
+
+    def resolve(self, now_ns: int = None) -> BuzzerPress:
+        return None
+
+    def remaining_ms(self) -> int:
+        return self.playback_time * 1000 - self.millis
+
+    def check_time(self) -> bool:
+        '''Room stops the song itself, so timer of window isn't scheduled again.'''
+        return True
+
+    def next_song(self) -> bool:
+        self.command('next_song')
+        return True
+
+    def pause(self) -> None:
+        if self.playback_state == S_PLAYING:
+            self.command('pause_resume')
+
+    def resume(self) -> None:
+        if self.playback_state == S_PAUSED:
+            self.command('pause_resume')
+
+    def pause_resume(self) -> None:
+        self.command('pause_resume')
+
+    def stop(self) -> None:
+        self.command('stop')
+
+    def answer(self, correct: bool) -> None:
+        self.command('answer', correct=correct)
+
+    def new_game(self) -> None:
+        self.command('new_game')
@@ -0,0 +1,602 @@
+'''Runs several quiz rooms in one headless process, sharing library and caches.
+
+Run from the main directory of the project:
+
+    python rooms.py rooms.ini
+
+Every [Room <name>] section of the file is an independent game with its
+own buzzers, scores, journal and audio, settings missing in it are taken
+from [DEFAULT] and then from data/rooms.ini. Window attaches to a room as
+its front end with:
+
+    python main.py --room <code>@<host>:<port>/<name>
+'''
+import os
+import re
+import hmac
+import json
+import time
+import queue
+import codecs
+import signal
+import asyncio
+import secrets
+import argparse
+import threading
+import configparser
+
+# Logging
+import logging as l
+
+from typing import TYPE_CHECKING, Callable
+
+from buzzers import BuzzerPress, SerialMultiplexer
+from engine import (GameEngine, GameEvent, NO_SONGS, PAUSED, RESUMED, SONG_STARTED, STOPPED,
+                    S_PLAYING, Silencer)
+from instrumentation import instruments
+from journal import Journal, event_record, restore_scores
+from remote import MAX_MESSAGE, encode
+
+if TYPE_CHECKING:
+    from audio import AudioOutput, ChannelSink, SongPrefetcher
+    from features import FeatureAnalyser, FeatureIndex
+    from library import LibraryIndex, LibraryScanner
+    from netbuzz import NetworkBuzzerServer
+    from song_queue import SongQueue
+    from spotify_worker import RequestScheduler, SpotifyWorker
+    from watcher import LibraryWatcher
+
+ROOM_SECTION = re.compile(r'Room (.+)')
+
+
+class Room(threading.Thread):
+    '''Headless game of one room, run by its own thread.
+
+    Engine is used only from room thread, commands of front ends, songs
+    found by scanner and timers are queued to it. Presses are submitted
+    from threads of buzzers and silence the song right away. Every event
+    is journaled and passed to attached front ends with state of the room.
+    '''
+
+    def __init__(self, name: str, section: configparser.SectionProxy) -> None:
+        super().__init__(name=f'Room({name})', daemon=True)
+        self.name: str = name
+        self.section: configparser.SectionProxy = section
+        self.use_spotify: bool = section.getboolean('use_spotify')
+        self.songs_directory: str = os.path.abspath(section['songs_directory'])
+        self.number_teams: int = section.getint('number_teams')
+        names: list = [team.strip() for team in section['team_names'].split(',') if team.strip()]
+        self.team_names: list = [
+            names[i] if i < len(names) else f'Team {i + 1}' for i in range(self.number_teams)]
+        codes: list = [code.strip() for code in section['team_codes'].split(',')]
+        self.team_codes: dict = {
+            i: codes[i] if i < len(codes) and codes[i] else secrets.token_hex(3)
+            for i in range(self.number_teams)}
+
+        self.engine: GameEngine = GameEngine(
+            self.number_teams,
+            section.getint('playback_time'),
+            section.getint('points_correct'),
+            section.getint('points_incorrect'),
+            section.getint('tie_window_us'),
+            section.getboolean('lockout_incorrect'),
+            self.take_song)
+        self.engine.subscribe(self.on_game_event)
+        journal_path: str = os.path.join('cache', f'journal-{slug(name)}.jsonl')
+        self.engine.team_scores = restore_scores(journal_path, self.number_teams)
+        self.journal: Journal = Journal(journal_path)
+        self.engine.subscribe(self.journal.record_event)
+
+        self.commands: queue.SimpleQueue = queue.SimpleQueue()
+        self.listeners: list = []  # Attached front ends, called with event and state.
+        self.stopped: bool = False
+        self.silencer: Silencer = Silencer()
+
+        # Audio of local songs, set by server.
+        self.sink: ChannelSink = None
+        self.song_queue: SongQueue = None
+        self.prefetcher: SongPrefetcher = None
+        self.spotify_worker: SpotifyWorker = None
+        self.serial_multiplexer: SerialMultiplexer = SerialMultiplexer(self.submit_press)
+        self.network_server: NetworkBuzzerServer = None
+
+    def call(self, function: Callable, *args) -> None:
+        '''Runs function in room thread, can be called from any thread.'''
+        self.commands.put((function, args))
+
+    def run(self) -> None:
+        while not self.stopped:
+            try:
+                command: tuple = self.commands.get(timeout=self.timeout())
+            except queue.Empty:
+                command = None
+            if command:
+                function, args = command
+                try:
+                    function(*args)
+                except Exception as e:
+                    l.error(f'Room {self.name} failed: {e}')
+            self.check_timers()
+
+    def stop(self) -> None:
+        self.stopped = True
+        self.commands.put(None)
+        self.join(1)
+        self.serial_multiplexer.stop()
+        if self.network_server:
+            self.network_server.stop()
+        if self.prefetcher:
+            self.prefetcher.shutdown()
+        if self.spotify_worker:
+            self.spotify_worker.stop()
+        self.journal.close()
+
+    def timeout(self) -> float:
+        '''Returns seconds until contest is resolved or playback time is over.'''
+        now: int = time.monotonic_ns()
+        deadlines: list = []
+        arbitration: int = self.engine.arbitration_deadline()
+        if arbitration is not None:
+            deadlines.append((arbitration - now) / 1e9)
+        if self.engine.playback_state == S_PLAYING:
+            deadlines.append(self.engine.remaining_ms() / 1000)
+        return max(0, min(deadlines)) if deadlines else None
+
+    def check_timers(self) -> None:
+        deadline: int = self.engine.arbitration_deadline()
+        if deadline is not None and time.monotonic_ns() >= deadline:
+            self.engine.resolve(time.monotonic_ns())
+        self.engine.check_time()
+
+    def submit_press(self, press: BuzzerPress) -> None:
+        '''Passes press to engine, can be called from any thread.'''
+        if self.engine.press(press):
+            self.silence(press)
+            # Waking room thread, so contest is resolved after tie window.
+            self.commands.put(None)
+
+    def silence(self, press: BuzzerPress) -> None:
+        '''Silences the song right after first press, engine pauses it once contest is resolved.'''
+        from spotify_worker import PAUSE
+        self.silencer.silence(
+            press, self.engine.playback_state,
+            (lambda: self.spotify_worker.send(PAUSE)) if self.spotify_worker else None, self.sink)
+
+    def take_song(self) -> dict:
+        return self.prefetcher.take() if self.prefetcher else None
+
+    def add_songs(self, songs: list) -> None:
+        self.song_queue.add(songs)
+        self.prefetcher.prefetch()
+
+    def on_game_event(self, event: GameEvent) -> None:
+        '''Plays audio of the room and passes event to front ends.'''
+        from spotify_worker import PAUSE, RESUME
+        if event.kind == SONG_STARTED:
+            self.silencer.reset()
+            if self.sink:
+                self.sink.play(event.song['sound'])
+                self.song_queue.mark_played(event.song)
+            l.info(f'Room {self.name} started {event.song["name"]}.')
+        elif event.kind == PAUSED:
+            if self.spotify_worker:
+                self.spotify_worker.send(PAUSE)
+            elif self.sink:
+                self.sink.pause()
+        elif event.kind == RESUMED:
+            self.silencer.reset()
+            if self.spotify_worker:
+                self.spotify_worker.send(RESUME)
+            elif self.sink:
+                self.sink.unpause()
+        elif event.kind == STOPPED:
+            if self.spotify_worker:
+                self.spotify_worker.send(PAUSE)
+            elif self.sink:
+                self.sink.stop()
+        elif event.kind == NO_SONGS:
+            l.warning(f'Room {self.name} has no songs.')
+
+        if self.listeners:
+            message: dict = {'type': 'event', 'event': event_record(event), 'state': self.state()}
+            for listener in self.listeners:
+                listener(message)
+
+    def state(self) -> dict:
+        song: dict = self.engine.current_song
+        return {
+            'room': self.name,
+            'team_names': self.team_names,
+            'team_scores': list(self.engine.team_scores),
+            'song': {'name': song['name'], 'artist': song['artist']} if song else None,
+            'playback_state': self.engine.playback_state,
+            'is_team_guessing': self.engine.is_team_guessing,
+            'guessing_team': self.engine.guessing_team,
+            'playback_time': self.engine.playback_time,
+            'millis': self.engine.millis,
+        }
+
+    def attach(self, listener: Callable[[dict], None]) -> None:
+        '''Adds front end, it gets state of the room first.'''
+        listener({'type': 'state', 'state': self.state()})
+        self.listeners.append(listener)
+
+    def detach(self, listener: Callable[[dict], None]) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def handle(self, message: dict, source: str) -> None:
+        '''Executes command of front end.'''
+        from spotify_worker import NEXT
+        command: str = message.get('command')
+        if command == 'next_song':
+            if not self.spotify_worker:
+                self.engine.next_song()
+            elif self.engine.can_play_next:
+                # Song is started once Spotify reports that track changed.
+                self.spotify_worker.send(NEXT)
+        elif command == 'pause_resume':
+            self.engine.pause_resume()
+        elif command == 'stop':
+            self.engine.stop()
+        elif command == 'answer':
+            self.engine.answer(bool(message.get('correct')))
+        elif command == 'new_game':
+            self.engine.new_game()
+        elif command == 'press' and isinstance(message.get('team'), int):
+            # Clock of front end differs, press is stamped with its arrival.
+            self.submit_press(BuzzerPress(message['team'], time.monotonic_ns(), source))
+        elif command == 'playback_time' and isinstance(message.get('seconds'), int):
+            self.engine.playback_time = message['seconds']
+            if self.prefetcher:
+                # Song prepared before was cut to previous playback time.
+                self.prefetcher.max_seconds = self.engine.playback_time
+                self.prefetcher.refresh()
+        else:
+            l.warning(f'Room {self.name} got unknown command {command!r} from {source}.')
+
+
+def slug(name: str) -> str:
+    '''Returns name usable in file names.'''
+    return re.sub(r'[^\w-]+', '_', name).strip('_').lower() or 'room'
+
+
+class ControlServer(threading.Thread):
+    '''Accepts front ends attaching to rooms, in its own event loop.
+
+    Front end sends attach with name of the room and code of the server,
+    then commands, and gets state of the room followed by its events.
+    '''
+
+    def __init__(self, rooms: dict, code: str, host: str = '0.0.0.0', port: int = 8770) -> None:
+        super().__init__(name='ControlServer', daemon=True)
+        self.rooms: dict = rooms
+        self.code: str = code
+        self.host: str = host
+        self.port: int = port
+        self.loop: asyncio.AbstractEventLoop = None
+        self.stopping: asyncio.Event = None
+        self.writers: set = set()
+        self.ready: threading.Event = threading.Event()  # Set once port is open.
+
+    def run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.serve())
+        except OSError as e:
+            l.error(f'Starting control server failed: {e}')
+        finally:
+            self.ready.set()
+            self.loop.close()
+
+    def stop(self) -> None:
+        if self.loop and self.stopping and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        self.join(2)
+
+    async def serve(self) -> None:
+        self.stopping = asyncio.Event()
+        server: asyncio.AbstractServer = await asyncio.start_server(
+            self.handle, self.host, self.port, limit=MAX_MESSAGE)
+        # Actual port, in case any free port was requested.
+        self.port = server.sockets[0].getsockname()[1]
+        l.info(f'Rooms {", ".join(self.rooms)} listening on port {self.port}.')
+        self.ready.set()
+        await self.stopping.wait()
+        server.close()
+        for writer in list(self.writers):
+            writer.close()
+        await server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info('peername')
+        address: str = f'front end {peer[0]}:{peer[1]}' if peer else 'front end'
+        self.writers.add(writer)
+        room: Room = None
+        listener: Callable[[dict], None] = None
+        try:
+            while True:
+                line: bytes = await reader.readline()
+                if not line:
+                    break
+                message: dict = json.loads(line)
+                if not isinstance(message, dict):
+                    break
+                if room is None:
+                    room = self.authenticate(message, writer)
+                    if room is None:
+                        break
+                    # Called from room thread, message is written by event loop.
+                    listener = lambda message: self.loop.call_soon_threadsafe(writer.write, encode(message))
+                    room.call(room.attach, listener)
+                    l.info(f'{address} attached to room {room.name}.')
+                elif message.get('type') == 'command':
+                    room.call(room.handle, message, address)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e:
+            l.warning(f'Disconnecting {address}: {e}')
+        finally:
+            if listener:
+                room.call(room.detach, listener)
+            self.writers.discard(writer)
+            writer.close()
+
+    def authenticate(self, message: dict, writer: asyncio.StreamWriter) -> Room:
+        room: Room = self.rooms.get(message.get('room'))
+        if message.get('type') != 'attach' or room is None:
+            error: str = f'Unknown room, rooms are {", ".join(self.rooms)}.'
+        elif not self.code or \
+                not hmac.compare_digest(str(message.get('code', '')).encode(), self.code.encode()):
+            error = 'Wrong code.'
+        else:
+            return room
+        writer.write(encode({'type': 'error', 'message': error}))
+        return None
+
+
+class RoomServer:
+    '''Rooms of one process with library, caches and Spotify connections they share.
+
+    Every songs directory is scanned and watched once, whichever rooms play
+    it, and songs are passed to their queues. Rooms with local songs play
+    on their own channel of one mixer, rooms with Spotify send requests
+    through one session, spaced so the application stays within rate limit.
+    '''
+
+    def __init__(self, config: configparser.ConfigParser) -> None:
+        self.config: configparser.ConfigParser = config
+        # Rooms open their journals as they are created.
+        os.makedirs('cache', exist_ok=True)
+        self.rooms: dict = {}
+        for section in config.sections():
+            match = ROOM_SECTION.fullmatch(section)
+            if match:
+                self.rooms[match.group(1)] = Room(match.group(1), config[section])
+        self.library: LibraryIndex = None
+        self.features: FeatureIndex = None
+        self.analyser: FeatureAnalyser = None
+        self.output: AudioOutput = None
+        self.scheduler: RequestScheduler = None
+        self.lock: threading.Lock = threading.Lock()
+        self.scanners: dict = {}  # Running scanner of each songs directory.
+        self.changed_paths: dict = {}  # Changes of each directory waiting for its scanner.
+        self.watchers: list = []
+        self.control_server: ControlServer = None
+
+    @property
+    def local_rooms(self) -> list:
+        return [room for room in self.rooms.values() if not room.use_spotify]
+
+    def start(self) -> None:
+        settings: configparser.SectionProxy = self.config['Server']
+        instruments.enabled = settings.getboolean('instrumentation')
+        if self.local_rooms:
+            self.open_local(settings)
+        spotify_rooms: list = [room for room in self.rooms.values() if room.use_spotify]
+        if spotify_rooms:
+            self.open_spotify(settings, spotify_rooms)
+        for room in self.rooms.values():
+            self.open_buzzers(room)
+            room.start()
+        for directory in {room.songs_directory for room in self.local_rooms}:
+            self.scan(directory)
+            self.watch(directory)
+        code: str = settings['code']
+        if not code:
+            # Anyone on the network could run the rooms otherwise.
+            code = secrets.token_hex(4)
+            l.info(f'Code of room server: {code}.')
+        self.control_server = ControlServer(self.rooms, code, settings['host'], settings.getint('port'))
+        self.control_server.start()
+        self.control_server.ready.wait()
+
+    def open_local(self, settings: configparser.SectionProxy) -> None:
+        from audio import AudioOutput, SongPrefetcher
+        from library import LibraryIndex
+        from song_queue import SongQueue
+        self.library = LibraryIndex(os.path.join('cache', 'library.sqlite'))
+        self.output = AudioOutput(
+            settings.getint('output_frequency'), settings.getint('output_buffer'),
+            len(self.local_rooms))
+        # Analysis finds duplicates even in rooms where songs start at the beginning.
+        from features import FeatureAnalyser, FeatureIndex
+        self.features = FeatureIndex(os.path.join('cache', 'features.sqlite'))
+        self.analyser = FeatureAnalyser(self.features, self.remove_duplicates)
+        self.analyser.start()
+        for index, room in enumerate(self.local_rooms):
+            room.sink = self.output.sink(index)
+            room.song_queue = SongQueue(self.library)
+            room.prefetcher = SongPrefetcher(room.song_queue.take)
+            room.prefetcher.max_seconds = room.engine.playback_time
+            if room.section.getboolean('loud_snippets'):
+                room.prefetcher.snippet_start = self.features.snippet_start
+
+    def open_spotify(self, settings: configparser.SectionProxy, rooms: list) -> None:
+        '''Logs every room in with its own account, sharing one session.'''
+        from spotipy.cache_handler import CacheFileHandler
+        from spotipy.client import Spotify
+        from spotipy.oauth2 import SpotifyOAuth
+        from spotify_worker import (LOAD, PAUSE, RequestScheduler, SpotifyCatalog,
+                                    SpotifyWorker, create_session)
+        self.scheduler = RequestScheduler()
+        session = create_session(self.scheduler, 2 * len(rooms))
+        for room in rooms:
+            oauth: SpotifyOAuth = SpotifyOAuth(
+                client_id=settings['spotify_client_id'],
+                client_secret=settings['spotify_client_secret'],
+                redirect_uri=settings['spotify_redirect_uri'],
+                scope=('user-read-playback-state user-modify-playback-state '
+                       'user-read-currently-playing app-remote-control'),
+                open_browser=False,
+                cache_handler=CacheFileHandler(
+                    cache_path=os.path.join('cache', f'.spotify_cache-{slug(room.name)}')))
+            if not oauth.validate_token(oauth.cache_handler.get_cached_token()):
+                # Link is opened on any device, redirected address is pasted back.
+                print(f'Spotify login of room {room.name}:')
+                oauth.get_access_token(as_dict=False)
+            client: Spotify = Spotify(oauth_manager=oauth, requests_session=session)
+            if settings.get('spotify_api_url'):
+                client.prefix = settings['spotify_api_url']
+            catalog: SpotifyCatalog = SpotifyCatalog(
+                os.path.join('cache', f'spotify_tracks-{slug(room.name)}.json'))
+            room.spotify_worker = SpotifyWorker(
+                client,
+                lambda song, room=room: room.call(room.engine.start_song, song),
+                lambda command, error, room=room: l.error(f'Room {room.name}: {command} failed: {error}'),
+                catalog,
+                room.silencer.report)
+            room.spotify_worker.start()
+            room.spotify_worker.send(PAUSE)
+            room.spotify_worker.send(LOAD)
+
+    def open_buzzers(self, room: Room) -> None:
+        for port in room.section['serial_ports'].split(','):
+            if port.strip():
+                try:
+                    room.serial_multiplexer.open(port.strip())
+                except Exception as e:
+                    l.error(f'Opening {port.strip()} for room {room.name} failed: {e}')
+        if room.section['buzzer_port']:
+            from netbuzz import NetworkBuzzerServer
+            udp_port: str = room.section['buzzer_udp_port']
+            room.network_server = NetworkBuzzerServer(
+                room.team_codes, room.submit_press, self.config['Server']['host'],
+                int(room.section['buzzer_port']), int(udp_port) if udp_port else None)
+            room.network_server.start()
+            l.info(f'Codes of teams of room {room.name}: '
+                   f'{", ".join(room.team_codes.values())}.')
+
+    def rooms_of(self, directory: str) -> list:
+        return [room for room in self.local_rooms if room.songs_directory == directory]
+
+    def scan(self, directory: str, paths: list = None) -> None:
+        '''Scans songs directory, or only given paths inside it, for its rooms.'''
+        from library import LibraryScanner
+        rooms: list = self.rooms_of(directory)
+        with self.lock:
+            self.scanners[directory] = LibraryScanner(
+                self.library, directory,
+                lambda songs: self.add_songs(rooms, songs),
+                on_finished=lambda cancelled: self.scan_finished(directory),
+                paths=paths,
+                on_removed=lambda songs: self.forget_songs(rooms, songs))
+            self.scanners[directory].start()
+
+    def watch(self, directory: str) -> None:
+        from watcher import LibraryWatcher
+        watcher: LibraryWatcher = LibraryWatcher(
+            directory, lambda paths: self.update_songs(directory, paths))
+        watcher.start()
+        self.watchers.append(watcher)
+
+    def update_songs(self, directory: str, paths: list) -> None:
+        '''Applies changes reported by watcher once scanner of the directory is done.'''
+        with self.lock:
+            self.changed_paths.setdefault(directory, set()).update(paths)
+            if self.scanners.get(directory) is not None or not self.changed_paths[directory]:
+                return
+            paths = sorted(self.changed_paths.pop(directory))
+        self.scan(directory, paths)
+
+    def scan_finished(self, directory: str) -> None:
+        with self.lock:
+            self.scanners[directory] = None
+        self.update_songs(directory, [])
+
+    def add_songs(self, rooms: list, songs: list) -> None:
+        for room in rooms:
+            room.call(room.add_songs, songs)
+        if self.analyser:
+            self.analyser.add(songs)
+
+    def forget_songs(self, rooms: list, songs: list) -> None:
+        rowids: list = [song['rowid'] for song in songs]
+        for room in rooms:
+            room.call(room.song_queue.forget, rowids)
+
+    def remove_duplicates(self, paths: list) -> None:
+        '''Leaves single copy of every song in queues of all rooms.'''
+        rowids: list = list(self.library.rowids(paths).values())
+        for room in self.local_rooms:
+            room.call(room.song_queue.remove, rowids)
+
+    def stop(self) -> None:
+        if self.control_server:
+            self.control_server.stop()
+        for watcher in self.watchers:
+            watcher.stop()
+        with self.lock:
+            scanners: list = [scanner for scanner in self.scanners.values() if scanner]
+        for scanner in scanners:
+            scanner.cancel()
+            scanner.join(1)
+        for room in self.rooms.values():
+            room.stop()
+        if self.analyser:
+            self.analyser.cancel()
+            self.analyser.join(1)
+        if self.features:
+            self.features.close()
+        if self.library:
+            self.library.close()
+        instruments.dump(os.path.join('cache', 'instrumentation-rooms'))
+
+
+def load_config(path: str) -> configparser.ConfigParser:
+    '''Reads default settings of rooms overwritten by given file.'''
+    config: configparser.ConfigParser = configparser.ConfigParser()
+    config.read_file(codecs.open('data/rooms.ini', 'r', 'utf8'))
+    if os.path.exists(path):
+        custom: configparser.ConfigParser = configparser.ConfigParser()
+        custom.read_file(codecs.open(path, 'r', 'utf8'))
+        if any(ROOM_SECTION.fullmatch(section) for section in custom.sections()):
+            # Example rooms are replaced by rooms of given file.
+            for section in config.sections():
+                if ROOM_SECTION.fullmatch(section):
+                    config.remove_section(section)
+        config.read_dict(custom)
+    else:
+        l.warning(f'{path} not found, running rooms of data/rooms.ini.')
+    return config
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('config', nargs='?', default='rooms.ini')
+    args = parser.parse_args()
+    l.basicConfig(level=l.INFO)
+
+    server: RoomServer = RoomServer(load_config(args.config))
+    stopped: threading.Event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    try:
+        server.start()
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    l.info('Stopping rooms.')
+    server.stop()
+
+
+# Guarded, because worker processes of scanner and analyser import this module.
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+from PyQt5.QtCore import (QAbstractListModel, QModelIndex, QRect, QSize,
+                          QSortFilterProxyModel, Qt)
+from PyQt5.QtGui import QFont, QPainter, QResizeEvent
+from PyQt5.QtWidgets import (QAbstractItemView, QListView, QStyledItemDelegate,
+                             QStyleOptionViewItem)
+
+# Role of the score, display role holds name of the team.
+SCORE_ROLE = Qt.UserRole + 1
+
+# Tiles in one row before scoreboard wraps into next row.
+TEAMS_PER_ROW = 6
+MIN_TILE_WIDTH = 120
+NAME_HEIGHT = 50
+SCORE_HEIGHT = 80
+NAME_POINT_SIZE = 16
+SCORE_POINT_SIZE = 30
+
+
+class ScoreboardModel(QAbstractListModel):
+    '''Names and scores of the teams, row of each team is its index.
+
+    Changing score emits dataChanged of that single row, so views repaint
+    only the tile that changed.
+    '''
+
+    def __init__(self, names: list, scores: list = None) -> None:
+        super().__init__()
+        self.names: list[str] = list(names)
+        self.scores: list[int] = list(scores) if scores else [0] * len(self.names)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.names)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.names[index.row()]
+        if role == SCORE_ROLE:
+            return self.scores[index.row()]
+        return None
+
+    def set_score(self, team: int, score: int) -> None:
+        if self.scores[team] != score:
+            self.scores[team] = score
+            index: QModelIndex = self.index(team)
+            self.dataChanged.emit(index, index, [SCORE_ROLE])
+
+    def set_scores(self, scores: list) -> None:
+        for team, score in enumerate(scores):
+            self.set_score(team, score)
+
+
+class RankingModel(QSortFilterProxyModel):
+    '''Teams ordered from highest score, reordered as scores change.'''
+
+    def __init__(self, source: ScoreboardModel) -> None:
+        super().__init__()
+        self.setSourceModel(source)
+        self.setSortRole(SCORE_ROLE)
+        self.setDynamicSortFilter(True)
+        self.sort(0, Qt.DescendingOrder)
+
+    def lessThan(self, left: QModelIndex, right: QModelIndex) -> bool:
+        left_score: int = left.data(SCORE_ROLE)
+        right_score: int = right.data(SCORE_ROLE)
+        if left_score != right_score:
+            return left_score < right_score
+        # Teams with equal score stay in their order.
+        return left.row() > right.row()
+
+
+class TeamDelegate(QStyledItemDelegate):
+    '''Paints team as tile with name above score.'''
+
+    def paint(self, painter: QPainter, option: QStyleOptionViewItem, index: QModelIndex) -> None:
+        painter.save()
+        # Tile fills whole cell of the grid.
+        rect: QRect = QRect(option.rect.topLeft(), self.parent().gridSize())
+        font: QFont = QFont(option.font)
+        font.setPointSize(NAME_POINT_SIZE)
+        font.setBold(True)
+        painter.setFont(font)
+        painter.setPen(option.palette.windowText().color())
+        painter.drawText(QRect(rect.left(), rect.top(), rect.width(), NAME_HEIGHT),
+                         Qt.AlignCenter, index.data(Qt.DisplayRole))
+
+        font = QFont(option.font)
+        font.setPointSize(SCORE_POINT_SIZE)
+        painter.setFont(font)
+        painter.drawText(QRect(rect.left(), rect.top() + NAME_HEIGHT, rect.width(), SCORE_HEIGHT),
+                         Qt.AlignCenter, str(index.data(SCORE_ROLE)))
+        painter.restore()
+
+    def sizeHint(self, option: QStyleOptionViewItem, index: QModelIndex) -> QSize:
+        return QSize(MIN_TILE_WIDTH, NAME_HEIGHT + SCORE_HEIGHT)
+
+
+class ScoreboardView(QListView):
+    '''Tiles of the teams in rows, as many rows as needed.'''
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self.setItemDelegate(TeamDelegate(self))
+        self.setFlow(QListView.LeftToRight)
+        self.setWrapping(True)
+        self.setResizeMode(QListView.Adjust)
+        self.setUniformItemSizes(True)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setFocusPolicy(Qt.NoFocus)
+        self.setFrameShape(QListView.NoFrame)
+        # Height fits all rows, so nothing is ever scrolled.
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        # Blends in with the window, like labels did.
+        self.viewport().setAutoFillBackground(False)
+
+    def setModel(self, model) -> None:
+        super().setModel(model)
+        # Number of teams is fixed during the game.
+        self.update_grid()
+
+    def update_grid(self) -> None:
+        '''Spreads tiles over whole width, height fits all rows.'''
+        teams: int = self.model().rowCount() if self.model() else 0
+        # Pixel is left, so the last tile doesn't wrap.
+        width: int = self.viewport().width() - 1
+        columns: int = max(1, min(teams, TEAMS_PER_ROW, width // MIN_TILE_WIDTH))
+        rows: int = -(-teams // columns)
+        self.setGridSize(QSize(width // columns, NAME_HEIGHT + SCORE_HEIGHT))
+        self.setFixedHeight(rows * (NAME_HEIGHT + SCORE_HEIGHT) + 2 * self.frameWidth())
+
+    def resizeEvent(self, e: QResizeEvent) -> None:
+        super().resizeEvent(e)
+        self.update_grid()
@@ -0,0 +1,115 @@
+import random
+from array import array
+
+# Logging
+import logging as l
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from library import LibraryIndex
+
+# State of each row id known to the queue.
+UNKNOWN = 0
+QUEUED = 1
+PLAYED = 2
+REMOVED = 3
+
+
+class SongQueue:
+    '''Local songs waiting to be played, kept as row ids of library index.
+
+    Queue holds only integers, about ten bytes per song, and reads metadata
+    of a song from index once it's taken. Songs are drawn at random when
+    taken, so nothing is shuffled when songs are added. Songs played in any
+    session are set aside until all others were played, then the queue
+    starts again with them.
+    '''
+
+    def __init__(self, library: 'LibraryIndex') -> None:
+        self.library: 'LibraryIndex' = library
+        self.queued: array = array('q')  # Row ids to draw from, may contain removed ones.
+        self.played: array = array('q')  # Row ids set aside until queue runs out.
+        self.states: bytearray = bytearray()  # State of every row id, indexed by it.
+        self.size: int = 0  # Number of queued songs that weren't removed.
+
+    def __len__(self) -> int:
+        return self.size
+
+    def state(self, rowid: int) -> int:
+        return self.states[rowid] if rowid < len(self.states) else UNKNOWN
+
+    def set_state(self, rowid: int, state: int) -> None:
+        if rowid >= len(self.states):
+            # Grows by half, so growing costs constant time per song.
+            self.states.extend(bytes(max(rowid + 1, len(self.states) * 3 // 2) - len(self.states)))
+        self.states[rowid] = state
+
+    def add(self, songs: list) -> None:
+        '''Adds scanned songs, ones already known to the queue are skipped.'''
+        songs = [song for song in songs if self.state(song['rowid']) == UNKNOWN]
+        played: set = self.library.played(song['hash'] for song in songs)
+        for song in songs:
+            rowid: int = song['rowid']
+            if song['hash'] in played:
+                self.played.append(rowid)
+                self.set_state(rowid, PLAYED)
+            else:
+                self.queued.append(rowid)
+                self.set_state(rowid, QUEUED)
+                self.size += 1
+
+    def remove(self, rowids) -> None:
+        '''Removes songs from the queue for good, e.g. duplicates.'''
+        for rowid in rowids:
+            # Removed row ids stay in the array and are skipped when drawn.
+            if self.state(rowid) == QUEUED:
+                self.size -= 1
+            self.set_state(rowid, REMOVED)
+
+    def forget(self, rowids) -> None:
+        '''Removes songs whose rows were deleted, their row ids can be given to new songs.'''
+        for rowid in rowids:
+            if self.state(rowid) == QUEUED:
+                self.size -= 1
+            self.set_state(rowid, UNKNOWN)
+
+    def take(self) -> dict:
+        '''Removes random song from the queue and returns it, None if there are no songs.'''
+        for _ in range(2):
+            while self.queued:
+                # Drawn song is swapped with the last one, so it's removed in constant time.
+                i: int = random.randrange(len(self.queued))
+                rowid: int = self.queued[i]
+                self.queued[i] = self.queued[-1]
+                self.queued.pop()
+                if self.state(rowid) != QUEUED:
+                    continue
+                self.size -= 1
+                self.set_state(rowid, PLAYED)
+                song: dict = self.library.song(rowid)
+                if song is not None:
+                    self.played.append(rowid)
+                    return song
+            if not self.played:
+                break
+            l.info('All songs were played, playing them again.')
+            # Row id given to new song could be set aside twice.
+            self.queued = array('q', dict.fromkeys(
+                rowid for rowid in self.played if self.state(rowid) == PLAYED))
+            self.played = array('q')
+            self.library.forget_played(self.queued)
+            for rowid in self.queued:
+                self.set_state(rowid, QUEUED)
+            self.size = len(self.queued)
+        return None
+
+    def mark_played(self, song: dict) -> None:
+        '''Keeps song out of queue in next sessions too.'''
+        self.library.mark_played(song['hash'])
+
+    def clear(self) -> None:
+        self.queued = array('q')
+        self.played = array('q')
+        self.states = bytearray()
+        self.size = 0
@@ -0,0 +1,352 @@
+import os
+import json
+import time
+import random
+import threading
+
+# Logging
+import logging as l
+
+from typing import TYPE_CHECKING, Callable
+
+from instrumentation import instruments
+
+# Spotify client is imported by its users, so commands can be imported without it.
+if TYPE_CHECKING:
+    import requests
+    from spotipy.client import Spotify
+
+PAUSE = 'pause'
+RESUME = 'resume'
+NEXT = 'next'
+LOAD = 'load'
+
+# Polling for track change after skipping, delays in seconds.
+POLL_FIRST_DELAY = 0.05
+POLL_MAX_DELAY = 1
+POLL_TIMEOUT = 5
+# Idle connection is used by request after this many seconds, so it's open when buzzer is pressed.
+KEEPALIVE_INTERVAL = 30
+# Web API limits requests of whole application, shared by all rooms of server.
+REQUESTS_PER_SECOND = 5
+REQUEST_BURST = 10
+
+# Limits of Web API for single request.
+PAGE_SIZE = 100
+TRACKS_PER_LOOKUP = 50
+
+
+class RequestScheduler:
+    '''Spaces requests of all clients sharing one Spotify application.
+
+    Requests take tokens of bucket refilled REQUESTS_PER_SECOND times per
+    second, so busy room can't use up the limit of others. Pause doesn't
+    wait for token, audience hears every moment of its delay. After Web API
+    answers 429, every request waits as long as Retry-After asks.
+    '''
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND, burst: int = REQUEST_BURST) -> None:
+        self.rate: float = rate
+        self.burst: int = burst
+        self.tokens: float = burst
+        self.updated: float = time.monotonic()
+        self.blocked_until: float = 0  # Moment until which Web API refuses requests.
+        self.lock: threading.Lock = threading.Lock()
+
+    def acquire(self, urgent: bool = False) -> None:
+        '''Waits until request can be sent.'''
+        while True:
+            with self.lock:
+                now: float = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                delay: float = self.blocked_until - now
+                if delay <= 0:
+                    if urgent or self.tokens >= 1:
+                        # Urgent request borrows token, following ones wait longer.
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+            with instruments.measure('spotify scheduler wait'):
+                time.sleep(delay)
+
+    def back_off(self, seconds: float) -> None:
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        l.warning(f'Spotify rate limit reached, requests wait {seconds:g} s.')
+
+
+def create_session(scheduler: RequestScheduler = None, connections: int = 4) -> 'requests.Session':
+    '''Creates HTTP session keeping connections to Web API alive between calls.
+
+    Clients sharing session with scheduler share its connections and take turns.
+    '''
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    # Defined here, so requests is imported only when Spotify is used.
+    class ScheduledAdapter(HTTPAdapter):
+        def send(self, request: 'requests.PreparedRequest', **kwargs) -> 'requests.Response':
+            scheduler.acquire(urgent=request.method == 'PUT' and request.path_url.endswith('/pause'))
+            response: requests.Response = super().send(request, **kwargs)
+            if response.status_code == 429:
+                try:
+                    retry_after: float = float(response.headers.get('Retry-After', 1))
+                except ValueError:
+                    retry_after = 1
+                scheduler.back_off(retry_after)
+            return response
+
+    session: requests.Session = requests.Session()
+    adapter: HTTPAdapter = (ScheduledAdapter if scheduler else HTTPAdapter)(
+        pool_connections=1, pool_maxsize=connections)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def song_from_item(item: dict) -> dict:
+    '''Returns name and artists of track returned by Web API.'''
+    return {
+        'id': item.get('id'),
+        'uri': item.get('uri'),
+        'name': item['name'],
+        'artist': ', '.join(str(artist['name']) for artist in item['artists']),
+    }
+
+
+class SpotifyCatalog:
+    '''Tracks of active playlist or album, known before they are played.
+
+    Names and artists of tracks are cached in file, together with track list
+    of each playlist and its snapshot, so unchanged playlist is loaded with
+    single request. Tracks are played in random order without repeating.
+    '''
+
+    def __init__(self, cache_path: str) -> None:
+        self.cache_path: str = cache_path
+        self.songs: dict = {}  # Known tracks by id.
+        self.playlists: dict = {}  # Snapshot and track ids by playlist URI.
+        self.context_uri: str = None  # Playlist or album that is played.
+        self.tracks: list = []  # Ids of its tracks.
+        self.order: list = []  # Ids of tracks left to play, last one is next.
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, encoding='UTF-8') as file:
+                    data: dict = json.load(file)
+                self.songs = data['songs']
+                self.playlists = data['playlists']
+            except (ValueError, KeyError) as e:
+                l.warning(f'Ignoring broken Spotify cache: {e}')
+
+    def save(self) -> None:
+        temporary: str = self.cache_path + '.tmp'
+        with open(temporary, 'w', encoding='UTF-8') as file:
+            json.dump({'songs': self.songs, 'playlists': self.playlists}, file)
+        os.replace(temporary, self.cache_path)
+
+    def load(self, client: 'Spotify') -> None:
+        '''Loads tracks of playlist or album that is currently played.'''
+        playback: dict = client.current_playback()
+        context: dict = playback.get('context') if playback else None
+        if not context or context.get('type') not in ('playlist', 'album'):
+            l.warning('Nothing is played from playlist or album, tracks are not prefetched.')
+            return
+
+        uri: str = context['uri']
+        if context['type'] == 'playlist':
+            ids: list = self.load_playlist(client, uri)
+        else:
+            ids = self.add_items(client.album_tracks(uri, limit=50), client)
+        self.lookup(client, ids)
+        self.save()
+
+        self.context_uri = uri
+        self.tracks = [i for i in ids if i in self.songs]
+        self.order = list(self.tracks)
+        random.shuffle(self.order)
+        l.info(f'Loaded {len(self.order)} tracks of {uri}.')
+
+    def load_playlist(self, client: 'Spotify', uri: str) -> list:
+        '''Returns track ids of playlist, paging through it only if it changed.'''
+        snapshot: str = client.playlist(uri, fields='snapshot_id')['snapshot_id']
+        cached: dict = self.playlists.get(uri)
+        if cached and cached['snapshot'] == snapshot:
+            return cached['tracks']
+        page: dict = client.playlist_items(
+            uri, fields='items(track(id,uri,name,artists(name))),next',
+            limit=PAGE_SIZE, additional_types=('track',))
+        ids: list = self.add_items(page, client, lambda item: item['track'])
+        self.playlists[uri] = {'snapshot': snapshot, 'tracks': ids}
+        return ids
+
+    def add_items(self, page: dict, client: 'Spotify', track=lambda item: item) -> list:
+        '''Stores tracks of all pages, returns their ids.'''
+        ids: list = []
+        while page:
+            for item in page['items']:
+                item = track(item)
+                # Local files and removed tracks have no id.
+                if item and item.get('id'):
+                    self.songs[item['id']] = song_from_item(item)
+                    ids.append(item['id'])
+            page = client.next(page) if page.get('next') else None
+        return ids
+
+    def lookup(self, client: 'Spotify', ids: list) -> None:
+        '''Fetches tracks missing in cache in bulk.'''
+        missing: list = [i for i in ids if i not in self.songs]
+        for start in range(0, len(missing), TRACKS_PER_LOOKUP):
+            response: dict = client.tracks(missing[start:start + TRACKS_PER_LOOKUP])
+            for item in response['tracks']:
+                if item:
+                    self.songs[item['id']] = song_from_item(item)
+
+    def pop(self) -> dict:
+        '''Returns next track to play, or None if no tracks are loaded.'''
+        if not self.order:
+            # All tracks were played, starting again in new order.
+            self.order = list(self.tracks)
+            random.shuffle(self.order)
+        if not self.order:
+            return None
+        return self.songs[self.order.pop()]
+
+
+class SpotifyWorker(threading.Thread):
+    '''Sends playback commands to Spotify in background thread.
+
+    Commands are queued without blocking and redundant ones are dropped,
+    e.g. pause followed by pause or pause followed by resume before any of
+    them was sent. After skipping, currently playing track is polled with
+    increasing delay until it changes. Pause is skipped when playback is
+    already paused by worker, so pause sent right after press and pause sent
+    by the game cost single request. Idle connection is kept alive, so pause
+    never waits for new connection. Callbacks are called from worker thread.
+    '''
+
+    def __init__(self, client: 'Spotify',
+                 on_track: Callable[[dict], None],
+                 on_error: Callable[[str, str], None],
+                 catalog: SpotifyCatalog = None,
+                 on_paused: Callable[[int], None] = None) -> None:
+        super().__init__(name='SpotifyWorker', daemon=True)
+        self.client: Spotify = client
+        # When tracks are loaded, rounds start without polling.
+        self.catalog: SpotifyCatalog = catalog
+        self.on_track: Callable[[dict], None] = on_track  # Called with new song after skip.
+        self.on_error: Callable[[str, str], None] = on_error  # Called with command and error.
+        # Called with moment when pause request was answered.
+        self.on_paused: Callable[[int], None] = on_paused
+        self.condition: threading.Condition = threading.Condition()
+        self.commands: list = []
+        self.stopped: bool = False
+        self.track_id: str = None  # Track playing before last skip.
+        self.paused: bool = False  # Whether last request paused playback.
+
+    def send(self, command: str) -> None:
+        '''Queues command, can be called from any thread.'''
+        with self.condition:
+            if command in (PAUSE, RESUME):
+                # Only last pause or resume after last skip matters.
+                while self.commands and self.commands[-1] in (PAUSE, RESUME):
+                    self.commands.pop()
+            elif self.commands and self.commands[-1] == command:
+                return
+            self.commands.append(command)
+            self.condition.notify()
+
+    def stop(self) -> None:
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.commands or self.stopped, KEEPALIVE_INTERVAL)
+                if self.stopped:
+                    return
+                command: str = self.commands.pop(0) if self.commands else None
+            if command is None:
+                self.keep_alive()
+                continue
+            try:
+                self.execute(command)
+            except Exception as e:
+                l.error(f'Spotify {command} failed: {e}')
+                self.on_error(command, str(e))
+
+    def execute(self, command: str) -> None:
+        with instruments.measure(f'spotify {command}'):
+            if command == PAUSE:
+                if not self.paused:
+                    self.client.pause_playback()
+                    self.paused = True
+                    if self.on_paused:
+                        self.on_paused(time.monotonic_ns())
+            elif command == RESUME:
+                self.client.start_playback()
+                self.paused = False
+            elif command == LOAD:
+                if self.catalog:
+                    self.catalog.load(self.client)
+            elif command == NEXT:
+                song: dict = self.catalog.pop() if self.catalog else None
+                if song is not None:
+                    # Track is started directly, its name and artists are already known.
+                    self.client.start_playback(
+                        context_uri=self.catalog.context_uri, offset={'uri': song['uri']})
+                    self.paused = False
+                    self.track_id = song['id']
+                    self.on_track(song)
+                    return
+                if self.track_id is None:
+                    self.track_id = self.current_track_id()
+                self.client.next_track()
+                self.paused = False
+                self.on_track(self.wait_for_track())
+
+    def keep_alive(self) -> None:
+        '''Sends cheap request, so server doesn't close idle connection.'''
+        try:
+            with instruments.measure('spotify keep-alive'):
+                self.client.currently_playing()
+        except Exception as e:
+            l.warning(f'Spotify keep-alive failed: {e}')
+
+    def current_track_id(self) -> str:
+        response: dict = self.client.currently_playing()
+        if response and response.get('item'):
+            return response['item'].get('id')
+        return None
+
+    def execute_pending(self) -> None:
+        '''Executes pending pause or resume without waiting for skip to finish.'''
+        while True:
+            with self.condition:
+                if not self.commands or self.commands[0] not in (PAUSE, RESUME):
+                    return
+                command: str = self.commands.pop(0)
+            try:
+                self.execute(command)
+            except Exception as e:
+                l.error(f'Spotify {command} failed: {e}')
+                self.on_error(command, str(e))
+
+    def wait_for_track(self) -> dict:
+        '''Polls currently playing track until it differs from previous one.'''
+        delay: float = POLL_FIRST_DELAY
+        deadline: float = time.monotonic() + POLL_TIMEOUT
+        while True:
+            response: dict = self.client.currently_playing()
+            item: dict = response.get('item') if response else None
+            if item and (item.get('id') != self.track_id or time.monotonic() >= deadline):
+                self.track_id = item.get('id')
+                return song_from_item(item)
+            if time.monotonic() >= deadline:
+                raise TimeoutError('Track did not change.')
+            # Pending commands, e.g. pause, are not delayed by polling.
+            self.execute_pending()
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_MAX_DELAY)
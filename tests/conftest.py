@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Modules of the game are at top of the repository, which isn't installed.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Window and mixer are opened without display and sound card.
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
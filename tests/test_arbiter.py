@@ -0,0 +1,100 @@
+from arbiter import BuzzerArbiter
+from buzzers import BuzzerPress
+
+MS = 1_000_000
+
+
+def press(team: int, ms: float) -> BuzzerPress:
+    return BuzzerPress(team, int(ms * MS), 'test')
+
+
+def test_earliest_press_wins():
+    arbiter = BuzzerArbiter(4, tie_window_us=2000)
+    assert arbiter.submit(press(2, 10))
+    assert arbiter.submit(press(1, 15))
+    assert arbiter.resolve(20 * MS).team == 2
+    assert [p.team for p in arbiter.runners_up] == [1]
+
+
+def test_contest_waits_for_tie_window():
+    arbiter = BuzzerArbiter(4, tie_window_us=2000)
+    arbiter.submit(press(0, 10))
+    assert arbiter.deadline_ns() == 12 * MS
+    assert arbiter.resolve(11 * MS) is None
+    assert arbiter.resolve(12 * MS).team == 0
+
+
+def test_tie_goes_to_team_that_waited_longest():
+    arbiter = BuzzerArbiter(4, tie_window_us=2000)
+    arbiter.submit(press(0, 0))
+    assert arbiter.resolve(10 * MS).team == 0
+    arbiter.verdict(True)
+
+    # Team 0 answered last, so team 1 wins the tie although it pressed later.
+    arbiter.submit(press(0, 100))
+    arbiter.submit(press(1, 101))
+    assert arbiter.resolve(110 * MS).team == 1
+
+
+def test_press_after_tie_window_loses():
+    arbiter = BuzzerArbiter(4, tie_window_us=2000)
+    arbiter.submit(press(0, 0))
+    arbiter.resolve(10 * MS)
+    arbiter.verdict(True)
+
+    arbiter.submit(press(0, 100))
+    arbiter.submit(press(1, 103))
+    assert arbiter.resolve(110 * MS).team == 0
+
+
+def test_result_does_not_depend_on_delivery_order():
+    presses = [press(3, 5.5), press(1, 5), press(2, 6)]
+    winners = set()
+    for order in (presses, presses[::-1], presses[1:] + presses[:1]):
+        arbiter = BuzzerArbiter(4, tie_window_us=2000)
+        for p in order:
+            arbiter.submit(p)
+        winners.add(arbiter.resolve(100 * MS))
+    assert winners == {press(1, 5)}
+
+
+def test_presses_after_decision_are_only_recorded():
+    arbiter = BuzzerArbiter(4)
+    arbiter.submit(press(0, 0))
+    arbiter.resolve(0)
+    assert not arbiter.submit(press(1, 1))
+    assert [p.team for p in arbiter.runners_up] == [1]
+
+
+def test_incorrect_team_is_locked_out_until_new_round():
+    arbiter = BuzzerArbiter(4)
+    arbiter.submit(press(0, 0))
+    arbiter.resolve(0)
+    arbiter.verdict(False)
+    assert not arbiter.submit(press(0, 10))
+    assert arbiter.submit(press(1, 11))
+    assert arbiter.resolve(20 * MS).team == 1
+
+    arbiter.new_round()
+    assert arbiter.submit(press(0, 30))
+
+
+def test_correct_answer_and_disabled_lockout_keep_team_in():
+    arbiter = BuzzerArbiter(4)
+    arbiter.submit(press(0, 0))
+    arbiter.resolve(0)
+    arbiter.verdict(True)
+    assert arbiter.submit(press(0, 10))
+
+    arbiter = BuzzerArbiter(4, lockout=False)
+    arbiter.submit(press(0, 0))
+    arbiter.resolve(0)
+    arbiter.verdict(False)
+    assert arbiter.submit(press(0, 10))
+
+
+def test_press_of_unused_team_is_rejected():
+    arbiter = BuzzerArbiter(2)
+    assert not arbiter.submit(press(2, 0))
+    assert not arbiter.submit(press(-1, 0))
+    assert arbiter.deadline_ns() is None
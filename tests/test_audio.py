@@ -0,0 +1,111 @@
+import io
+import os
+import wave
+
+import numpy as np
+import pygame
+import pytest
+from pygame import mixer
+
+from audio import AudioOutput, SongPrefetcher, prepare_song, read_wav, resample, to_output
+
+
+def wav(path, samples: bytes, rate: int, width: int = 2, channels: int = 1) -> None:
+    with wave.open(str(path), 'wb') as file:
+        file.setnchannels(channels)
+        file.setsampwidth(width)
+        file.setframerate(rate)
+        file.writeframes(samples)
+
+
+@pytest.fixture(scope='module')
+def output():
+    output = AudioOutput(44100)
+    yield output
+    mixer.quit()
+
+
+def test_resample_keeps_same_rate():
+    samples = np.ones((10, 2), np.float32)
+    assert resample(samples, 44100, 44100) is samples
+
+
+def test_resample_interpolates_between_frames():
+    samples = np.array([[0], [1], [0], [-1]], np.float32)
+    resampled = resample(samples, 22050, 44100)
+    assert resampled.shape == (8, 1)
+    assert resampled.dtype == np.float32
+    assert resampled[:, 0].tolist() == [0, 0.5, 1, 0.5, 0, -0.5, -1, -1]
+
+
+def test_resample_changes_length_by_ratio():
+    samples = np.zeros((48000, 2), np.float32)
+    assert resample(samples, 48000, 44100).shape == (44100, 2)
+    assert resample(samples[:0], 48000, 44100).shape == (0, 2)
+
+
+@pytest.mark.parametrize('width, raw, expected', [
+    (1, bytes([128, 255, 0]), [0, 127 / 128, -1]),
+    (2, np.array([0, 16384, -32768], np.int16).tobytes(), [0, 0.5, -1]),
+    (3, bytes([0, 0, 0, 0, 0, 0x40, 0, 0, 0x80]), [0, 0.5, -1]),
+])
+def test_read_wav_scales_samples(tmp_path, width: int, raw: bytes, expected: list):
+    wav(tmp_path / 'song.wav', raw, 8000, width)
+    samples, rate = read_wav(io.BytesIO((tmp_path / 'song.wav').read_bytes()))
+    assert rate == 8000
+    assert samples[:, 0].tolist() == pytest.approx(expected)
+
+
+def test_read_wav_stops_after_max_seconds(tmp_path):
+    wav(tmp_path / 'song.wav', bytes(2 * 2 * 8000 * 3), 8000, channels=2)
+    samples, _ = read_wav(io.BytesIO((tmp_path / 'song.wav').read_bytes()), 1.5)
+    assert samples.shape == (12000, 2)
+
+
+def test_read_wav_starts_at_given_second(tmp_path):
+    wav(tmp_path / 'song.wav', np.arange(8000 * 3, dtype=np.int16).tobytes(), 8000)
+    samples, _ = read_wav(io.BytesIO((tmp_path / 'song.wav').read_bytes()), 1, 1.5)
+    assert len(samples) == 8000
+    assert samples[0, 0] * 32768 == 12000
+
+
+def test_to_output_is_clipped_16_bit_stereo():
+    samples = np.array([[0.5], [2]], np.float32)
+    output = np.frombuffer(to_output(samples, 44100, 44100), np.int16)
+    assert output.tolist() == [16383, 16383, 32767, 32767]
+
+
+def test_wav_is_prepared_at_rate_of_mixer(tmp_path, output: AudioOutput):
+    wav(tmp_path / 'song.wav', bytes(2 * 22050), 22050)
+    song = prepare_song({'path': str(tmp_path / 'song.wav'), 'extension': 'wav'})
+    assert song['frequency'] == 22050
+    assert song['sound'].get_length() == pytest.approx(1, abs=0.01)
+
+
+# Example shipped with pygame, about 7 s long.
+MP3 = os.path.join(os.path.dirname(pygame.__file__), 'examples', 'data', 'house_lo.mp3')
+
+
+@pytest.mark.skipif(not os.path.exists(MP3), reason='pygame examples are not installed')
+@pytest.mark.parametrize('start', [0, 2])
+def test_mp3_is_cut_to_max_seconds(output: AudioOutput, start: float):
+    song = {'path': MP3, 'extension': 'mp3', 'frequency': 44100, 'start': start}
+    assert prepare_song(song, 3)['sound'].get_length() == pytest.approx(3, abs=0.01)
+    assert prepare_song(song)['sound'].get_length() == pytest.approx(7.26 - start, abs=0.05)
+
+
+def test_refreshed_song_is_cut_again_without_skipping_it(tmp_path, output: AudioOutput):
+    songs = []
+    for name in ('first', 'second'):
+        wav(tmp_path / f'{name}.wav', bytes(2 * 3 * 22050), 22050)
+        songs.append({'path': str(tmp_path / f'{name}.wav'), 'extension': 'wav', 'name': name})
+    prefetcher = SongPrefetcher(lambda: songs.pop(0) if songs else None)
+    prefetcher.max_seconds = 2
+    prefetcher.prefetch()
+    prefetcher.max_seconds = 1
+    prefetcher.refresh()
+    song = prefetcher.take()
+    assert song['name'] == 'first'
+    assert song['sound'].get_length() == pytest.approx(1, abs=0.01)
+    assert prefetcher.take()['name'] == 'second'
+    prefetcher.shutdown()
@@ -0,0 +1,101 @@
+import pytest
+
+from buzzers import BYTE_TIME_NS, RECENT_SEQUENCES, SEQUENCE_MODULUS, PortParser, SerialMultiplexer
+
+
+@pytest.fixture
+def multiplexer():
+    presses: list = []
+    multiplexer = SerialMultiplexer(presses.append)
+    multiplexer.presses = presses
+    yield multiplexer
+    multiplexer.stop()
+
+
+def frame(board: int, sequence: int, team: int) -> bytes:
+    return f'#{board},{sequence},{team}\n'.encode()
+
+
+def test_digits_of_arduino_without_id():
+    parser = PortParser('COM1')
+    assert parser.parse(b'3x\r\n', 1000) == [(3, 1000 - 3 * BYTE_TIME_NS, None, None)]
+
+
+def test_frame_is_stamped_with_arrival_of_its_last_byte():
+    parser = PortParser('COM1')
+    data = frame(7, 42, 2) + b'1'
+    assert parser.parse(data, 10_000_000) == [
+        (2, 10_000_000 - BYTE_TIME_NS, 7, 42),
+        (1, 10_000_000, None, None),
+    ]
+
+
+def test_frame_spanning_reads():
+    parser = PortParser('COM1')
+    data = frame(7, 42, 2)
+    assert parser.parse(data[:4], 100) == []
+    assert parser.parse(data[4:], 200) == [(2, 200, 7, 42)]
+
+
+def test_broken_and_too_long_frames_are_dropped():
+    parser = PortParser('COM1')
+    assert parser.parse(b'#1,x,2\n', 0) == []
+    # Parser is back outside of frame, so digit after the frame counts.
+    assert [press[0] for press in parser.parse(b'#' + b'x' * 40 + b'\n4', 0)] == [4]
+
+
+def test_repeated_press_is_dropped(multiplexer: SerialMultiplexer):
+    assert multiplexer.check_sequence('COM1', 7, 1)
+    assert not multiplexer.check_sequence('COM1', 7, 1)
+    assert multiplexer.duplicates == 1
+
+
+def test_late_repeated_press_is_dropped(multiplexer: SerialMultiplexer):
+    for sequence in (5, 6, 5, 7, 6):
+        multiplexer.check_sequence('COM1', 7, sequence)
+    assert multiplexer.duplicates == 2
+    # Frame older than remembered numbers isn't taken for restart of the board.
+    for sequence in range(8, 30 + RECENT_SEQUENCES):
+        assert multiplexer.check_sequence('COM1', 7, sequence)
+    assert not multiplexer.check_sequence('COM1', 7, 20)
+    assert multiplexer.duplicates == 3
+
+
+def test_lost_press_arriving_late_is_dropped(multiplexer: SerialMultiplexer):
+    for sequence in (1, 2, 3, 5, 6):
+        assert multiplexer.check_sequence('COM1', 7, sequence)
+    assert not multiplexer.check_sequence('COM1', 7, 4)
+    assert multiplexer.lost == 1
+
+
+def test_lost_presses_are_counted(multiplexer: SerialMultiplexer):
+    assert multiplexer.check_sequence('COM1', 7, 1)
+    assert multiplexer.check_sequence('COM1', 7, 4)
+    assert multiplexer.lost == 2
+
+
+def test_sequence_wraps_around(multiplexer: SerialMultiplexer):
+    assert multiplexer.check_sequence('COM1', 7, SEQUENCE_MODULUS - 1)
+    assert multiplexer.check_sequence('COM1', 7, 0)
+    assert multiplexer.lost == 0
+
+
+def test_presses_of_restarted_board_are_accepted(multiplexer: SerialMultiplexer):
+    parser = PortParser('COM1')
+    data = b''.join(frame(7, sequence, 0) for sequence in range(1, 501))
+    assert len(multiplexer.accept(parser, data, 10**12)) == 500
+
+    # Board restarted and numbers presses from 1 again.
+    data = b''.join(frame(7, sequence, 1) for sequence in range(1, 6))
+    presses = multiplexer.accept(parser, data, 2 * 10**12)
+    assert [press.team for press in presses] == [1] * 5
+    assert multiplexer.duplicates == 0
+
+
+def test_reopened_port_forgets_its_boards(multiplexer: SerialMultiplexer):
+    multiplexer.check_sequence('COM1', 7, 3)
+    multiplexer.check_sequence('COM2', 8, 3)
+    with multiplexer.lock:
+        multiplexer.forget_boards('COM1')
+    assert multiplexer.check_sequence('COM1', 7, 3)
+    assert not multiplexer.check_sequence('COM2', 8, 3)
@@ -0,0 +1,100 @@
+import time
+import wave
+
+import numpy as np
+import pytest
+
+from duplicates import DuplicateIndex, bands, correlation, distance
+from features import FeatureAnalyser, FeatureIndex, envelope, spectrum
+
+RATE = 11025
+NOTES = [110, 147, 196, 262, 330, 440, 587, 784, 1046, 1568]
+
+
+def song(seed: int, seconds: int = 40) -> np.ndarray:
+    '''Returns random melody of plucked notes, different for every seed.'''
+    rng = np.random.default_rng(seed)
+    t = np.arange(RATE // 4) / RATE
+    notes = []
+    for _ in range(seconds * 4):
+        pitch = rng.choice(NOTES) * rng.uniform(0.98, 1.02)
+        note = rng.uniform(0.05, 0.8) * np.sin(2 * np.pi * pitch * t) * np.exp(-t * rng.uniform(1, 8))
+        note += rng.uniform(0, 0.2) * rng.standard_normal(len(t)) * np.exp(-t * 20)
+        notes.append(note)
+    return np.concatenate(notes).astype(np.float32)
+
+
+def reencode(samples: np.ndarray) -> tuple:
+    '''Returns quieter copy with leading silence at double rate, like another release of the song.'''
+    samples = np.concatenate([np.zeros(int(1.5 * RATE), np.float32), 0.7 * samples])
+    resampled = np.interp(np.arange(2 * len(samples)) / 2, np.arange(len(samples)), samples)
+    return resampled.astype(np.float32), 2 * RATE
+
+
+def write(path, samples: np.ndarray, rate: int = RATE) -> str:
+    with wave.open(str(path), 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(rate)
+        file.writeframes((samples * 32767).astype(np.int16).tobytes())
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def features():
+    '''Loudness and spectrum of six different songs and re-encoded copy of the first.'''
+    features = {}
+    for seed in range(6):
+        samples = song(seed)
+        features[f'song{seed}'] = (envelope(samples, RATE)[0], spectrum(samples, RATE))
+    samples, rate = reencode(song(0))
+    features['copy'] = (envelope(samples, rate)[0], spectrum(samples, rate))
+    return features
+
+
+def test_distance_and_bands():
+    assert distance(0b1011, 0b0001) == 2
+    assert distance(-1, 0) == 64
+    assert bands(0x0004_0003_0002_0001) == [1, 2, 3, 4]
+
+
+def test_correlation_aligns_shifted_envelopes(features):
+    original, copy = features['song0'][0], features['copy'][0]
+    assert correlation(original, copy) > 0.6
+    assert correlation(original, features['song1'][0]) < 0.6
+    # Envelopes of too different length aren't compared at all.
+    assert correlation(original, original[:len(original) // 3]) == 0
+
+
+def test_index_finds_only_reencoded_copy(features):
+    index = DuplicateIndex(lambda song_hash: features[song_hash][0])
+    for seed in range(6):
+        assert index.add(f'song{seed}', features[f'song{seed}'][1]) is None
+    assert index.add('copy', features['copy'][1]) == 'song0'
+    # Envelopes are compared only for songs with similar spectra.
+    assert index.comparisons < 6
+
+    index.clear()
+    assert index.add('copy', features['copy'][1]) is None
+
+
+def test_analyser_reports_copies_and_reencodings(tmp_path):
+    index = FeatureIndex(str(tmp_path / 'features.sqlite'))
+    paths = [write(tmp_path / f'{seed}.wav', song(seed)) for seed in range(3)]
+    paths.append(write(tmp_path / 'reencoded.wav', *reencode(song(1))))
+    songs = [{'hash': f'song{seed}', 'path': path} for seed, path in enumerate(paths)]
+    # Copy of the same file has the same hash.
+    songs.append({'hash': 'song0', 'path': str(tmp_path / 'moved' / '0.wav')})
+    found = []
+    analyser = FeatureAnalyser(index, found.extend, workers=1)
+    analyser.start()
+    analyser.add(songs)
+    deadline = time.monotonic() + 30
+    while analyser.analysed < 4 or analyser.analysing:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    analyser.report()
+    analyser.cancel()
+    analyser.join(5)
+    index.close()
+    assert sorted(found) == sorted([paths[3], songs[4]['path']])
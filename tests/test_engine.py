@@ -0,0 +1,154 @@
+import pytest
+
+from buzzers import BuzzerPress
+from engine import (GameEngine, NEW_GAME, NO_SONGS, PAUSED, RESUMED, SCORED, SONG_STARTED,
+                    STOPPED, TEAM_GUESSING, S_PAUSED, S_PLAYING, S_STOPPED, Silencer,
+                    VirtualClock)
+
+MS = 1_000_000
+
+
+@pytest.fixture
+def clock() -> VirtualClock:
+    return VirtualClock()
+
+
+@pytest.fixture
+def engine(clock: VirtualClock) -> GameEngine:
+    songs = iter([{'name': 'First'}, {'name': 'Second'}])
+    engine = GameEngine(3, 30, points_correct=2, points_incorrect=-1, tie_window_us=2000,
+                        song_source=lambda: next(songs, None), time_ns=clock)
+    engine.events = []
+    engine.subscribe(engine.events.append)
+    return engine
+
+
+def kinds(engine: GameEngine) -> list:
+    return [event.kind for event in engine.events]
+
+
+def buzz(engine: GameEngine, clock: VirtualClock, team: int) -> None:
+    '''Presses buzzer of the team and resolves contest after tie window.'''
+    assert engine.press(BuzzerPress(team, clock(), 'test'))
+    clock.advance(2)
+    assert engine.resolve().team == team
+
+
+def test_next_song_starts_playing(engine: GameEngine):
+    assert engine.next_song()
+    assert engine.playback_state == S_PLAYING
+    assert engine.events[0].kind == SONG_STARTED
+    assert engine.events[0].song == {'name': 'First'}
+    assert not engine.can_play_next
+
+
+def test_no_songs(engine: GameEngine):
+    assert engine.next_song()
+    engine.stop()
+    assert engine.next_song()
+    engine.stop()
+    assert not engine.next_song()
+    assert kinds(engine)[-1] == NO_SONGS
+    assert engine.playback_state == S_STOPPED
+
+
+def test_press_pauses_song_and_gives_floor_to_team(engine: GameEngine, clock: VirtualClock):
+    engine.next_song()
+    buzz(engine, clock, 1)
+    assert kinds(engine) == [SONG_STARTED, PAUSED, TEAM_GUESSING]
+    assert engine.playback_state == S_PAUSED
+    assert engine.is_team_guessing and engine.guessing_team == 1
+    assert not engine.can_play_next and not engine.can_pause_resume
+    # Another contest isn't resolved while team is guessing.
+    engine.press(BuzzerPress(2, clock(), 'test'))
+    assert engine.resolve(clock.now + 10 * MS) is None
+
+
+def test_correct_answer_scores_and_stops_song(engine: GameEngine, clock: VirtualClock):
+    engine.next_song()
+    buzz(engine, clock, 1)
+    engine.answer(True)
+    scored = engine.events[-2]
+    assert (scored.kind, scored.team, scored.points, scored.score) == (SCORED, 1, 2, 2)
+    assert kinds(engine)[-1] == STOPPED
+    assert engine.team_scores == [0, 2, 0]
+    assert engine.can_play_next
+
+
+def test_incorrect_answer_lets_song_resume_without_team(engine: GameEngine, clock: VirtualClock):
+    engine.next_song()
+    buzz(engine, clock, 0)
+    engine.answer(False)
+    assert engine.team_scores == [-1, 0, 0]
+    assert engine.playback_state == S_PAUSED
+    engine.pause_resume()
+    assert kinds(engine)[-1] == RESUMED
+    assert not engine.press(BuzzerPress(0, clock(), 'test'))
+    buzz(engine, clock, 2)
+
+
+def test_answer_without_guessing_team_is_ignored(engine: GameEngine):
+    engine.next_song()
+    engine.answer(True)
+    assert engine.team_scores == [0, 0, 0]
+    assert kinds(engine) == [SONG_STARTED]
+
+
+def test_paused_time_is_not_counted(engine: GameEngine, clock: VirtualClock):
+    engine.next_song()
+    clock.advance(10_000)
+    engine.pause()
+    clock.advance(60_000)
+    engine.resume()
+    assert engine.millis == 10_000
+    assert not engine.check_time()
+    clock.advance(20_000)
+    assert engine.check_time()
+    assert engine.playback_state == S_STOPPED
+    assert kinds(engine)[-1] == STOPPED
+
+
+def test_new_game_resets_scores(engine: GameEngine, clock: VirtualClock):
+    engine.next_song()
+    buzz(engine, clock, 1)
+    engine.answer(True)
+    engine.new_game()
+    assert kinds(engine)[-1] == NEW_GAME
+    assert engine.team_scores == [0, 0, 0]
+    assert engine.songs_played == 0
+    assert engine.guessing_team is None
+
+
+class Sink:
+    buffer_ms = 5
+
+    def __init__(self) -> None:
+        self.volume = 1
+
+    def silence(self) -> None:
+        self.volume = 0
+
+
+def test_first_press_silences_local_song_once(clock: VirtualClock):
+    silencer, sink = Silencer(clock), Sink()
+    clock.advance(10)
+    silencer.silence(BuzzerPress(0, 7 * MS, 'test'), S_PLAYING, None, sink)
+    assert sink.volume == 0
+    # Audio in output buffer is heard after the press.
+    assert silencer.latency_ms == 8
+    sink.volume = 1
+    silencer.silence(BuzzerPress(1, 8 * MS, 'test'), S_PLAYING, None, sink)
+    assert sink.volume == 1
+
+    silencer.reset()
+    silencer.silence(BuzzerPress(1, 8 * MS, 'test'), S_PAUSED, None, sink)
+    assert sink.volume == 1
+
+
+def test_spotify_reports_its_silence(clock: VirtualClock):
+    silencer, paused = Silencer(clock), []
+    silencer.silence(BuzzerPress(0, 0, 'test'), S_PLAYING, lambda: paused.append(True), Sink())
+    assert paused == [True] and silencer.latency_ms is None
+    silencer.report(150 * MS)
+    silencer.report(300 * MS)
+    assert silencer.latency_ms == 150
@@ -0,0 +1,125 @@
+import os
+import time
+import random
+import wave
+
+import numpy as np
+import pytest
+
+from features import (ENVELOPE_RATE, FeatureAnalyser, FeatureIndex, envelope, pick_start)
+
+RATE = 8000
+
+
+def song_with_loud_part(path, seconds: int = 20, loud: tuple = (8, 11)) -> str:
+    '''Writes quiet song with loud tone between given seconds.'''
+    t = np.arange(seconds * RATE) / RATE
+    samples = 0.001 * np.sin(2 * np.pi * 440 * t)
+    part = (t >= loud[0]) & (t < loud[1])
+    samples[part] = 0.8 * np.sin(2 * np.pi * 440 * t[part])
+    with wave.open(str(path), 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(RATE)
+        file.writeframes((samples * 32767).astype(np.int16).tobytes())
+    return str(path)
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = FeatureIndex(str(tmp_path / 'features.sqlite'))
+    yield index
+    index.close()
+
+
+def test_envelope_of_silence_and_full_scale():
+    loudness, onsets = envelope(np.zeros(RATE, np.float32), RATE)
+    assert len(loudness) == ENVELOPE_RATE
+    assert loudness.tolist() == [0] * ENVELOPE_RATE
+    loudness, _ = envelope(np.ones((RATE, 2), np.float32), RATE)
+    assert loudness.tolist() == [255] * ENVELOPE_RATE
+
+
+def test_onsets_are_rises_of_loudness():
+    samples = np.concatenate([np.zeros(RATE // 2), np.ones(RATE // 2), np.zeros(RATE // 2)])
+    loudness, onsets = envelope(samples.astype(np.float32), RATE)
+    assert onsets.argmax() == 5
+    assert onsets[5] == 255
+    # Fall back to silence isn't an onset.
+    assert onsets[10] == 0
+
+
+def test_pick_start_finds_loud_part():
+    loudness = np.zeros(300, np.uint8)
+    loudness[150:250] = 200
+    onsets = np.zeros(300, np.uint8)
+    starts = {pick_start(loudness, onsets, 3, random.Random(seed)) for seed in range(20)}
+    # Snippet is whole inside loud part, but not always at the same moment.
+    assert min(starts) >= 15 and max(starts) <= 22
+    assert len(starts) > 1
+
+
+def test_short_song_starts_at_beginning():
+    loudness = np.full(50, 100, np.uint8)
+    assert pick_start(loudness, loudness, 5) == 0
+    assert pick_start(loudness, loudness, 30) == 0
+
+
+def test_index_keeps_features_by_hash(index: FeatureIndex):
+    loudness, onsets = np.arange(5, dtype=np.uint8), np.ones(5, np.uint8)
+    profile = np.ones(32, np.float32)
+    index.update([('abc', loudness.tobytes(), onsets.tobytes(), profile.tobytes())])
+    assert index.spectra()['abc'].tolist() == profile.tolist()
+    stored = index.get('abc')
+    assert stored[0].tolist() == loudness.tolist() and stored[1].tolist() == onsets.tolist()
+    assert index.get('other') is None
+    assert index.snippet_start({'hash': 'other'}, 1) == 0
+
+
+def test_analyser_finds_loud_part_of_songs(tmp_path, index: FeatureIndex):
+    songs = [{'hash': f'song{i}',
+              'path': song_with_loud_part(tmp_path / f'{i}.wav', loud=(4 + i, 10 + i))}
+             for i in range(3)]
+    analyser = FeatureAnalyser(index, workers=1)
+    analyser.start()
+    analyser.add(songs + [{'hash': 'broken', 'path': str(tmp_path / 'missing.wav')}])
+    deadline = time.monotonic() + 30
+    while analyser.analysed < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    analyser.cancel()
+    analyser.join(5)
+    assert set(index.spectra()) == {'song0', 'song1', 'song2'}
+    for i, song in enumerate(songs):
+        assert 3.5 + i <= index.snippet_start(song, 3) <= 7.5 + i
+
+
+class CrashingAnalyser(FeatureAnalyser):
+    '''Analyser whose first pool has worker dying at first task.'''
+
+    pools = 0
+
+    def create_executor(self):
+        executor = super().create_executor()
+        self.pools += 1
+        if self.pools == 1:
+            submit = executor.submit
+            executor.submit = lambda *_: submit(os._exit, 1)
+        return executor
+
+
+def test_analyser_survives_dying_worker(tmp_path, index: FeatureIndex):
+    analyser = CrashingAnalyser(index, workers=1)
+    analyser.start()
+    analyser.add([{'hash': 'crash', 'path': song_with_loud_part(tmp_path / 'crash.wav')}])
+    deadline = time.monotonic() + 30
+    while analyser.pools < 2 or analyser.analysing:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    analyser.add([{'hash': 'song', 'path': song_with_loud_part(tmp_path / 'song.wav')}])
+    while analyser.analysed < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    analyser.cancel()
+    analyser.join(5)
+    assert set(index.spectra()) == {'song'}
@@ -0,0 +1,56 @@
+import os
+
+from engine import NEW_GAME, SCORED, SONG_STARTED, GameEvent
+from journal import Journal, event_record, read, restore_scores, scoreboard
+
+
+def write(path: str, events: list) -> None:
+    journal = Journal(path)
+    for event in events:
+        # Appended directly, record_event would archive the journal on new game.
+        journal.append(event_record(event))
+    journal.close()
+
+
+def scored(team: int, points: int, score: int) -> GameEvent:
+    return GameEvent(SCORED, team=team, points=points, score=score, correct=points > 0)
+
+
+def test_missing_journal_gives_zero_scores(tmp_path):
+    assert restore_scores(str(tmp_path / 'journal.jsonl'), 3) == [0, 0, 0]
+
+
+def test_scores_of_last_game_are_restored(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    write(path, [
+        GameEvent(SONG_STARTED, song={'name': 'Song', 'path': 'song.mp3'}),
+        scored(0, 1, 1), scored(2, 1, 1), GameEvent(NEW_GAME),
+        scored(1, 1, 1), scored(1, -1, 0), scored(2, -1, -1), scored(1, 1, 1),
+    ])
+    assert restore_scores(path, 3) == [0, 1, -1]
+    assert restore_scores(path, 3) == scoreboard(read(path), 3)
+
+
+def test_torn_record_and_unused_teams_are_skipped(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    write(path, [scored(0, 1, 1), scored(5, 1, 1)])
+    with open(path, 'ab') as file:
+        file.write(b'{"kind":"scored","t":1,"team":0,"points":1,"score":2')
+    assert restore_scores(path, 2) == [1, 0]
+
+    # Journal opened after crash starts on new line after torn record.
+    write(path, [scored(1, 1, 1)])
+    assert restore_scores(path, 2) == [1, 1]
+    assert len(read(path)) == 3
+
+
+def test_new_game_archives_journal(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = Journal(path)
+    journal.record_event(scored(0, 1, 1))
+    journal.record_event(GameEvent(NEW_GAME))
+    journal.close()
+    assert restore_scores(path, 2) == [0, 0]
+    archives = [name for name in os.listdir(tmp_path) if name != 'journal.jsonl']
+    assert len(archives) == 1
+    assert restore_scores(str(tmp_path / archives[0]), 2) == [1, 0]
@@ -0,0 +1,152 @@
+import os
+import threading
+import wave
+
+import pytest
+
+from library import PROBE_CHUNK, LibraryIndex, LibraryScanner, content_hash
+
+
+def make_wav(path, seconds: float = 1, rate: int = 8000, fill: int = 0) -> str:
+    with wave.open(str(path), 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(rate)
+        file.writeframes(bytes([fill]) * int(2 * seconds * rate))
+    return str(path)
+
+
+@pytest.fixture
+def songs(tmp_path):
+    directory = tmp_path / 'songs'
+    (directory / 'Album').mkdir(parents=True)
+    make_wav(directory / 'First.wav', 2)
+    make_wav(directory / 'Album' / 'Second.wav', 1, 22050)
+    (directory / 'cover.jpg').write_bytes(b'jpg')
+    return directory
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = LibraryIndex(str(tmp_path / 'library.db'))
+    yield index
+    index.close()
+
+
+def scan(index: LibraryIndex, directory, scanner_class: type = LibraryScanner, **kwargs) -> LibraryScanner:
+    '''Runs scanner to the end, songs it passed are in its songs attribute.'''
+    songs: list = []
+    progress: list = []
+    finished: list = []
+    done = threading.Event()
+
+    def on_finished(cancelled: bool) -> None:
+        finished.append(cancelled)
+        done.set()
+
+    scanner = scanner_class(index, str(directory), songs.extend, lambda *p: progress.append(p),
+                             on_finished, workers=2, **kwargs)
+    scanner.start()
+    assert done.wait(30)
+    scanner.join(5)
+    scanner.songs, scanner.progress, scanner.finished = songs, progress, finished
+    return scanner
+
+
+def by_title(songs: list) -> dict:
+    return {song['title']: song for song in songs}
+
+
+def test_scan_reads_metadata_of_songs_in_subdirectories(songs, index: LibraryIndex):
+    scanner = scan(index, songs)
+    found = by_title(scanner.songs)
+    assert set(found) == {'First', 'Second'}
+    assert found['First']['duration'] == 2
+    assert found['Second']['frequency'] == 22050
+    assert found['Second']['extension'] == 'wav'
+    assert found['Second']['name'] == 'Second'
+    assert scanner.finished == [False]
+    assert scanner.progress[-1] == (2, 2)
+
+
+def test_unchanged_files_are_not_probed_again(songs, tmp_path, index: LibraryIndex):
+    first = by_title(scan(index, songs).songs)
+    index.close()
+    # Index is kept in a file, so it's reused after restart.
+    index = LibraryIndex(str(tmp_path / 'library.db'))
+    scanner = scan(index, songs)
+    index.close()
+    assert scanner.updated == 0
+    assert by_title(scanner.songs)['First']['hash'] == first['First']['hash']
+
+
+def test_changed_and_removed_files_are_updated(songs, index: LibraryIndex):
+    scan(index, songs)
+    make_wav(songs / 'First.wav', 3)
+    os.remove(songs / 'Album' / 'Second.wav')
+    scanner = scan(index, songs)
+    found = by_title(scanner.songs)
+    assert set(found) == {'First'}
+    assert found['First']['duration'] == 3
+    assert scanner.updated == 1
+    assert list(index.known(str(songs))) == [str(songs / 'First.wav')]
+
+
+def test_unreadable_file_is_skipped(songs, index: LibraryIndex):
+    (songs / 'Broken.wav').write_bytes(b'not a wav file')
+    assert set(by_title(scan(index, songs).songs)) == {'First', 'Second'}
+
+
+def test_many_files_are_probed_in_workers(songs, index: LibraryIndex):
+    for i in range(3 * PROBE_CHUNK):
+        make_wav(songs / 'Album' / f'Song {i}.wav', 0.01)
+    scanner = scan(index, songs)
+    assert len(scanner.songs) == 3 * PROBE_CHUNK + 2
+    assert scanner.updated == 3 * PROBE_CHUNK + 2
+    assert len(index.known(str(songs))) == 3 * PROBE_CHUNK + 2
+
+
+class CrashingScanner(LibraryScanner):
+    '''Scanner whose first pool has workers dying at every task.'''
+
+    pools = 0
+
+    def create_executor(self):
+        executor = super().create_executor()
+        self.pools += 1
+        if self.pools == 1:
+            submit = executor.submit
+            executor.submit = lambda *_: submit(os._exit, 1)
+        return executor
+
+
+def test_scan_survives_dying_worker(songs, index: LibraryIndex):
+    for i in range(6 * PROBE_CHUNK):
+        make_wav(songs / 'Album' / f'Song {i}.wav', 0.01)
+    scanner = scan(index, songs, CrashingScanner)
+    assert scanner.finished == [False]
+    assert len(scanner.songs) < 6 * PROBE_CHUNK + 2
+
+    # Files of broken pool are probed at next scan.
+    scanner = scan(index, songs)
+    assert len(scanner.songs) == 6 * PROBE_CHUNK + 2
+    assert len(index.known(str(songs))) == 6 * PROBE_CHUNK + 2
+
+
+def test_known_songs_are_limited_to_directory(songs, tmp_path, index: LibraryIndex):
+    other = tmp_path / 'songs2'
+    other.mkdir()
+    make_wav(other / 'Other.wav')
+    scan(index, songs)
+    scan(index, other)
+    assert len(index.known(str(songs))) == 2
+    assert list(index.known(str(other))) == [str(other / 'Other.wav')]
+
+
+def test_content_hash_depends_on_content(tmp_path):
+    first = make_wav(tmp_path / 'first.wav', 1)
+    copy = make_wav(tmp_path / 'copy.wav', 1)
+    other = make_wav(tmp_path / 'other.wav', 1, fill=1)
+    size = os.path.getsize(first)
+    assert content_hash(first, size) == content_hash(copy, size)
+    assert content_hash(first, size) != content_hash(other, size)
@@ -0,0 +1,192 @@
+import os
+import json
+import socket
+import asyncio
+import urllib.request
+import urllib.error
+
+import pytest
+
+from netbuzz import (OP_TEXT, BuzzerProtocol, Client, NetworkBuzzerServer, accept_key,
+                     encode_frame, read_frame)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CODES = {0: 'abc', 1: 'def', 2: ''}
+
+
+class FakeClient(Client):
+    '''Client keeping messages sent to it.'''
+
+    def __init__(self) -> None:
+        self.sent: list = []
+        self.closed: bool = False
+        super().__init__('test', self.sent.append, lambda: setattr(self, 'closed', True))
+
+    def kinds(self) -> list:
+        return [message['type'] for message in self.sent]
+
+
+@pytest.fixture
+def protocol():
+    presses: list = []
+    protocol = BuzzerProtocol(CODES, presses.append)
+    protocol.presses = presses
+    return protocol
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # Buzzer page is read relative to main directory of the project.
+    monkeypatch.chdir(ROOT)
+    presses: list = []
+    server = NetworkBuzzerServer(CODES, presses.append, '127.0.0.1', 0, 0)
+    server.presses = presses
+    server.start()
+    assert server.ready.wait(5)
+    yield server
+    server.stop()
+
+
+def test_accept_key_of_rfc_example():
+    assert accept_key('dGhlIHNhbXBsZSBub25jZQ==') == 's3pPLMBiTxaQ9kYGzzhZRbK+xOo='
+
+
+def decode(frame: bytes) -> tuple:
+    async def read() -> tuple:
+        reader = asyncio.StreamReader()
+        reader.feed_data(frame)
+        return await read_frame(reader)
+    return asyncio.run(read())
+
+
+@pytest.mark.parametrize('length', [0, 125, 126, 4000])
+def test_masked_frame_is_read_back(length: int):
+    payload = os.urandom(length)
+    assert decode(encode_frame(payload, mask=True)) == (OP_TEXT, payload)
+
+
+def test_too_long_message_is_rejected():
+    with pytest.raises(ValueError):
+        decode(encode_frame(bytes(5000)))
+
+
+@pytest.mark.parametrize('hello', [
+    {'type': 'hello', 'team': 0, 'code': 'def'},
+    {'type': 'hello', 'team': 0},
+    {'type': 'hello', 'team': 2, 'code': ''},
+    {'type': 'hello', 'team': 7, 'code': 'abc'},
+    {'type': 'hello', 'team': '0', 'code': 'abc'},
+])
+def test_wrong_team_or_code_is_rejected(protocol: BuzzerProtocol, hello: dict):
+    client = FakeClient()
+    assert not protocol.handle(client, hello, 0)
+    assert client.kinds() == ['error']
+    assert client.team is None and not protocol.clients
+
+
+def test_press_before_hello_is_rejected(protocol: BuzzerProtocol):
+    client = FakeClient()
+    assert not protocol.handle(client, {'type': 'press', 'id': 1}, 0)
+    assert protocol.presses == []
+
+
+def test_authenticated_press_is_passed_once_and_acknowledged(protocol: BuzzerProtocol):
+    client = FakeClient()
+    assert protocol.handle(client, {'type': 'hello', 'team': 1, 'code': 'def'}, 0)
+    assert client.kinds() == ['welcome', 'ping']
+    assert protocol.handle(client, {'type': 'press', 'id': 5}, 1000)
+    # Repeated press, e.g. resent over UDP, is only acknowledged.
+    assert protocol.handle(client, {'type': 'press', 'id': 5}, 2000)
+    assert [(press.team, press.timestamp_ns) for press in protocol.presses] == [(1, 1000)]
+    assert client.kinds()[-2:] == ['ack', 'ack']
+
+
+def test_press_is_moved_to_game_clock():
+    client = FakeClient()
+    # Client clock is 5 ms ahead, round trip takes 2 ms.
+    client.measured(10_000_000, 16_000_000, 12_000_000)
+    assert client.press_time(25_000_000, 21_000_000) == 20_000_000
+    # Claimed moment is limited to one round trip before arrival.
+    assert client.press_time(0, 21_000_000) == 19_000_000
+    assert client.press_time(99_000_000, 21_000_000) == 21_000_000
+
+
+async def websocket(port: int) -> tuple:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'GET / HTTP/1.1\r\nHost: test\r\nUpgrade: websocket\r\n'
+                 b'Connection: Upgrade\r\nSec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+                 b'Sec-WebSocket-Version: 13\r\n\r\n')
+    response: bytes = await reader.readuntil(b'\r\n\r\n')
+    assert response.startswith(b'HTTP/1.1 101')
+    assert b's3pPLMBiTxaQ9kYGzzhZRbK+xOo=' in response
+    return reader, writer
+
+
+async def send(writer: asyncio.StreamWriter, message: dict) -> None:
+    writer.write(encode_frame(json.dumps(message).encode(), mask=True))
+    await writer.drain()
+
+
+async def receive(reader: asyncio.StreamReader) -> dict:
+    _, payload = await asyncio.wait_for(read_frame(reader), 5)
+    return json.loads(payload)
+
+
+def test_websocket_buzzer_presses(server: NetworkBuzzerServer):
+    async def buzz() -> list:
+        reader, writer = await websocket(server.port)
+        await send(writer, {'type': 'hello', 'team': 0, 'code': 'abc'})
+        received = [await receive(reader), await receive(reader)]
+        await send(writer, {'type': 'pong', 'id': received[1]['id'], 'client_ns': 1})
+        await send(writer, {'type': 'press', 'id': 1, 'client_ns': 2})
+        received.append(await receive(reader))
+        writer.close()
+        return received
+
+    welcome, ping, ack = asyncio.run(buzz())
+    assert welcome == {'type': 'welcome', 'team': 0}
+    assert ping['type'] == 'ping'
+    assert ack['type'] == 'ack' and ack['rtt_ns'] is not None
+    assert [press.team for press in server.presses] == [0]
+
+
+def test_websocket_with_wrong_code_is_closed(server: NetworkBuzzerServer):
+    async def buzz() -> tuple:
+        reader, writer = await websocket(server.port)
+        await send(writer, {'type': 'hello', 'team': 1, 'code': 'abc'})
+        error = await receive(reader)
+        closed = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        return error, closed
+
+    error, closed = asyncio.run(buzz())
+    assert error['type'] == 'error'
+    assert closed == b''
+    assert server.presses == []
+
+
+def test_udp_buzzer_presses(server: NetworkBuzzerServer):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+        udp.settimeout(5)
+        udp.connect(('127.0.0.1', server.udp_port))
+        udp.send(json.dumps({'type': 'hello', 'team': 1, 'code': 'def'}).encode())
+        assert json.loads(udp.recv(4096))['type'] == 'welcome'
+        udp.send(json.dumps({'type': 'press', 'id': 1}).encode())
+        kinds = [json.loads(udp.recv(4096))['type'] for _ in range(2)]
+    assert 'ack' in kinds
+    assert [press.team for press in server.presses] == [1]
+
+
+def test_browser_gets_buzzer_page(server: NetworkBuzzerServer):
+    with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/', timeout=5) as response:
+        assert response.headers['Content-Type'].startswith('text/html')
+        assert b'WebSocket' in response.read()
+    with pytest.raises(urllib.error.HTTPError):
+        urllib.request.urlopen(f'http://127.0.0.1:{server.port}/missing', timeout=5)
+
+
+def test_page_address_of_server(server: NetworkBuzzerServer):
+    assert server.page_address() == f'http://127.0.0.1:{server.port}/'
+    # Server listening on all interfaces is reached by address in local network.
+    server.host = '0.0.0.0'
+    assert '0.0.0.0' not in server.page_address()
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import wave
+import socket
+
+import pytest
+
+from engine import S_PLAYING
+from remote import encode
+from rooms import RoomServer, load_config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROOMS = '''[Server]
+port = 0
+output_buffer = 512
+instrumentation = 0
+
+[DEFAULT]
+loud_snippets = 0
+number_teams = 3
+
+[Room Main]
+
+[Room Second]
+team_codes = a, b, c
+'''
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    '''Two rooms playing the same directory of silent songs, on dummy audio driver.'''
+    os.symlink(os.path.join(ROOT, 'data'), tmp_path / 'data')
+    (tmp_path / 'rooms.ini').write_text(ROOMS, encoding='UTF-8')
+    os.mkdir(tmp_path / 'songs')
+    for name in ('First.wav', 'Second.wav'):
+        with wave.open(str(tmp_path / 'songs' / name), 'wb') as file:
+            file.setnchannels(1)
+            file.setsampwidth(2)
+            file.setframerate(22050)
+            file.writeframes(bytes(2 * 22050))
+    monkeypatch.chdir(tmp_path)
+    server = RoomServer(load_config('rooms.ini'))
+    server.start()
+    yield server
+    server.stop()
+
+
+def wait_until(condition, timeout: float = 20) -> None:
+    end: float = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, 'Timed out waiting for room.'
+        time.sleep(0.01)
+
+
+class FrontEnd:
+    '''Front end attached to room over control connection.'''
+
+    def __init__(self, port: int, room: str, code: str = '') -> None:
+        self.socket = socket.create_connection(('127.0.0.1', port), timeout=5)
+        self.file = self.socket.makefile('rb')
+        self.send({'type': 'attach', 'room': room, 'code': code})
+
+    def send(self, message: dict) -> None:
+        self.socket.sendall(encode(message))
+
+    def command(self, command: str, **arguments) -> None:
+        self.send({'type': 'command', 'command': command, **arguments})
+
+    def receive(self) -> dict:
+        return json.loads(self.file.readline())
+
+    def event(self, kind: str) -> dict:
+        '''Returns first message with event of given kind.'''
+        while True:
+            message = self.receive()
+            if message.get('event', {}).get('kind') == kind:
+                return message
+
+    def close(self) -> None:
+        self.file.close()
+        self.socket.close()
+
+
+def test_rooms_share_library_but_not_games(server: RoomServer):
+    main, second = server.rooms['Main'], server.rooms['Second']
+    assert main.sink.channel is not second.sink.channel
+    assert second.team_codes == {0: 'a', 1: 'b', 2: 'c'}
+    # Duplicates are found even when songs start at the beginning.
+    assert server.analyser is not None and main.prefetcher.snippet_start is None
+    wait_until(lambda: main.prefetcher.future is not None and second.prefetcher.future is not None)
+
+    front_end = FrontEnd(server.control_server.port, 'Main', server.control_server.code)
+    assert front_end.receive()['state']['room'] == 'Main'
+    front_end.command('next_song')
+    started = front_end.event('song_started')
+    assert started['event']['song']['name'] in ('First', 'Second')
+    assert started['state']['playback_state'] == S_PLAYING
+
+    front_end.command('press', team=1)
+    assert front_end.event('team_guessing')['state']['guessing_team'] == 1
+    front_end.command('answer', correct=True)
+    assert front_end.event('scored')['state']['team_scores'] == [0, 1, 0]
+    front_end.close()
+
+    # Other room plays its own game.
+    assert second.engine.team_scores == [0, 0, 0]
+    assert second.engine.current_song is None
+
+
+def test_front_end_with_wrong_room_or_code_is_refused(server: RoomServer):
+    # Code is generated when none is set.
+    assert len(server.control_server.code) == 8
+    server.control_server.code = 'secret'
+    front_end = FrontEnd(server.control_server.port, 'Main', 'guess')
+    assert front_end.receive() == {'type': 'error', 'message': 'Wrong code.'}
+    front_end.close()
+    front_end = FrontEnd(server.control_server.port, 'Third', 'secret')
+    assert front_end.receive()['message'].startswith('Unknown room')
+    front_end.close()
@@ -0,0 +1,59 @@
+import pytest
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication
+
+from scoreboard import (NAME_HEIGHT, SCORE_HEIGHT, SCORE_ROLE, RankingModel, ScoreboardModel,
+                        ScoreboardView)
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def model() -> ScoreboardModel:
+    model = ScoreboardModel(['One', 'Two', 'Three', 'Four'])
+    model.changes = []
+    model.dataChanged.connect(
+        lambda first, last, roles: model.changes.append((first.row(), last.row(), list(roles))))
+    return model
+
+
+def names(model) -> list:
+    return [model.index(row, 0).data(Qt.DisplayRole) for row in range(model.rowCount())]
+
+
+def test_changed_score_updates_single_row(model: ScoreboardModel):
+    model.set_score(2, 3)
+    assert model.changes == [(2, 2, [SCORE_ROLE])]
+    assert model.index(2).data(SCORE_ROLE) == 3
+    assert model.index(2).data(Qt.DisplayRole) == 'Three'
+
+
+def test_unchanged_scores_emit_nothing(model: ScoreboardModel):
+    model.set_scores([0, 0, 0, 0])
+    assert model.changes == []
+    model.set_scores([0, 1, 0, -1])
+    assert [change[0] for change in model.changes] == [1, 3]
+
+
+def test_ranking_follows_scores(model: ScoreboardModel):
+    ranking = RankingModel(model)
+    # Teams with equal score keep their order.
+    assert names(ranking) == ['One', 'Two', 'Three', 'Four']
+    model.set_scores([1, 0, 2, 1])
+    assert names(ranking) == ['Three', 'One', 'Four', 'Two']
+
+
+def test_view_wraps_teams_into_rows(app, model: ScoreboardModel):
+    view = ScoreboardView()
+    view.resize(722, 100)
+    view.setModel(ScoreboardModel([f'Team {i}' for i in range(8)]))
+    view.show()
+    app.processEvents()
+    assert view.gridSize().height() == NAME_HEIGHT + SCORE_HEIGHT
+    assert view.height() == 2 * (NAME_HEIGHT + SCORE_HEIGHT)
+    view.setModel(model)
+    assert view.height() == NAME_HEIGHT + SCORE_HEIGHT
+    view.close()
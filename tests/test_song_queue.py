@@ -0,0 +1,68 @@
+import pytest
+
+from library import LibraryIndex
+from song_queue import SongQueue
+
+
+@pytest.fixture
+def library(tmp_path):
+    library = LibraryIndex(str(tmp_path / 'library.db'))
+    library.update([
+        {'path': f'/songs/{i}.wav', 'directory': '/songs', 'mtime': 0, 'size': 1, 'title': str(i),
+         'artist': '', 'frequency': 44100, 'duration': 60, 'hash': f'hash{i}'}
+        for i in range(5)
+    ])
+    yield library
+    library.close()
+
+
+def indexed(library: LibraryIndex) -> list:
+    return [{'rowid': rowid, 'hash': f'hash{path[7]}'}
+            for path, rowid in library.rowids(f'/songs/{i}.wav' for i in range(5)).items()]
+
+
+def take_all(queue: SongQueue) -> list:
+    return [queue.take()['title'] for _ in range(len(queue))]
+
+
+def test_every_song_is_taken_once(library: LibraryIndex):
+    queue = SongQueue(library)
+    queue.add(indexed(library))
+    # Songs added again are already known.
+    queue.add(indexed(library))
+    assert len(queue) == 5
+    assert sorted(take_all(queue)) == ['0', '1', '2', '3', '4']
+    assert len(queue) == 0
+
+
+def test_removed_songs_are_skipped(library: LibraryIndex):
+    queue = SongQueue(library)
+    songs = indexed(library)
+    queue.add(songs)
+    queue.remove([songs[0]['rowid'], songs[1]['rowid']])
+    assert len(queue) == 3
+    assert sorted(take_all(queue)) == ['2', '3', '4']
+
+
+def test_songs_of_earlier_sessions_wait_until_others_were_played(library: LibraryIndex):
+    queue = SongQueue(library)
+    queue.add(indexed(library))
+    first = queue.take()
+    queue.mark_played(first)
+
+    queue = SongQueue(library)
+    queue.add(indexed(library))
+    assert len(queue) == 4
+    assert first['title'] not in take_all(queue)
+    # Once the rest was played, queue starts again with all songs.
+    assert queue.take() is not None
+    assert len(queue) == 4
+
+
+def test_songs_deleted_from_index_are_skipped(library: LibraryIndex):
+    queue = SongQueue(library)
+    queue.add(indexed(library))
+    library.remove(f'/songs/{i}.wav' for i in range(4))
+    assert queue.take()['title'] == '4'
+    queue.clear()
+    assert queue.take() is None
@@ -0,0 +1,140 @@
+import threading
+
+import pytest
+from spotipy.client import Spotify
+
+from spotify_worker import LOAD, NEXT, PAUSE, RESUME, SpotifyCatalog, SpotifyWorker, create_session
+from tools.fake_spotify import FakeSpotify
+
+
+@pytest.fixture
+def stub():
+    stub = FakeSpotify(switch_delay=0.3, tracks=5).start()
+    yield stub
+    stub.stop()
+
+
+class Recorder:
+    '''Callbacks of the worker, songs and errors are collected with event set on each.'''
+
+    def __init__(self) -> None:
+        self.tracks: list = []
+        self.errors: list = []
+        self.event = threading.Event()
+
+    def on_track(self, song: dict) -> None:
+        self.tracks.append(song)
+        self.event.set()
+
+    def on_error(self, command: str, error: str) -> None:
+        self.errors.append(command)
+        self.event.set()
+
+
+def create_client(prefix: str) -> Spotify:
+    client = Spotify(auth='token', requests_session=create_session(), retries=0)
+    client.prefix = prefix
+    return client
+
+
+def start_worker(prefix: str, recorder: Recorder, catalog: SpotifyCatalog = None) -> SpotifyWorker:
+    worker = SpotifyWorker(create_client(prefix), recorder.on_track, recorder.on_error, catalog)
+    worker.start()
+    return worker
+
+
+@pytest.mark.parametrize('commands, queued', [
+    ([PAUSE, PAUSE], [PAUSE]),
+    ([PAUSE, RESUME], [RESUME]),
+    ([RESUME, PAUSE, RESUME, PAUSE], [PAUSE]),
+    ([NEXT, NEXT], [NEXT]),
+    ([NEXT, PAUSE, RESUME], [NEXT, RESUME]),
+    ([PAUSE, NEXT, PAUSE], [PAUSE, NEXT, PAUSE]),
+])
+def test_redundant_commands_are_dropped(commands: list, queued: list):
+    worker = SpotifyWorker(None, None, None)
+    for command in commands:
+        worker.send(command)
+    assert worker.commands == queued
+
+
+def test_skip_reports_new_track(stub: FakeSpotify):
+    recorder = Recorder()
+    worker = start_worker(stub.prefix, recorder)
+    worker.send(NEXT)
+    assert recorder.event.wait(5)
+    worker.stop()
+    assert recorder.tracks == [{'id': 'track1', 'uri': 'spotify:track:track1',
+                                'name': 'Song 1', 'artist': 'Artist 1, Guest 1'}]
+    assert ('POST', '/v1/me/player/next') in [request[:2] for request in stub.requests]
+
+
+def test_pause_is_sent_while_waiting_for_track(stub: FakeSpotify):
+    recorder = Recorder()
+    worker = start_worker(stub.prefix, recorder)
+    worker.send(PAUSE)
+    worker.send(NEXT)
+    worker.send(PAUSE)
+    assert recorder.event.wait(5)
+    worker.stop()
+    assert not stub.is_playing
+    pauses = [i for i, request in enumerate(stub.requests) if request[1] == '/v1/me/player/pause']
+    polls = [i for i, request in enumerate(stub.requests)
+             if request[1] == '/v1/me/player/currently-playing']
+    # Second pause didn't wait until the last poll which found new track.
+    assert len(pauses) == 2 and pauses[1] < polls[-1]
+
+
+def test_failed_command_is_reported(stub: FakeSpotify):
+    recorder = Recorder()
+    worker = start_worker(stub.prefix.replace('/v1/', '/missing/'), recorder)
+    worker.send(PAUSE)
+    assert recorder.event.wait(5)
+    worker.stop()
+    assert recorder.errors == [PAUSE]
+
+
+def test_catalog_pages_through_playlist_and_caches_it(tmp_path):
+    stub = FakeSpotify(tracks=250).start()
+    try:
+        catalog = SpotifyCatalog(str(tmp_path / 'tracks.json'))
+        catalog.load(create_client(stub.prefix))
+        assert len(catalog.tracks) == 250
+        assert catalog.songs['track249']['name'] == 'Song 249'
+        assert catalog.context_uri == 'spotify:playlist:fake'
+
+        # Unchanged playlist is loaded from cache without paging.
+        stub.requests.clear()
+        cached = SpotifyCatalog(str(tmp_path / 'tracks.json'))
+        cached.load(create_client(stub.prefix))
+        assert cached.tracks == catalog.tracks
+        assert [request[1] for request in stub.requests] == ['/v1/me/player', '/v1/playlists/fake']
+    finally:
+        stub.stop()
+
+
+def test_catalog_plays_every_track_once_per_pass(tmp_path, stub: FakeSpotify):
+    catalog = SpotifyCatalog(str(tmp_path / 'tracks.json'))
+    catalog.load(create_client(stub.prefix))
+    first = [catalog.pop()['id'] for _ in range(5)]
+    second = [catalog.pop()['id'] for _ in range(5)]
+    assert sorted(first) == sorted(second) == [f'track{i}' for i in range(5)]
+
+
+def test_broken_cache_is_ignored(tmp_path):
+    (tmp_path / 'tracks.json').write_text('{"songs":', encoding='UTF-8')
+    catalog = SpotifyCatalog(str(tmp_path / 'tracks.json'))
+    assert catalog.songs == {} and catalog.pop() is None
+
+
+def test_round_starts_track_of_catalog_without_polling(tmp_path, stub: FakeSpotify):
+    recorder = Recorder()
+    worker = start_worker(stub.prefix, recorder, SpotifyCatalog(str(tmp_path / 'tracks.json')))
+    worker.send(LOAD)
+    worker.send(NEXT)
+    assert recorder.event.wait(5)
+    worker.stop()
+    song = recorder.tracks[0]
+    assert stub.tracks[stub.index]['id'] == song['id']
+    assert stub.is_playing
+    assert ('POST', '/v1/me/player/next') not in [request[:2] for request in stub.requests]
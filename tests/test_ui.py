@@ -0,0 +1,83 @@
+import os
+import time
+import wave
+
+import pytest
+
+from PyQt5.QtCore import QEvent, Qt
+from PyQt5.QtGui import QKeyEvent
+from PyQt5.QtWidgets import QApplication
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+CONFIG = '''[Settings]
+songs_directory = songs
+use_spotify = 0
+instrumentation = 0
+
+[Rules]
+playback_time = 5
+'''
+
+
+@pytest.fixture
+def window(tmp_path, monkeypatch):
+    '''Window started in empty directory with two silent local songs.'''
+    os.symlink(DATA, tmp_path / 'data')
+    (tmp_path / 'config.ini').write_text(CONFIG, encoding='UTF-8')
+    os.mkdir(tmp_path / 'songs')
+    for name in ('First.wav', 'Second.wav'):
+        with wave.open(str(tmp_path / 'songs' / name), 'wb') as file:
+            file.setnchannels(1)
+            file.setsampwidth(2)
+            file.setframerate(44100)
+            file.writeframes(bytes(2 * 44100 * 2))
+    monkeypatch.chdir(tmp_path)
+
+    import main
+    app = QApplication.instance() or QApplication([])
+    window = main.Ui()
+    window.app = app
+    yield window
+    window.close()
+    # Settings are saved on close.
+    assert 'songs_directory = songs' in (tmp_path / 'config.ini').read_text(encoding='UTF-8')
+
+
+def wait_until(window, condition, timeout: float = 20) -> None:
+    end: float = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, 'Timed out waiting for window.'
+        window.app.processEvents()
+        time.sleep(0.005)
+
+
+def test_song_is_played_guessed_and_scored(window):
+    # Song is prepared once audio is opened and songs are scanned.
+    wait_until(window, lambda: window.prefetcher and window.prefetcher.future is not None)
+    window.button_next.click()
+    assert window.engine.current_song['title'] in ('First', 'Second')
+
+    window.keyPressEvent(QKeyEvent(QEvent.KeyPress, Qt.Key_2, Qt.NoModifier))
+    wait_until(window, lambda: window.engine.is_team_guessing)
+    assert window.engine.guessing_team == 1
+    assert window.button_yes.isEnabled()
+
+    window.button_yes.click()
+    assert window.engine.team_scores[:3] == [0, 1, 0]
+    assert window.button_next.isEnabled()
+
+
+def test_settings_show_codes_of_network_buzzers(window):
+    from main import SettingsDialog
+    window.config['Network']['host'] = '127.0.0.1'
+    window.config['Network']['port'] = '0'
+    window.config['Network']['udp_port'] = '0'
+    window.start_network_server()
+    assert window.network_server.ready.wait(5)
+    dialog = SettingsDialog(window)
+    text: str = dialog.label_network.text()
+    assert f'http://127.0.0.1:{window.network_server.port}/' in text
+    for i in range(window.number_teams):
+        assert window.config['Team Codes'][f'team_{i + 1}'] in text
+    dialog.close()
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import queue
+
+import pytest
+
+import watcher
+from watcher import LibraryWatcher
+
+inotify = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is available only on Linux')
+
+
+@pytest.fixture
+def watch(tmp_path):
+    '''Starts watcher of tmp_path, reported lists of paths are put into returned queue.'''
+    watchers = []
+
+    def start(poll: bool = False) -> queue.Queue:
+        reports = queue.Queue()
+        library_watcher = LibraryWatcher(str(tmp_path), reports.put, poll)
+        library_watcher.start()
+        watchers.append(library_watcher)
+        # Watch is set up by the thread, so changes right after start could be missed.
+        time.sleep(0.1)
+        return reports
+
+    yield start
+    for library_watcher in watchers:
+        library_watcher.stop()
+
+
+def write(path, data: bytes = b'data') -> None:
+    with open(path, 'wb') as file:
+        file.write(data)
+
+
+@inotify
+def test_burst_of_changes_is_reported_at_once(tmp_path, watch):
+    (tmp_path / 'Album').mkdir()
+    reports = watch()
+    for i in range(5):
+        write(tmp_path / 'Album' / f'{i}.mp3')
+        time.sleep(watcher.DEBOUNCE / 4)
+    assert reports.get(timeout=5) == [str(tmp_path / 'Album' / f'{i}.mp3') for i in range(5)]
+    assert reports.empty()
+
+
+@inotify
+def test_new_directory_is_watched(tmp_path, watch):
+    reports = watch()
+    (tmp_path / 'Album').mkdir()
+    # Directory itself is reported, files copied before it was watched are found by scanning it.
+    assert reports.get(timeout=5) == [str(tmp_path / 'Album')]
+    write(tmp_path / 'Album' / 'song.mp3')
+    assert reports.get(timeout=5) == [str(tmp_path / 'Album' / 'song.mp3')]
+
+
+def test_polling_reports_changes_once_they_settle(tmp_path, watch, monkeypatch):
+    monkeypatch.setattr(watcher, 'POLL_INTERVAL', 0.1)
+    write(tmp_path / 'old.mp3')
+    reports = watch(poll=True)
+    write(tmp_path / 'new.mp3')
+    os.remove(tmp_path / 'old.mp3')
+    assert reports.get(timeout=5) == [str(tmp_path / 'new.mp3'), str(tmp_path / 'old.mp3')]
+    time.sleep(0.3)
+    assert reports.empty()
+
+
+def test_watcher_stopped_before_start_closes_pipe(tmp_path):
+    library_watcher = LibraryWatcher(str(tmp_path), print)
+    library_watcher.stop()
+    with pytest.raises(OSError):
+        os.fstat(library_watcher.wake_read)
+
+
+def test_watcher_that_finished_polling_is_stopped(tmp_path, monkeypatch):
+    monkeypatch.setattr(watcher, 'POLL_INTERVAL', 0.01)
+    library_watcher = LibraryWatcher(str(tmp_path), print, poll=True)
+    library_watcher.start()
+    # Thread ends at next poll and closes its pipe, which stop must not write to.
+    library_watcher.stopped = True
+    library_watcher.join(1)
+    library_watcher.stop()
+    assert library_watcher.closed
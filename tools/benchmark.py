@@ -0,0 +1,335 @@
+'''Measures end-to-end latencies of the game and compares them with stored baseline.
+
+Run from the main directory of the project:
+
+    python -m tools.benchmark --rounds 200
+    python -m tools.benchmark --save-baseline
+
+Presses come from fake Arduino on pseudo-terminal, Spotify is replaced with
+local stand-in, audio uses dummy SDL driver and window is drawn offscreen,
+so it runs on any Linux machine. Exits with status 1 if any latency regressed.
+'''
+import os
+import re
+import sys
+import json
+import time
+import wave
+import random
+import shutil
+import tempfile
+import selectors
+import subprocess
+
+import argparse
+
+# Must be set before Qt and pygame are imported.
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import numpy as np
+from PyQt5.QtCore import QEventLoop, QTimer, Qt
+from PyQt5.QtWidgets import QApplication
+
+from engine import PAUSED, SONG_STARTED, TEAM_GUESSING, GameEvent
+from tools.fake_arduino import FakeArduino
+from tools.fake_spotify import FakeSpotify
+
+PROJECT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(PROJECT, 'tools', 'benchmark_baseline.json')
+# Percentiles compared with baseline, p99 of few hundred samples is mostly noise.
+GATED = ('p50', 'p90')
+# Latency may exceed baseline by this many spreads between its p50 and p90.
+SPREAD_SLACK = 2
+
+# Seconds of each generated song.
+SONG_SECONDS = 3
+# Seconds to wait for single step of a round.
+STEP_TIMEOUT = 2
+SCOPE = 'user-read-playback-state user-modify-playback-state user-read-currently-playing app-remote-control'
+
+
+def percentile(samples: list, fraction: float) -> float:
+    '''Returns nearest-rank percentile of samples.'''
+    ordered: list = sorted(samples)
+    return ordered[max(0, int(np.ceil(fraction * len(ordered))) - 1)]
+
+
+def wait_until(condition, timeout: float = STEP_TIMEOUT) -> bool:
+    '''Runs Qt event loop until condition is true, returns whether it became true.'''
+    if condition():
+        return True
+    loop: QEventLoop = QEventLoop()
+    poll: QTimer = QTimer()
+    poll.setTimerType(Qt.PreciseTimer)
+    poll.timeout.connect(lambda: condition() and loop.quit())
+    poll.start(1)
+    QTimer.singleShot(int(timeout * 1000), loop.quit)
+    loop.exec_()
+    poll.stop()
+    return condition()
+
+
+def write_songs(directory: str, count: int) -> None:
+    '''Generates short WAV files with different tones.'''
+    os.makedirs(directory, exist_ok=True)
+    rate: int = 44100
+    times: np.ndarray = np.arange(SONG_SECONDS * rate) / rate
+    for i in range(count):
+        tone: np.ndarray = np.sin(2 * np.pi * (220 + 10 * i) * times) * 0.3
+        samples: np.ndarray = (np.repeat(tone[:, np.newaxis], 2, axis=1) * 32767).astype(np.int16)
+        with wave.open(os.path.join(directory, f'song{i:03d}.wav'), 'wb') as file:
+            file.setnchannels(2)
+            file.setsampwidth(2)
+            file.setframerate(rate)
+            file.writeframes(samples.tobytes())
+
+
+def prepare_directory(settings: dict, rules: dict = None) -> str:
+    '''Creates working directory with config file and link to data of the project.'''
+    directory: str = tempfile.mkdtemp(prefix='melodia-benchmark-')
+    os.symlink(os.path.join(PROJECT, 'data'), os.path.join(directory, 'data'))
+    os.mkdir(os.path.join(directory, 'cache'))
+    lines: list = ['[Settings]']
+    lines += [f'{key} = {value}' for key, value in settings.items()]
+    lines += ['', '[Rules]']
+    lines += [f'{key} = {value}' for key, value in (rules or {'playback_time': 30}).items()]
+    lines += ['']
+    with open(os.path.join(directory, 'config.ini'), 'w', encoding='UTF-8') as file:
+        file.write('\n'.join(lines))
+    return directory
+
+
+class Recorder:
+    '''Records moments of game events, subscribed after the window handled them.'''
+
+    def __init__(self) -> None:
+        self.times: dict = {}
+
+    def __call__(self, event: GameEvent) -> None:
+        self.times[event.kind] = time.monotonic_ns()
+
+    def since(self, kind: str, start_ns: int) -> float:
+        '''Returns milliseconds from start to event, None if it didn't happen after start.'''
+        moment: int = self.times.get(kind)
+        if moment is None or moment < start_ns:
+            return None
+        return (moment - start_ns) / 1_000_000
+
+
+class Benchmark:
+    '''Plays scripted rounds and collects latency samples by name.'''
+
+    def __init__(self, rounds: int, seed: int) -> None:
+        self.rounds: int = rounds
+        self.random: random.Random = random.Random(seed)
+        self.samples: dict = {}
+        self.app: QApplication = QApplication.instance() or QApplication(sys.argv)
+
+    def add(self, name: str, value: float) -> None:
+        if value is None:
+            print(f'  {name}: timed out', flush=True)
+        else:
+            self.samples.setdefault(name, []).append(value)
+
+    def burst(self) -> list:
+        '''Returns distinct teams pressing at once, usually just one.'''
+        size: int = self.random.choice((1, 1, 1, 2, 3))
+        return self.random.sample(range(6), size)
+
+    def open_window(self, directory: str):
+        import main
+        os.chdir(directory)
+        window = main.Ui()
+        recorder: Recorder = Recorder()
+        window.engine.subscribe(recorder)
+        return window, recorder
+
+    def connect_arduino(self, window) -> FakeArduino:
+        arduino: FakeArduino = FakeArduino()
+        window.serial_ports = [arduino.port]
+        window.open_serial_ports()
+        return arduino
+
+    def cold_start(self, runs: int) -> None:
+        '''Starts the game in new process and reads when window was shown.'''
+        directory: str = prepare_directory({'use_spotify': 0, 'songs_directory': 'songs'})
+        for _ in range(runs):
+            process = subprocess.Popen(
+                [sys.executable, os.path.join(PROJECT, 'main.py'), '--profile-startup'],
+                cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            selector = selectors.DefaultSelector()
+            selector.register(process.stdout, selectors.EVENT_READ)
+            deadline: float = time.monotonic() + 10 * STEP_TIMEOUT
+            output: str = ''
+            match = None
+            # Report is printed once background initialisation ended.
+            while match is None and time.monotonic() < deadline:
+                if not selector.select(deadline - time.monotonic()):
+                    break
+                data: bytes = os.read(process.stdout.fileno(), 4096)
+                if not data:
+                    break
+                output += data.decode()
+                match = re.search(r'window shown\s+[\d.]+ ms\s+([\d.]+) ms', output)
+            process.kill()
+            process.wait()
+            process.stdout.close()
+            selector.close()
+            self.add('cold start to window shown', float(match.group(1)) if match else None)
+        shutil.rmtree(directory)
+
+    def local(self) -> None:
+        '''Plays rounds with songs from local directory.'''
+        directory: str = prepare_directory({'use_spotify': 0, 'songs_directory': 'songs'})
+        write_songs(os.path.join(directory, 'songs'), self.rounds + 2)
+        window, recorder = self.open_window(directory)
+        if not wait_until(lambda: window.prefetcher is not None and window.song_queue is not None
+                          and len(window.song_queue) >= self.rounds, 10 * STEP_TIMEOUT):
+            raise RuntimeError('Songs were not loaded.')
+        arduino: FakeArduino = self.connect_arduino(window)
+        try:
+            for _ in range(self.rounds):
+                # Next song is prepared while previous round is scored.
+                wait_until(lambda: window.prefetcher.future is None
+                           or window.prefetcher.future.done())
+                window.next_playback()
+                self.add('next to first audio', window.start_latency_ms)
+                wait_until(lambda: False, 0.05)
+
+                pressed_ns: int = time.monotonic_ns()
+                window.silencer.latency_ms = None
+                arduino.press(*self.burst())
+                wait_until(lambda: recorder.since(TEAM_GUESSING, pressed_ns) is not None)
+                self.add('buzzer to silence', window.silencer.latency_ms)
+                self.add('buzzer to audio pause', recorder.since(PAUSED, pressed_ns))
+                self.add('buzzer to team label', recorder.since(TEAM_GUESSING, pressed_ns))
+                window.answer_correct()
+        finally:
+            window.close()
+            arduino.close()
+            os.chdir(PROJECT)
+            shutil.rmtree(directory)
+
+    def spotify(self, latency: float) -> None:
+        '''Plays rounds on local stand-in of Spotify Web API.'''
+        stub: FakeSpotify = FakeSpotify(latency=latency, tracks=max(50, self.rounds)).start()
+        directory: str = prepare_directory({
+            'use_spotify': 1,
+            'spotify_client_id': 'benchmark',
+            'spotify_client_secret': 'benchmark',
+            'spotify_redirect_uri': 'http://127.0.0.1/callback',
+            'spotify_api_url': stub.prefix,
+        })
+        # Valid token, so login dialog is not shown.
+        with open(os.path.join(directory, 'cache', '.spotify_cache'), 'w') as file:
+            json.dump({'access_token': 'benchmark', 'token_type': 'Bearer', 'expires_in': 3600,
+                       'scope': SCOPE, 'expires_at': int(time.time()) + 3600,
+                       'refresh_token': 'benchmark'}, file)
+        window, recorder = self.open_window(directory)
+        if not wait_until(lambda: window.spotify_worker is not None
+                          and window.spotify_worker.catalog.tracks, 10 * STEP_TIMEOUT):
+            raise RuntimeError('Spotify tracks were not loaded.')
+        arduino: FakeArduino = self.connect_arduino(window)
+
+        def paused_after(start_ns: int) -> float:
+            for method, path, moment in reversed(stub.requests):
+                if moment < start_ns:
+                    return None
+                if method == 'PUT' and path == '/v1/me/player/pause':
+                    return (moment - start_ns) / 1_000_000
+            return None
+
+        try:
+            for _ in range(self.rounds):
+                clicked_ns: int = time.monotonic_ns()
+                window.next_playback()
+                wait_until(lambda: recorder.since(SONG_STARTED, clicked_ns) is not None)
+                self.add('spotify next to track started', recorder.since(SONG_STARTED, clicked_ns))
+                wait_until(lambda: False, 0.05)
+
+                pressed_ns: int = time.monotonic_ns()
+                window.silencer.latency_ms = None
+                arduino.press(*self.burst())
+                wait_until(lambda: paused_after(pressed_ns) is not None
+                           and window.silencer.latency_ms is not None)
+                self.add('spotify buzzer to pause request', paused_after(pressed_ns))
+                self.add('spotify buzzer to silence', window.silencer.latency_ms)
+                window.answer_correct()
+                # Letting worker send pause after the answer.
+                wait_until(lambda: False, 2 * latency + 0.02)
+        finally:
+            window.close()
+            arduino.close()
+            os.chdir(PROJECT)
+            shutil.rmtree(directory)
+            stub.stop()
+
+    def results(self) -> dict:
+        return {
+            name: {
+                'samples': len(values),
+                'p50': round(percentile(values, 0.5), 3),
+                'p90': round(percentile(values, 0.9), 3),
+                'p99': round(percentile(values, 0.99), 3),
+            }
+            for name, values in self.samples.items()
+        }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, slack: float) -> bool:
+    '''Prints results next to baseline, returns whether any latency regressed.'''
+    regressed: bool = False
+    print(f'{"latency":<36}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"base p90":>10}')
+    for name, result in results.items():
+        base: dict = baseline.get(name)
+        status: str = ''
+        if base and all(key in base for key in GATED):
+            # Slack keeps noise of very short latencies and of scattered ones from failing.
+            allowed: float = max(slack, SPREAD_SLACK * (base['p90'] - base['p50']))
+            worse: list = [key for key in GATED if result[key] > base[key] * tolerance + allowed]
+            if worse:
+                regressed = True
+                status = 'REGRESSED ' + ', '.join(worse)
+        print(f'{name:<36}{result["p50"]:>10.1f}{result["p90"]:>10.1f}{result["p99"]:>10.1f}'
+              f'{base["p90"] if base and "p90" in base else float("nan"):>10.1f}  {status}', flush=True)
+    return regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--cold-starts', type=int, default=5)
+    parser.add_argument('--spotify-latency', type=float, default=0.02,
+                        help='seconds added to every response of Web API stand-in')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='allowed ratio of p50 and p90 to baseline')
+    parser.add_argument('--slack', type=float, default=5,
+                        help='least milliseconds allowed above tolerance, more for scattered latencies')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    benchmark: Benchmark = Benchmark(args.rounds, args.seed)
+    benchmark.cold_start(args.cold_starts)
+    benchmark.local()
+    benchmark.spotify(args.spotify_latency)
+    results: dict = benchmark.results()
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='UTF-8') as file:
+            json.dump(results, file, indent=4)
+            file.write('\n')
+        print(f'Saved baseline to {args.baseline}.')
+
+    baseline: dict = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='UTF-8') as file:
+            baseline = json.load(file)
+    if compare(results, baseline, args.tolerance, args.slack):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
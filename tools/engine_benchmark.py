@@ -0,0 +1,75 @@
+'''Drives game engine without display and reports how many events it handles.
+
+Run from the main directory of the project:
+
+    python -m tools.engine_benchmark --seconds 5
+'''
+import time
+import random
+
+import argparse
+
+from buzzers import BuzzerPress
+from engine import S_PAUSED, S_PLAYING, GameEngine, GameEvent, VirtualClock
+
+
+def play_round(engine: GameEngine, clock: VirtualClock, rng: random.Random) -> int:
+    '''Plays one song with presses and answers, returns number of engine calls.'''
+    calls: int = 1
+    engine.next_song()
+    while engine.current_song is not None and engine.playback_state == S_PLAYING:
+        clock.now += rng.randrange(100_000_000)
+        for _ in range(rng.randrange(1, 4)):
+            team: int = rng.randrange(engine.number_teams)
+            engine.press(BuzzerPress(team, clock.now + rng.randrange(5_000), 'benchmark'))
+            calls += 1
+        clock.now += 10_000_000
+        calls += 2
+        if engine.resolve(clock.now) is None:
+            # Every team is locked out, song ends without answer.
+            engine.stop()
+            break
+        engine.answer(rng.random() < 0.3)
+        calls += 1
+        if engine.playback_state == S_PAUSED:
+            engine.resume()
+            calls += 1
+        calls += 1
+        if engine.check_time():
+            break
+    return calls
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--teams', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng: random.Random = random.Random(args.seed)
+    clock: VirtualClock = VirtualClock()
+    song: dict = {'name': 'Song', 'artist': 'Artist'}
+    engine: GameEngine = GameEngine(
+        args.teams, 30, tie_window_us=2000, song_source=lambda: song, time_ns=clock)
+    events: list = [0]
+
+    def count(event: GameEvent) -> None:
+        events[0] += 1
+    engine.subscribe(count)
+
+    calls: int = 0
+    rounds: int = 0
+    started: float = time.perf_counter()
+    while time.perf_counter() - started < args.seconds:
+        calls += play_round(engine, clock, rng)
+        rounds += 1
+    elapsed: float = time.perf_counter() - started
+
+    print(f'{rounds} rounds, {calls} calls, {events[0]} events in {elapsed:.1f} s')
+    print(f'{calls / elapsed * 60:,.0f} calls per minute, '
+          f'{events[0] / elapsed * 60:,.0f} events per minute')
+
+
+if __name__ == '__main__':
+    main()
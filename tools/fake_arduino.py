@@ -0,0 +1,86 @@
+'''Pseudo-terminal pretending to be buzzer Arduino.
+
+Run from the main directory of the project:
+
+    python -m tools.fake_arduino --presses 1,3,2 --interval 0.5
+    python -m tools.fake_arduino --presses 1,3,2 --board 2
+
+Printed device path can be selected as serial port in settings, several
+boards are selected as comma separated ports. Teams are numbered from 0,
+like bytes sent by Arduino. Board with id sends numbered frames.
+'''
+import os
+import pty
+import sys
+import time
+import tty
+
+import argparse
+
+from buzzers import SEQUENCE_MODULUS
+
+
+class FakeArduino:
+    '''Sends scripted presses through pseudo-terminal.'''
+
+    def __init__(self, board: int = None) -> None:
+        self.master, self.slave = pty.openpty()
+        # Raw mode, so bytes are passed without line buffering or echo.
+        tty.setraw(self.slave)
+        self.port: str = os.ttyname(self.slave)
+        self.board: int = board  # Without id presses are sent as single digits.
+        self.sequence: int = 0
+
+    def frame(self, team: int) -> bytes:
+        '''Returns next numbered frame of the board.'''
+        self.sequence = (self.sequence + 1) % SEQUENCE_MODULUS
+        return f'#{self.board},{self.sequence},{team}\n'.encode()
+
+    def press(self, *teams: int) -> None:
+        '''Sends presses of given teams in one write, as if they were simultaneous.'''
+        if self.board is None:
+            os.write(self.master, bytes(0x30 + team for team in teams))
+        else:
+            os.write(self.master, b''.join(self.frame(team) for team in teams))
+
+    def burst(self, teams: list, interval: float = 0) -> None:
+        '''Sends presses one by one with given interval in seconds.'''
+        for team in teams:
+            self.press(team)
+            if interval:
+                time.sleep(interval)
+
+    def close(self) -> None:
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--presses', default='',
+                        help='comma separated teams to press, empty to wait for input')
+    parser.add_argument('--interval', type=float, default=0.5,
+                        help='seconds between scripted presses')
+    parser.add_argument('--delay', type=float, default=5,
+                        help='seconds to wait before sending scripted presses')
+    parser.add_argument('--board', type=int, help='id of the board, sends numbered frames')
+    args = parser.parse_args()
+
+    arduino = FakeArduino(args.board)
+    print(arduino.port, flush=True)
+    try:
+        if args.presses:
+            time.sleep(args.delay)
+            arduino.burst([int(team) for team in args.presses.split(',')], args.interval)
+        else:
+            # Every line typed in is sent as simultaneous presses, e.g. '13'.
+            for line in sys.stdin:
+                arduino.press(*(int(c) for c in line.strip() if c.isdigit()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        arduino.close()
+
+
+if __name__ == '__main__':
+    main()
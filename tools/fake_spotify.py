@@ -0,0 +1,166 @@
+'''Local stand-in for the part of Spotify Web API used by the game.
+
+Run from the main directory of the project:
+
+    python -m tools.fake_spotify --port 8765 --latency 0.05
+
+Client is pointed at it by setting prefix of spotipy client to printed URL.
+'''
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import argparse
+
+
+def make_tracks(count: int) -> list:
+    return [
+        {
+            'id': f'track{i}',
+            'uri': f'spotify:track:track{i}',
+            'name': f'Song {i}',
+            'artists': [{'name': f'Artist {i}'}, {'name': f'Guest {i % 7}'}],
+            'duration_ms': 180_000,
+        }
+        for i in range(count)
+    ]
+
+
+class FakeSpotify:
+    '''Web API stub with single player and one playlist.'''
+
+    def __init__(self, port: int = 0, latency: float = 0, switch_delay: float = 0.1,
+                 tracks: int = 50) -> None:
+        self.latency: float = latency  # Seconds added to every response.
+        self.switch_delay: float = switch_delay  # Seconds before skip takes effect.
+        self.tracks: list = make_tracks(tracks)
+        self.index: int = 0
+        self.is_playing: bool = False
+        self.switch_at: float = None  # Moment when pending skip takes effect.
+        self.requests: list = []  # Method, path and arrival time of every request.
+        self.lock: threading.Lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                stub.handle(self, 'GET')
+
+            def do_PUT(self) -> None:
+                stub.handle(self, 'PUT')
+
+            def do_POST(self) -> None:
+                stub.handle(self, 'POST')
+
+        self.server: ThreadingHTTPServer = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.thread: threading.Thread = threading.Thread(
+            target=self.server.serve_forever, name='FakeSpotify', daemon=True)
+
+    @property
+    def prefix(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}/v1/'
+
+    def start(self) -> 'FakeSpotify':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def current(self) -> dict:
+        if self.switch_at is not None and time.monotonic() >= self.switch_at:
+            self.index = (self.index + 1) % len(self.tracks)
+            self.switch_at = None
+        return self.tracks[self.index]
+
+    def page(self, offset: int, limit: int) -> dict:
+        '''Returns page of playlist tracks.'''
+        items: list = [{'track': track} for track in self.tracks[offset:offset + limit]]
+        following: int = offset + limit
+        return {
+            'items': items,
+            'next': f'{self.prefix}playlists/fake/tracks?offset={following}&limit={limit}'
+            if following < len(self.tracks) else None,
+        }
+
+    def route(self, method: str, path: str, query: dict, body: dict) -> tuple:
+        '''Returns status and JSON response for request.'''
+        with self.lock:
+            self.requests.append((method, path, time.monotonic_ns()))
+            if path == '/v1/playlists/fake' and method == 'GET':
+                return 200, {'snapshot_id': f'snapshot{len(self.tracks)}'}
+            # Newer spotipy releases use items endpoint.
+            if path in ('/v1/playlists/fake/tracks', '/v1/playlists/fake/items') and method == 'GET':
+                return 200, self.page(int(query.get('offset', ['0'])[0]),
+                                      int(query.get('limit', ['100'])[0]))
+            if path == '/v1/tracks' and method == 'GET':
+                ids: list = query['ids'][0].split(',')
+                known: dict = {track['id']: track for track in self.tracks}
+                return 200, {'tracks': [known.get(i) for i in ids]}
+            if path in ('/v1/me/player/currently-playing', '/v1/me/player') and method == 'GET':
+                return 200, {
+                    'is_playing': self.is_playing,
+                    'progress_ms': 0,
+                    'item': self.current(),
+                    'context': {'type': 'playlist', 'uri': 'spotify:playlist:fake'},
+                }
+            if path == '/v1/me/player/pause' and method == 'PUT':
+                self.is_playing = False
+                return 204, None
+            if path == '/v1/me/player/play' and method == 'PUT':
+                if body and 'offset' in body:
+                    uris: list = [track['uri'] for track in self.tracks]
+                    self.index = uris.index(body['offset']['uri'])
+                    self.switch_at = None
+                self.is_playing = True
+                return 204, None
+            if path == '/v1/me/player/next' and method == 'POST':
+                self.current()
+                self.switch_at = time.monotonic() + self.switch_delay
+                self.is_playing = True
+                return 204, None
+        return 404, {'error': {'status': 404, 'message': 'Not found'}}
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str) -> None:
+        length: int = int(request.headers.get('Content-Length') or 0)
+        raw: bytes = request.rfile.read(length) if length else b''
+        body: dict = json.loads(raw) if raw else None
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(request.path)
+        status, response = self.route(method, url.path, parse_qs(url.query), body)
+        data: bytes = json.dumps(response).encode() if response is not None else b''
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to every response')
+    parser.add_argument('--tracks', type=int, default=50)
+    args = parser.parse_args()
+
+    stub = FakeSpotify(args.port, args.latency, tracks=args.tracks).start()
+    print(stub.prefix, flush=True)
+    try:
+        stub.thread.join()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
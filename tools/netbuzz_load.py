@@ -0,0 +1,218 @@
+'''Connects many simulated phone buzzers to the buzzer server.
+
+Run from the main directory of the project, against running game:
+
+    python -m tools.netbuzz_load --clients 300 --duration 10
+
+or against server started by the tool itself:
+
+    python -m tools.netbuzz_load --serve --clients 300 --udp
+
+Every client has its clock shifted by random skew, so accuracy of measured
+clock offsets is reported together with press acknowledgement latency.
+'''
+import os
+import json
+import time
+import base64
+import random
+import asyncio
+import threading
+import configparser
+
+import argparse
+
+import numpy as np
+
+from buzzers import BuzzerPress
+from netbuzz import OP_CLOSE, OP_TEXT, NetworkBuzzerServer, accept_key, encode_frame, read_frame
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.connected: int = 0
+        self.rejected: int = 0
+        self.acks: list = []  # Milliseconds from press to acknowledgement.
+        self.offset_errors: list = []  # Milliseconds between measured and real skew.
+
+
+class SimulatedBuzzer:
+    '''Single client pressing at random moments.'''
+
+    def __init__(self, team: int, code: str, skew_ns: int, rate: float, stats: Stats) -> None:
+        self.team: int = team
+        self.code: str = code
+        self.skew_ns: int = skew_ns  # Difference between clock of client and server.
+        self.rate: float = rate  # Presses per second.
+        self.stats: Stats = stats
+        self.sent: dict = {}  # Moment of each unacknowledged press by id.
+        self.presses: int = 0
+
+    def clock(self) -> int:
+        return time.monotonic_ns() + self.skew_ns
+
+    def message(self, kind: str, **fields) -> dict:
+        return dict(type=kind, **fields)
+
+    def received(self, message: dict, send) -> bool:
+        '''Handles message from server, returns whether client stays connected.'''
+        kind: str = message.get('type')
+        if kind == 'welcome':
+            self.stats.connected += 1
+        elif kind == 'error':
+            self.stats.rejected += 1
+            return False
+        elif kind == 'ping':
+            send(self.message('pong', id=message['id'], client_ns=self.clock()))
+        elif kind == 'ack' and message.get('id') in self.sent:
+            self.stats.acks.append((time.monotonic_ns() - self.sent.pop(message['id'])) / 1e6)
+            if message.get('offset_ns') is not None:
+                self.stats.offset_errors.append(abs(message['offset_ns'] - self.skew_ns) / 1e6)
+        return True
+
+    def press(self, send) -> None:
+        self.presses += 1
+        self.sent[self.presses] = time.monotonic_ns()
+        send(self.message('press', id=self.presses, client_ns=self.clock()))
+
+    def hello(self) -> dict:
+        return self.message('hello', team=self.team, code=self.code)
+
+    async def run_websocket(self, host: str, port: int, duration: float) -> None:
+        reader, writer = await asyncio.open_connection(host, port)
+        key: str = base64.b64encode(os.urandom(16)).decode()
+        writer.write((f'GET / HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\n'
+                      f'Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n'
+                      'Sec-WebSocket-Version: 13\r\n\r\n').encode())
+        response: bytes = await reader.readuntil(b'\r\n\r\n')
+        if accept_key(key).encode() not in response:
+            raise ConnectionError('Handshake failed.')
+
+        def send(message: dict) -> None:
+            writer.write(encode_frame(json.dumps(message).encode(), mask=True))
+
+        async def receive() -> None:
+            while True:
+                opcode, payload = await read_frame(reader)
+                if opcode == OP_CLOSE:
+                    return
+                if opcode == OP_TEXT and not self.received(json.loads(payload), send):
+                    return
+
+        send(self.hello())
+        await self.press_until(send, receive(), duration)
+        writer.close()
+
+    async def run_udp(self, host: str, port: int, duration: float) -> None:
+        loop = asyncio.get_running_loop()
+        buzzer = self
+        done: asyncio.Future = loop.create_future()
+
+        class Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data: bytes, address: tuple) -> None:
+                if not buzzer.received(json.loads(data), send) and not done.done():
+                    done.set_result(None)
+
+        transport, _ = await loop.create_datagram_endpoint(Protocol, remote_addr=(host, port))
+
+        def send(message: dict) -> None:
+            transport.sendto(json.dumps(message).encode())
+
+        send(self.hello())
+        await self.press_until(send, done, duration)
+        transport.close()
+
+    async def press_until(self, send, receiving, duration: float) -> None:
+        receiver: asyncio.Future = asyncio.ensure_future(receiving)
+        # Waiting for first clock measurements.
+        await asyncio.sleep(0.5)
+        end: float = time.monotonic() + duration
+        while time.monotonic() < end and not receiver.done():
+            await asyncio.sleep(min(random.expovariate(self.rate), end - time.monotonic()))
+            if time.monotonic() < end:
+                self.press(send)
+        await asyncio.sleep(0.2)
+        receiver.cancel()
+
+
+def read_codes(path: str) -> dict:
+    config = configparser.ConfigParser()
+    config.read(path, encoding='UTF-8')
+    if not config.has_section('Team Codes'):
+        return {}
+    return {i: code for i, code in enumerate(config['Team Codes'].values()) if code}
+
+
+async def run_clients(args, codes: dict, stats: Stats) -> None:
+    teams: list = sorted(codes)
+    buzzers: list = [
+        SimulatedBuzzer(teams[i % len(teams)], codes[teams[i % len(teams)]],
+                        random.randint(-10**9, 10**9), args.rate, stats)
+        for i in range(args.clients)
+    ]
+    if args.udp:
+        runs = [buzzer.run_udp(args.host, args.udp_port, args.duration) for buzzer in buzzers]
+    else:
+        runs = [buzzer.run_websocket(args.host, args.port, args.duration) for buzzer in buzzers]
+    results: list = await asyncio.gather(*runs, return_exceptions=True)
+    failed: list = [result for result in results if isinstance(result, Exception)]
+    if failed:
+        print(f'{len(failed)} clients failed, e.g. {failed[0]!r}')
+
+
+def summary(name: str, values: list) -> str:
+    if not values:
+        return f'{name}: none'
+    return (f'{name}: p50 {np.percentile(values, 50):.2f} ms, '
+            f'p99 {np.percentile(values, 99):.2f} ms, max {max(values):.2f} ms')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--udp-port', type=int, default=8767)
+    parser.add_argument('--udp', action='store_true', help='use UDP instead of WebSocket')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=5, help='seconds of pressing')
+    parser.add_argument('--rate', type=float, default=1, help='presses per second of each client')
+    parser.add_argument('--config', default='config.ini', help='file with codes of teams')
+    parser.add_argument('--serve', action='store_true', help='start server in this process')
+    args = parser.parse_args()
+
+    server: NetworkBuzzerServer = None
+    presses: list = []
+    if args.serve:
+        codes: dict = {team: f'code{team}' for team in range(6)}
+        lock: threading.Lock = threading.Lock()
+
+        def on_press(press: BuzzerPress) -> None:
+            with lock:
+                presses.append(press)
+
+        server = NetworkBuzzerServer(codes, on_press, args.host, 0, 0)
+        server.start()
+        server.ready.wait()
+        args.port, args.udp_port = server.port, server.udp_port
+    else:
+        codes = read_codes(args.config)
+        if not codes:
+            parser.error(f'No team codes in {args.config}.')
+
+    stats: Stats = Stats()
+    started: float = time.perf_counter()
+    asyncio.run(run_clients(args, codes, stats))
+    elapsed: float = time.perf_counter() - started
+    if server:
+        server.stop()
+
+    print(f'{stats.connected} of {args.clients} clients connected, {stats.rejected} rejected, '
+          f'{len(stats.acks)} presses acknowledged in {elapsed:.1f} s.')
+    if server:
+        print(f'Server received {len(presses)} presses.')
+    print(summary('press to acknowledgement', stats.acks))
+    print(summary('clock offset error', stats.offset_errors))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+'''Replays game journal on headless engine, checking that scores match.
+
+Run from the main directory of the project:
+
+    python -m tools.replay cache/journal.jsonl --speed 10
+    python -m tools.replay cache/journal.jsonl --repeat 100 --write /tmp/load.jsonl
+
+Speed 0 replays as fast as possible. With --write, replayed events are
+journaled again, which measures throughput of the journal writer.
+'''
+import sys
+import time
+
+import argparse
+
+from buzzers import BuzzerPress
+from engine import (NEW_GAME, PAUSED, RESUMED, SCORED, SONG_STARTED, STOPPED,
+                    S_PAUSED, S_PLAYING, TEAM_GUESSING, GameEngine, VirtualClock)
+from journal import Journal, read, scoreboard
+
+
+def replay(records: list, engine: GameEngine, clock: VirtualClock, speed: float = 0) -> int:
+    '''Applies records to engine, returns number of applied records.'''
+    applied: int = 0
+    first: int = records[0].get('t', 0) if records else 0
+    started: float = time.perf_counter()
+    for record in records:
+        if speed:
+            # Waiting until record is due at given speed.
+            due: float = (record.get('t', first) - first) / 1e9 / speed
+            delay: float = due - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        clock.now = record.get('t', clock.now)
+        kind: str = record['kind']
+        if kind == SONG_STARTED:
+            engine.start_song(record['song'])
+        elif kind == PAUSED and engine.playback_state == S_PLAYING:
+            engine.pause()
+        elif kind == RESUMED and engine.playback_state == S_PAUSED:
+            engine.resume()
+        elif kind == STOPPED:
+            engine.stop()
+        elif kind == TEAM_GUESSING:
+            # Only the winning press is journaled, so it wins again.
+            engine.press(BuzzerPress(record['team'], clock.now, 'replay'))
+            engine.resolve(clock.now + engine.arbiter.tie_window_ns)
+        elif kind == SCORED:
+            engine.answer(record['correct'])
+        elif kind == NEW_GAME:
+            engine.new_game()
+        else:
+            continue
+        applied += 1
+    return applied
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('journal')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='how many times faster than the game, 0 for no waiting')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--teams', type=int, default=6)
+    parser.add_argument('--points-correct', type=int, default=1)
+    parser.add_argument('--points-incorrect', type=int, default=-1)
+    parser.add_argument('--write', help='journal replayed events to this file')
+    args = parser.parse_args()
+
+    started: float = time.perf_counter()
+    records: list = read(args.journal)
+    print(f'Read {len(records)} records in {(time.perf_counter() - started) * 1000:.1f} ms.')
+    expected: list = scoreboard(records, args.teams)
+
+    journal: Journal = Journal(args.write) if args.write else None
+    applied: int = 0
+    matched: bool = True
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        clock: VirtualClock = VirtualClock()
+        engine: GameEngine = GameEngine(
+            args.teams, 30, args.points_correct, args.points_incorrect, time_ns=clock)
+        if journal:
+            engine.subscribe(journal.record_event)
+        applied += replay(records, engine, clock, args.speed)
+        matched = matched and engine.team_scores == expected
+    if journal:
+        journal.close()
+    elapsed: float = time.perf_counter() - started
+
+    print(f'Replayed {applied} records in {elapsed * 1000:.1f} ms, '
+          f'{applied / elapsed:,.0f} records per second'
+          + (f', {journal.commits} journal syncs.' if journal else '.'))
+    print(f'Scores: {engine.team_scores}' if args.repeat else 'Nothing replayed.')
+    if not matched:
+        print(f'Scores differ from journal: {expected}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,520 @@
+'''Plays whole tournaments through the window on virtual clock, checking game rules.
+
+Run from the main directory of the project:
+
+    python -m tools.simulate --rounds 500 --teams 30
+    python -m tools.simulate --spotify --record /tmp/session.jsonl
+    python -m tools.simulate --replay /tmp/session.jsonl
+
+Host and teams are simulated by seeded random generator and drive handlers
+of the window, so no real time passes between their actions. Songs, audio
+output and Spotify are synthetic. Timers of the window are fired by the
+simulation at their virtual deadlines. Every event is checked against rules
+of the game and window is checked against state of the engine after every
+step. Recorded session is replayed with the same actions at the same
+virtual moments and must produce the same events. Exits with status 1 if
+any rule was broken or replay differs from recording.
+'''
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import contextlib
+from collections import Counter
+
+import argparse
+
+from tools.benchmark import PROJECT, prepare_directory
+
+from PyQt5.QtWidgets import QApplication
+
+from buzzers import BuzzerPress
+from engine import (NEW_GAME, PAUSED, RESUMED, SCORED, SONG_STARTED, STOPPED, S_PAUSED,
+                    S_PLAYING, S_STOPPED, TEAM_GUESSING, GameEvent, VirtualClock)
+from journal import event_record
+
+# Chance that host answers that the guess was correct.
+CORRECT_CHANCE = 0.3
+# Average seconds of the song before teams press.
+PRESS_SECONDS = 8
+# Chance that host pauses playing song, or that teams press after the song ended.
+PAUSE_CHANCE = 0.05
+LATE_PRESS_CHANCE = 0.05
+# Seconds between reply of Spotify and start of next track.
+SPOTIFY_LATENCY = 0.15
+# Broken rules printed in the report, all of them are counted.
+SHOWN_VIOLATIONS = 10
+
+
+class SyntheticSongs:
+    '''Endless queue of songs without audio.'''
+
+    def __init__(self) -> None:
+        self.taken: int = 0
+        self.played: int = 0
+
+    def __len__(self) -> int:
+        return sys.maxsize
+
+    def take(self) -> dict:
+        self.taken += 1
+        return {'name': f'Song {self.taken}', 'artist': 'Simulation', 'path': f'song{self.taken}.wav',
+                'hash': str(self.taken), 'sound': None}
+
+    def mark_played(self, song: dict) -> None:
+        self.played += 1
+
+
+class SyntheticOutput:
+    '''Audio output remembering what it plays instead of playing it.'''
+
+    buffer_ms: float = 256 / 44100 * 1000
+
+    def __init__(self) -> None:
+        self.state: int = S_STOPPED
+        self.volume: float = 1
+
+    def play(self, sound) -> None:
+        self.state, self.volume = S_PLAYING, 1
+
+    def silence(self) -> None:
+        self.volume = 0
+
+    def pause(self) -> None:
+        if self.state == S_PLAYING:
+            self.state = S_PAUSED
+
+    def unpause(self) -> None:
+        if self.state == S_PAUSED:
+            self.state, self.volume = S_PLAYING, 1
+
+    def stop(self) -> None:
+        self.state = S_STOPPED
+
+
+class SyntheticSpotify:
+    '''Spotify worker whose next track starts after fixed virtual delay.'''
+
+    def __init__(self, window, clock: VirtualClock, songs: SyntheticSongs) -> None:
+        self.window = window
+        self.clock: VirtualClock = clock
+        self.songs: SyntheticSongs = songs
+        self.paused: bool = True
+        self.pending_ns: int = None  # Moment when requested track starts.
+        self.requests: int = 0
+
+    def send(self, command: str) -> None:
+        from spotify_worker import NEXT, PAUSE
+        if command == PAUSE:
+            if self.paused:
+                return
+            self.paused = True
+            self.window.silencer.report(self.clock.now)
+        elif command == NEXT:
+            self.paused = False
+            self.pending_ns = self.clock.now + int(SPOTIFY_LATENCY * 1e9)
+        else:
+            self.paused = False
+        self.requests += 1
+
+    def deliver(self) -> None:
+        self.pending_ns = None
+        self.window.spotify_track.emit(self.songs.take())
+
+    def stop(self) -> None:
+        pass
+
+
+class RuleChecker:
+    '''Keeps its own model of the game from events and reports every broken rule.
+
+    Presses are reported to the checker before the window gets them, so it
+    knows which presses take part in each contest without asking arbiter.
+    '''
+
+    def __init__(self, window, clock: VirtualClock, lockout: bool) -> None:
+        self.window = window
+        self.clock: VirtualClock = clock
+        self.lockout: bool = lockout
+        self.tie_window_ns: int = window.engine.arbiter.tie_window_ns
+        self.state: int = S_STOPPED
+        self.guessing_team: int = None
+        self.scores: list = [0] * window.number_teams
+        self.locked_out: set = set()
+        self.contest: dict = {}  # Earliest press of each team in current contest.
+        self.violations: Counter = Counter()
+        self.examples: list = []
+
+    def violate(self, rule: str, detail: str = '') -> None:
+        self.violations[rule] += 1
+        if len(self.examples) < SHOWN_VIOLATIONS:
+            self.examples.append(f'{self.clock.now / 1e9:12.3f} s  {rule}{": " + detail if detail else ""}')
+
+    def pressed(self, press: BuzzerPress) -> None:
+        if self.guessing_team is None and press.team not in self.locked_out:
+            earlier: BuzzerPress = self.contest.get(press.team)
+            if earlier is None or press.timestamp_ns < earlier.timestamp_ns:
+                self.contest[press.team] = press
+
+    def __call__(self, event: GameEvent) -> None:
+        if event.kind == SONG_STARTED:
+            if self.state == S_PLAYING or self.guessing_team is not None:
+                self.violate('song started during round')
+            self.state = S_PLAYING
+            self.locked_out.clear()
+            self.contest.clear()
+        elif event.kind == PAUSED:
+            if self.state != S_PLAYING:
+                self.violate('paused song that was not playing')
+            self.state = S_PAUSED
+        elif event.kind == RESUMED:
+            if self.state != S_PAUSED or self.guessing_team is not None:
+                self.violate('resumed song that was not paused or while team is guessing')
+            self.state = S_PLAYING
+        elif event.kind == STOPPED:
+            if self.state == S_STOPPED:
+                self.violate('stopped song twice')
+            self.state = S_STOPPED
+        elif event.kind == TEAM_GUESSING:
+            self.check_winner(event)
+            self.guessing_team = event.team
+        elif event.kind == SCORED:
+            self.check_score(event)
+            self.guessing_team = None
+            self.contest.clear()
+        elif event.kind == NEW_GAME:
+            self.scores = [0] * len(self.scores)
+            self.guessing_team = None
+            self.locked_out.clear()
+            self.contest.clear()
+
+    def check_winner(self, event: GameEvent) -> None:
+        if self.guessing_team is not None:
+            self.violate('double winner', f'team {event.team} won while team {self.guessing_team} is guessing')
+        if event.team in self.locked_out:
+            self.violate('locked out team won', f'team {event.team}')
+        press: BuzzerPress = self.contest.get(event.team)
+        if press is None or event.press is None:
+            self.violate('winner did not press', f'team {event.team}')
+        else:
+            first: int = min(press.timestamp_ns for press in self.contest.values())
+            if press.timestamp_ns > first + self.tie_window_ns:
+                self.violate('winner pressed after tie window', f'team {event.team}')
+            if self.clock.now < first + self.tie_window_ns:
+                self.violate('contest resolved before end of tie window')
+
+    def check_score(self, event: GameEvent) -> None:
+        if self.guessing_team is None:
+            self.violate('scoring while not guessing', f'team {event.team}')
+        elif event.team != self.guessing_team:
+            self.violate('scored team is not guessing', f'team {event.team}, guessing {self.guessing_team}')
+        engine = self.window.engine
+        if event.points != (engine.points_correct if event.correct else engine.points_incorrect):
+            self.violate('wrong points', f'{event.points} for {"correct" if event.correct else "incorrect"} answer')
+        self.scores[event.team] += event.points
+        if event.score != self.scores[event.team]:
+            self.violate('score does not add up', f'team {event.team} has {event.score}, '
+                                                  f'expected {self.scores[event.team]}')
+            self.scores[event.team] = event.score
+        if not event.correct and self.lockout:
+            self.locked_out.add(event.team)
+
+    def check_window(self, spotify: SyntheticSpotify = None, output: SyntheticOutput = None) -> None:
+        '''Compares engine, window and audio with model after each step.'''
+        window = self.window
+        engine = window.engine
+        if engine.playback_state != self.state:
+            self.violate('engine state differs from events')
+        if engine.is_team_guessing != (self.guessing_team is not None) or \
+                engine.is_team_guessing and engine.guessing_team != self.guessing_team:
+            self.violate('guessing team differs from events')
+        if engine.team_scores != self.scores:
+            self.violate('scores differ from events')
+        if window.scoreboard.scores != engine.team_scores:
+            self.violate('scoreboard differs from scores')
+        if window.button_yes.isEnabled() != engine.is_team_guessing:
+            self.violate('answer buttons out of date')
+        waiting: bool = spotify is not None and spotify.pending_ns is not None
+        if not waiting and window.button_next.isEnabled() != engine.can_play_next:
+            self.violate('next button out of date')
+        if engine.is_team_guessing and window.label_team.text() != window.team_names[engine.guessing_team]:
+            self.violate('wrong team shown as guessing')
+        if engine.playback_state == S_PLAYING and engine.millis > engine.playback_time * 1000:
+            self.violate('song played past playback time', f'{engine.millis} ms')
+        if self.contest and self.guessing_team is None and \
+                self.clock.now > min(press.timestamp_ns for press in self.contest.values()) + self.tie_window_ns:
+            self.violate('contest not resolved after tie window')
+        if output is not None and output.state != engine.playback_state and \
+                not (output.state == S_STOPPED and engine.current_song is None):
+            self.violate('audio differs from playback state')
+        if output is not None and engine.playback_state == S_PLAYING and output.volume == 0 and \
+                not window.silencer.silenced:
+            self.violate('playing song is silent')
+        if spotify is not None and engine.playback_state != S_PLAYING and not spotify.paused and not waiting:
+            self.violate('Spotify plays while song is not playing')
+
+
+class Simulation:
+    '''Drives window with actions of host and teams, at virtual moments.'''
+
+    def __init__(self, window, clock: VirtualClock, settings: dict) -> None:
+        self.window = window
+        self.clock: VirtualClock = clock
+        self.settings: dict = settings
+        self.random: random.Random = random.Random(settings['seed'])
+        self.tie_window_ns: int = settings['tie_window_us'] * 1000
+        self.songs: SyntheticSongs = SyntheticSongs()
+        window.song_queue = self.songs
+        window.engine.song_source = self.songs.take
+        self.output: SyntheticOutput = None
+        self.spotify: SyntheticSpotify = None
+        if settings['spotify']:
+            self.spotify = SyntheticSpotify(window, clock, self.songs)
+            window.spotify_worker = self.spotify
+        else:
+            self.output = SyntheticOutput()
+            window.output = self.output
+        self.checker: RuleChecker = RuleChecker(window, clock, settings['lockout'])
+        window.engine.subscribe(self.checker)
+        window.engine.subscribe(self.record_event)
+        self.digest = hashlib.sha256()
+        self.events: int = 0
+        self.actions: list = []  # Applied actions, in order.
+        self.burst: list = []  # Presses of teams pressing at once, not yet applied.
+
+    def record_event(self, event: GameEvent) -> None:
+        record: dict = event_record(event)
+        record['t'] = self.clock.now
+        self.digest.update(json.dumps(record, sort_keys=True).encode())
+        self.events += 1
+
+    def next_timer(self) -> tuple:
+        '''Returns moment and handler of the earliest timer of the window, None if none runs.'''
+        engine = self.window.engine
+        timers: list = []
+        deadline: int = engine.arbitration_deadline()
+        if deadline is not None:
+            timers.append((deadline, self.window.resolve_presses))
+        if engine.playback_state == S_PLAYING:
+            timers.append((self.clock.now + engine.remaining_ms() * 1_000_000, self.window.playback_time_over))
+        if self.spotify and self.spotify.pending_ns is not None:
+            timers.append((self.spotify.pending_ns, self.spotify.deliver))
+        return min(timers, key=lambda timer: timer[0]) if timers else None
+
+    def advance(self, until: int = None) -> bool:
+        '''Fires earliest timer due until given moment and returns True, or moves clock there.'''
+        timer: tuple = self.next_timer()
+        if timer is not None and (until is None or timer[0] <= until):
+            self.clock.now = max(self.clock.now, timer[0])
+            timer[1]()
+            self.step()
+            return True
+        if until is not None:
+            self.clock.now = max(self.clock.now, until)
+        return False
+
+    def step(self) -> None:
+        if self.window.engine.playback_state == S_PLAYING:
+            # Frame of the progress bar.
+            self.window.update_song()
+        self.checker.check_window(self.spotify, self.output)
+
+    def apply(self, action: dict) -> None:
+        window = self.window
+        kind: str = action['action']
+        if kind == 'next':
+            window.next_playback()
+        elif kind == 'press':
+            press: BuzzerPress = BuzzerPress(action['team'], self.clock.now, action['source'])
+            self.checker.pressed(press)
+            if press.source == 'keyboard':
+                window.team_pressed(press)
+            else:
+                window.submit_press(press)
+        elif kind == 'answer':
+            if action['correct']:
+                window.answer_correct()
+            else:
+                window.answer_incorrect()
+        elif kind == 'pause_resume':
+            window.pause_resume()
+        self.actions.append(action)
+        self.step()
+
+    def seconds(self, low: float, high: float) -> int:
+        return self.clock.now + int(self.random.uniform(low, high) * 1e9)
+
+    def press_burst(self, start: int) -> list:
+        '''Returns presses of teams pressing at about the same moment, often exactly tied.'''
+        teams: int = self.window.number_teams
+        presses: list = []
+        for _ in range(self.random.choice((1, 1, 2, 3, 4))):
+            offset: int = self.random.choice((0, self.random.randrange(2 * self.tie_window_ns + 1)))
+            presses.append({'t': start + offset, 'action': 'press', 'team': self.random.randrange(teams),
+                            'source': self.random.choice(('keyboard', 'serial'))})
+        return sorted(presses, key=lambda press: press['t'])
+
+    def choose(self) -> dict:
+        '''Returns next action of host or teams, None when the tournament is over.'''
+        if self.burst:
+            return self.burst.pop(0)
+        engine = self.window.engine
+        if engine.is_team_guessing:
+            return {'t': self.seconds(1, 5), 'action': 'answer',
+                    'correct': self.random.random() < CORRECT_CHANCE}
+        if engine.playback_state == S_PLAYING:
+            if self.random.random() < PAUSE_CHANCE:
+                return {'t': self.seconds(0.5, 10), 'action': 'pause_resume'}
+            self.burst = self.press_burst(
+                self.clock.now + int(self.random.expovariate(1 / PRESS_SECONDS) * 1e9))
+            return self.burst.pop(0)
+        if engine.playback_state == S_PAUSED:
+            return {'t': self.seconds(0.3, 2), 'action': 'pause_resume'}
+        if self.spotify and self.spotify.pending_ns is not None:
+            return None
+        if engine.songs_played >= self.settings['rounds']:
+            return None
+        if engine.songs_played and self.random.random() < LATE_PRESS_CHANCE:
+            self.burst = self.press_burst(self.seconds(0, 1))
+            return self.burst.pop(0)
+        return {'t': self.seconds(0.5, 3), 'action': 'next'}
+
+    def play(self) -> None:
+        '''Plays the tournament, actions are chosen at random.'''
+        while True:
+            action: dict = self.choose()
+            if self.advance(action['t'] if action else None):
+                # Timer changed the game before the action, so it's chosen again.
+                self.burst.clear()
+                continue
+            if action is None:
+                break
+            self.apply(action)
+
+    def replay(self, actions: list) -> None:
+        '''Plays the tournament with recorded actions.'''
+        for action in actions:
+            while self.advance(action['t']):
+                pass
+            self.apply(action)
+        while self.advance():
+            pass
+
+
+def read_session(path: str) -> tuple:
+    '''Returns settings, actions and result of recorded session.'''
+    with open(path, encoding='UTF-8') as file:
+        records: list = [json.loads(line) for line in file if line.strip()]
+    return records[0], records[1:-1], records[-1]
+
+
+def write_session(path: str, settings: dict, actions: list, result: dict) -> None:
+    with open(path, 'w', encoding='UTF-8') as file:
+        for record in [settings] + actions + [result]:
+            file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+
+def simulate(settings: dict, actions: list = None) -> tuple:
+    '''Plays tournament in new window, returns simulation and seconds it took.'''
+    import main
+    directory: str = prepare_directory(
+        {'use_spotify': int(settings['spotify']), 'songs_directory': '', 'instrumentation': 0},
+        {'playback_time': settings['playback_time'], 'number_teams': settings['teams'],
+         'points_correct': settings['points_correct'], 'points_incorrect': settings['points_incorrect'],
+         'tie_window_us': settings['tie_window_us'], 'lockout_incorrect': int(settings['lockout']),
+         'loud_snippets': 0})
+    os.chdir(directory)
+    clock: VirtualClock = VirtualClock()
+    # Window prints every Spotify song.
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Event loop never runs, so subsystems started by it stay off.
+        window = main.Ui(time_ns=clock)
+        simulation: Simulation = Simulation(window, clock, settings)
+        try:
+            started: float = time.perf_counter()
+            if actions is None:
+                simulation.play()
+            else:
+                simulation.replay(actions)
+            elapsed: float = time.perf_counter() - started
+        finally:
+            window.close()
+            os.chdir(PROJECT)
+            shutil.rmtree(directory)
+    return simulation, elapsed
+
+
+def report(simulation: Simulation, elapsed: float) -> None:
+    engine = simulation.window.engine
+    game_seconds: float = simulation.clock.now / 1e9
+    print(f'Simulated {engine.songs_played} rounds of {engine.number_teams} teams: '
+          f'{game_seconds / 3600:.1f} h of game in {elapsed:.2f} s, '
+          f'{game_seconds / elapsed:,.0f} times real time.')
+    print(f'{len(simulation.actions)} actions, {simulation.events} events, '
+          f'{len(simulation.actions) / elapsed:,.0f} actions and '
+          f'{simulation.events / elapsed:,.0f} events per second.')
+    if simulation.spotify:
+        print(f'{simulation.spotify.requests} Spotify requests.')
+    print(f'Scores: {engine.team_scores}')
+    checker: RuleChecker = simulation.checker
+    if checker.violations:
+        print(f'{sum(checker.violations.values())} broken rules:')
+        for rule, count in checker.violations.most_common():
+            print(f'  {rule}: {count}')
+        print('First of them:')
+        for example in checker.examples:
+            print(f'  {example}')
+    else:
+        print('No rules were broken.')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=500)
+    parser.add_argument('--teams', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--playback-time', type=int, default=30)
+    parser.add_argument('--points-correct', type=int, default=1)
+    parser.add_argument('--points-incorrect', type=int, default=-1)
+    parser.add_argument('--tie-window-us', type=int, default=2000)
+    parser.add_argument('--no-lockout', action='store_true')
+    parser.add_argument('--spotify', action='store_true', help='play synthetic Spotify instead of local songs')
+    parser.add_argument('--record', help='write actions and result of the session to this file')
+    parser.add_argument('--replay', help='replay session recorded with --record')
+    args = parser.parse_args()
+
+    app: QApplication = QApplication.instance() or QApplication(sys.argv)
+    if args.replay:
+        settings, actions, recorded = read_session(args.replay)
+    else:
+        settings = {'seed': args.seed, 'rounds': args.rounds, 'teams': args.teams,
+                    'playback_time': args.playback_time, 'points_correct': args.points_correct,
+                    'points_incorrect': args.points_incorrect, 'tie_window_us': args.tie_window_us,
+                    'lockout': not args.no_lockout, 'spotify': args.spotify}
+        actions, recorded = None, None
+
+    simulation, elapsed = simulate(settings, actions)
+    report(simulation, elapsed)
+    result: dict = {'digest': simulation.digest.hexdigest(), 'events': simulation.events,
+                    'scores': simulation.window.engine.team_scores}
+    failed: bool = bool(simulation.checker.violations)
+    if recorded is not None:
+        if result == recorded:
+            print(f'Replay matches recording, digest {result["digest"][:16]}.')
+        else:
+            print(f'Replay differs from recording: {recorded["events"]} events recorded, '
+                  f'{result["events"]} replayed, scores {recorded["scores"]}.')
+            failed = True
+    if args.record:
+        write_session(args.record, settings, simulation.actions, result)
+        print(f'Recorded {len(simulation.actions)} actions to {args.record}.')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import struct
+import selectors
+import threading
+
+# Logging
+import logging as l
+
+from typing import Callable
+
+from library import walk
+
+# Changes are reported once no new change came for this long, so a copied album is applied at once.
+DEBOUNCE = 0.2
+# Interval of comparing directory snapshots where inotify isn't available.
+POLL_INTERVAL = 5
+
+# Flags of inotify events, see inotify(7).
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# Files are reported once they are written, not when they are created.
+WATCHED = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+           | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    '''Recursive inotify watch of a directory, called through libc.'''
+
+    def __init__(self, directory: str) -> None:
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is available only on Linux')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd: int = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directory: str = directory
+        self.paths: dict = {}  # Watched directory of each watch descriptor.
+        self.watches: dict = {}  # Watch descriptor of each watched directory.
+        self.add_tree(directory)
+
+    def add(self, path: str) -> None:
+        wd: int = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCHED)
+        if wd < 0:
+            error: int = ctypes.get_errno()
+            if path == self.directory:
+                os.close(self.fd)
+                raise OSError(error, f'Watching {path} failed: {os.strerror(error)}')
+            # Directory could be removed in the meantime, it's reported by its parent.
+            l.warning(f'Watching {path} failed: {os.strerror(error)}')
+            return
+        self.paths[wd] = path
+        self.watches[path] = wd
+
+    def add_tree(self, directory: str) -> None:
+        '''Watches directory and all its subdirectories.'''
+        stack: list = [directory]
+        while stack:
+            path: str = stack.pop()
+            self.add(path)
+            try:
+                with os.scandir(path) as entries:
+                    stack += [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+            except OSError as e:
+                l.error(f'Reading directory failed: {e}')
+
+    def remove_tree(self, directory: str) -> None:
+        '''Stops watching directory moved out of watched tree.'''
+        prefix: str = os.path.join(directory, '')
+        for path in [path for path in self.watches if path == directory or path.startswith(prefix)]:
+            wd: int = self.watches.pop(path)
+            del self.paths[wd]
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self) -> set:
+        '''Returns paths changed by pending events.'''
+        try:
+            data: bytes = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed: set = set()
+        offset: int = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name: bytes = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, whole directory has to be scanned.
+                changed.add(self.directory)
+                continue
+            if mask & IN_IGNORED:
+                path = self.paths.pop(wd, None)
+                if path is not None and self.watches.get(path) == wd:
+                    del self.watches[path]
+                continue
+            directory: str = self.paths.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if directory == self.directory:
+                    changed.add(directory)
+                continue
+            path: str = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(path)
+                elif mask & IN_MOVED_FROM:
+                    self.remove_tree(path)
+            elif mask & IN_CREATE:
+                # File is reported once it's written.
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class LibraryWatcher(threading.Thread):
+    '''Reports files added, changed, removed or renamed in songs directory.
+
+    Uses inotify on Linux, so changes are reported right after they settle,
+    and compares snapshots of directory every POLL_INTERVAL elsewhere.
+    Bursts of changes are reported together once DEBOUNCE passes without
+    any new one. Callback gets paths of changed files and directories,
+    it's called from watcher thread.
+    '''
+
+    def __init__(self, directory: str, callback: Callable[[list], None], poll: bool = False) -> None:
+        super().__init__(name='LibraryWatcher', daemon=True)
+        self.directory: str = os.path.abspath(directory)
+        self.callback: Callable[[list], None] = callback
+        self.poll: bool = poll
+        self.selector: selectors.BaseSelector = selectors.DefaultSelector()
+        # Pipe waking the thread when it's stopped.
+        self.wake_read, self.wake_write = os.pipe()
+        self.selector.register(self.wake_read, selectors.EVENT_READ)
+        self.stopped: bool = False
+        # Thread may finish and close the pipe while it's being woken.
+        self.lock: threading.Lock = threading.Lock()
+        self.closed: bool = False
+
+    def stop(self) -> None:
+        self.stopped = True
+        if self.ident is None:
+            self.close()
+            return
+        with self.lock:
+            if not self.closed:
+                os.write(self.wake_write, b'\0')
+        self.join(1)
+
+    def close(self) -> None:
+        with self.lock:
+            if not self.closed:
+                self.selector.close()
+                os.close(self.wake_read)
+                os.close(self.wake_write)
+                self.closed = True
+
+    def run(self) -> None:
+        inotify: Inotify = None
+        if not self.poll:
+            try:
+                inotify = Inotify(self.directory)
+            except (OSError, AttributeError) as e:
+                l.warning(f'Falling back to polling {self.directory}: {e}')
+        if inotify:
+            l.info(f'Watching {self.directory} with inotify.')
+            self.watch(inotify)
+            inotify.close()
+        else:
+            self.poll_snapshots()
+        self.close()
+
+    def watch(self, inotify: Inotify) -> None:
+        self.selector.register(inotify.fd, selectors.EVENT_READ)
+        changed: set = set()
+        deadline: float = None
+        while not self.stopped:
+            timeout: float = None if deadline is None else max(0, deadline - time.monotonic())
+            events: list = self.selector.select(timeout)
+            if any(key.fd == inotify.fd for key, _ in events):
+                new: set = inotify.read()
+                if new:
+                    changed |= new
+                    deadline = time.monotonic() + DEBOUNCE
+            if deadline is not None and time.monotonic() >= deadline and not self.stopped:
+                self.callback(sorted(changed))
+                changed, deadline = set(), None
+        self.selector.unregister(inotify.fd)
+
+    def snapshot(self) -> dict:
+        return {path: (mtime, size) for path, mtime, size in walk(self.directory)}
+
+    def poll_snapshots(self) -> None:
+        '''Compares snapshots, changes are reported once snapshot stops changing.'''
+        l.info(f'Watching {self.directory} every {POLL_INTERVAL} s.')
+        reported: dict = self.snapshot()  # Snapshot of last reported state.
+        last: dict = reported
+        while not self.stopped:
+            if self.selector.select(POLL_INTERVAL):
+                break
+            current: dict = self.snapshot()
+            if current != last:
+                # Files may be still copied, changes are reported at next poll.
+                last = current
+                continue
+            if current != reported:
+                changed: set = {path for path in current.keys() | reported.keys()
+                                if current.get(path) != reported.get(path)}
+                self.callback(sorted(changed))
+                reported = current